@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+View-counter throughput benchmark.
+
+Imports the app once, forks several worker processes and has every worker
+open the same clip through the real view_clip route, first with counters
+written through to the store on every view (CONNECTRA_COUNTER_FLUSH_INTERVAL=0,
+the old behaviour) and then with the write-coalescing CounterBuffer. Prints
+views per second for both and checks afterwards that every view reached the
+store. ``--counter-only`` calls main.count() directly instead of going
+through the route, which leaves out template rendering.
+
+Usage:
+    python benchmarks/counters_bench.py --workers 4 --views 2000
+    CONNECTRA_STORAGE=sqlite python benchmarks/counters_bench.py
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+from stress_storage import CLIP_ID, prepare_database  # noqa: E402
+
+
+def worker(views, threads, counter_only):
+    import main
+    sys.stdout = open(os.devnull, 'w')
+
+    def view(_):
+        if counter_only:
+            with main.app.app_context():
+                main.count(('clips', CLIP_ID, 'views'), 0)
+            return 200
+        return main.app.test_client().get(f"/clips/{CLIP_ID}").status_code
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(view, range(views)))
+    main.counters.flush()
+    os._exit(0 if all(status == 200 for status in statuses) else 1)
+
+
+def run(ctx, workers, views, threads, counter_only):
+    procs = [ctx.Process(target=worker, args=(views, threads, counter_only)) for _ in range(workers)]
+    started = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    return time.perf_counter() - started, [p.exitcode for p in procs if p.exitcode]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=max(2, multiprocessing.cpu_count()))
+    parser.add_argument('--views', type=int, default=1000, help='views per worker')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent requests per worker')
+    parser.add_argument('--counter-only', action='store_true', help='time main.count() without the route')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='connectra-counters-')
+    prepare_database(workdir, 0)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    if os.environ.get('CONNECTRA_STORAGE', 'json').lower() == 'sqlite':
+        subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'storage.py'), 'migrate'], check=True)
+
+    import main as app_module  # preload before forking, as gunicorn does
+
+    ctx = multiprocessing.get_context('fork')
+    total = args.workers * args.views
+    print(f"backend={app_module.STORAGE_BACKEND} workers={args.workers} views={total}"
+          f"{' (counter only)' if args.counter_only else ''}")
+    expected = 0
+    failed = False
+    for name, interval in (('write-through', 0), ('buffered', 1.0)):
+        app_module.counters.interval = interval
+        elapsed, failures = run(ctx, args.workers, args.views, args.threads, args.counter_only)
+        expected += total
+        stored = app_module.store.get('clips', CLIP_ID, shallow=True)['views']
+        ok = stored == expected and not failures
+        failed = failed or not ok
+        print(f"  {name:<14}{total / elapsed:>10.0f} views/s   stored={stored} expected={expected} {'OK' if ok else 'MISMATCH'}")
+    app_module.store.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
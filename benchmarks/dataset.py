@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Synthetic Connectra database generator.
+
+Writes a ``database/userbase.json`` shaped like the real one at any scale:
+users (password "password"), a follow graph where a few accounts are much
+more popular than the rest, direct chats, a busy global chat with @mentions,
+emoji and markdown, clips with likes and comment threads, and blogs. The
+follow lists sit on the user records the way older databases had them, so
+the app imports them into its social graph on first start.
+
+The output is deterministic for a given --seed. ``loadtest.py`` uses
+``generate`` and ``write`` directly; on its own the script writes a directory
+the app can be started in:
+
+Usage:
+    python benchmarks/dataset.py --out /tmp/connectra-data --users 10000
+    python benchmarks/dataset.py --out /tmp/big --users 100000 --global-messages 500000 --sqlite
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'password'
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Chris', 'Maria', 'David', 'Sarah', 'Mike', 'Emma', 'Noah', 'Olivia',
+               'Liam', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Zoe', 'Pierce', 'Nina']
+LAST_NAMES = ['Smith', 'Lee', 'Garcia', 'Brown', 'Dolan', 'Nguyen', 'Martin', 'Clark', 'Lopez', 'Young', 'King', 'Scott']
+WORDS = ('hey what is up did you see the new clip lol that was so good see you at practice tomorrow who is coming '
+         'tonight game score chat video music school weekend pizza movie stream post blog thanks nice cool').split()
+EMOJI = ['🎉', '😂', '🔥', '👍', '❤️', '😎', '🚀']
+START = datetime(2025, 1, 1)
+
+
+def hash_pw(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def sentence(rng, usernames, mention_rate=0.05):
+    """Chat-like text with occasional mentions, emoji and markdown; returns (text, mentioned usernames)"""
+    words, mentions = [], []
+    for _ in range(rng.randint(2, 18)):
+        roll = rng.random()
+        if roll < mention_rate:
+            mentions.append(rng.choice(usernames))
+            words.append(f"@{mentions[-1]}")
+        elif roll < mention_rate + 0.04:
+            words.append(rng.choice(EMOJI))
+        elif roll < mention_rate + 0.06:
+            words.append(f"**{rng.choice(WORDS)}**")
+        else:
+            words.append(rng.choice(WORDS))
+    return ' '.join(words), mentions
+
+
+def render_mentions(text, mentions):
+    """The stored form of a message: mentions wrapped the way process_mentions does it"""
+    for username in set(mentions):
+        text = text.replace(f"@{username}", f'<span class="mention" data-user="{username}">@{username}</span>')
+    return text
+
+
+def timestamps(rng, count, days=180):
+    """``count`` increasing ISO timestamps spread over ``days``"""
+    offsets = sorted(rng.random() * days * 86400 for _ in range(count))
+    return [(START + timedelta(seconds=offset)).isoformat() for offset in offsets]
+
+
+def message(rng, author, usernames, timestamp, mention_rate=0.05):
+    text, mentions = sentence(rng, usernames, mention_rate)
+    return {
+        'id': f"m{rng.getrandbits(64):016x}", 'user_id': author, 'username': author,
+        'content': render_mentions(text, mentions), 'raw_content': text, 'mentions': sorted(set(mentions)),
+        'timestamp': timestamp, 'type': 'text', 'attachments': []
+    }
+
+
+def generate(users=1000, follows=20, dms=2000, dm_messages=20, global_messages=20000, clips=500, comments=8,
+             blogs=100, seed=1):
+    """Build the database dict. ``follows``, ``dm_messages`` and ``comments`` are averages."""
+    rng = random.Random(seed)
+    usernames = [f"user{i}" for i in range(users)]
+    # Popularity falls off like a power law: user0 is followed, liked and DMed far more than user999
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(users)))
+
+    def popular(k):
+        return rng.choices(usernames, cum_weights=cum_weights, k=k)
+
+    records = {}
+    for i, username in enumerate(usernames):
+        records[username] = {
+            'id': username, 'username': username, 'email': f"{username}@example.com", 'password': hash_pw(PASSWORD),
+            'display_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", 'photo': None, 'avatar': None,
+            'online': False, 'bio': ' '.join(rng.choices(WORDS, k=rng.randint(0, 8))),
+            'followers': [], 'following': [], 'clips_liked': [], 'clips_shared': []
+        }
+    for username in usernames:
+        targets = {target for target in popular(int(rng.expovariate(1 / follows)) if follows else 0) if target != username}
+        for target in sorted(targets):
+            records[username]['following'].append(target)
+            records[target]['followers'].append(username)
+
+    chats = [{'id': 'global', 'name': 'Global Chat', 'type': 'public', 'participants': [], 'messages': []}]
+    for timestamp in timestamps(rng, global_messages):
+        chats[0]['messages'].append(message(rng, rng.choice(usernames), usernames, timestamp))
+    pairs = set()
+    while len(pairs) < min(dms, users * (users - 1) // 2):
+        a, b = rng.choice(usernames), popular(1)[0]
+        if a != b:
+            pairs.add(tuple(sorted((a, b))))
+    for a, b in sorted(pairs):
+        stamps = timestamps(rng, max(1, int(rng.expovariate(1 / dm_messages)))) if dm_messages else []
+        chats.append({
+            'id': f"dm_{a}_{b}", 'name': f"DM: {a} & {b}", 'type': 'direct', 'participants': [a, b],
+            'messages': [message(rng, rng.choice((a, b)), [a, b], stamp, mention_rate=0) for stamp in stamps],
+            'created_at': stamps[0] if stamps else START.isoformat()
+        })
+
+    clip_list = []
+    for n, created_at in enumerate(timestamps(rng, clips)):
+        clip_id = f"clip{n:06d}"
+        author = popular(1)[0]
+        liked_by = sorted(set(popular(int(rng.expovariate(1 / 30)))))
+        for username in liked_by:
+            records[username]['clips_liked'].append(clip_id)
+        clip_comments = []
+        for stamp in sorted(timestamps(rng, int(rng.expovariate(1 / comments)) if comments else 0)):
+            text, _ = sentence(rng, usernames, mention_rate=0)
+            comment_likes = sorted(set(popular(rng.randint(0, 3))))
+            clip_comments.append({'id': f"c{rng.getrandbits(64):016x}", 'author': rng.choice(usernames), 'content': text,
+                                  'created_at': max(stamp, created_at), 'likes': len(comment_likes), 'liked_by': comment_likes})
+        clip_list.append({
+            'id': clip_id, 'title': ' '.join(rng.choices(WORDS, k=3)).title(), 'description': sentence(rng, usernames, 0)[0],
+            'video_filename': f"{clip_id}.mp4", 'thumbnail': None, 'rendition': None, 'author': author,
+            'created_at': created_at, 'views': len(liked_by) * rng.randint(3, 40), 'likes': len(liked_by),
+            'liked_by': liked_by, 'shares': rng.randint(0, len(liked_by) // 3 + 1), 'comments': clip_comments,
+            'duration': rng.randint(5, 60), 'width': 1280, 'height': 720, 'size': rng.randint(10 ** 6, 5 * 10 ** 7),
+            'status': 'ready', 'media_status': 'done'
+        })
+
+    blog_list = [{
+        'id': f"blog{n:05d}", 'title': ' '.join(rng.choices(WORDS, k=5)).title(),
+        'content': '\n\n'.join(sentence(rng, usernames, 0)[0] for _ in range(rng.randint(2, 10))),
+        'author': popular(1)[0], 'created_at': stamp, 'updated_at': stamp
+    } for n, stamp in enumerate(timestamps(rng, blogs))]
+
+    return {'users': list(records.values()), 'chats': chats, 'clips': clip_list, 'blogs': blog_list}
+
+
+def write(data, directory, sqlite=False):
+    """Write ``data`` as ``<directory>/database/userbase.json`` (and import it into SQLite if asked)"""
+    database = os.path.join(directory, 'database')
+    os.makedirs(database, exist_ok=True)
+    path = os.path.join(database, 'userbase.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    if sqlite:
+        subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'storage.py'), 'migrate'], cwd=directory, check=True,
+                       stdout=subprocess.DEVNULL)
+    return path
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=20, help='average follows per user')
+    parser.add_argument('--dms', type=int, default=2000, help='direct chats')
+    parser.add_argument('--dm-messages', type=int, default=20, help='average messages per direct chat')
+    parser.add_argument('--global-messages', type=int, default=20000)
+    parser.add_argument('--clips', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=8, help='average comments per clip')
+    parser.add_argument('--blogs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def generate_from_args(args):
+    return generate(users=args.users, follows=args.follows, dms=args.dms, dm_messages=args.dm_messages,
+                    global_messages=args.global_messages, clips=args.clips, comments=args.comments,
+                    blogs=args.blogs, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='directory to create database/ in')
+    parser.add_argument('--sqlite', action='store_true', help='also import it into database/connectra.db')
+    add_arguments(parser)
+    args = parser.parse_args()
+    data = generate_from_args(args)
+    path = write(data, args.out, sqlite=args.sqlite)
+    messages = sum(len(chat['messages']) for chat in data['chats'])
+    follows = sum(len(user['following']) for user in data['users'])
+    comments = sum(len(clip['comments']) for clip in data['clips'])
+    print(f"wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB): {len(data['users'])} users, {follows} follows, "
+          f"{len(data['chats'])} chats, {messages} messages, {len(data['clips'])} clips, {comments} comments, "
+          f"{len(data['blogs'])} blogs")
+
+
+if __name__ == '__main__':
+    main()
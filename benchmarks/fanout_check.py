@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Multi-worker Socket.IO fan-out check.
+
+Starts the IPC broker from fanout.py and several eventlet Socket.IO worker
+processes that share it, spreads clients across the workers, joins most of
+them to one room and has every worker emit a burst of events to that room.
+Every room member must receive every event exactly once, and the client
+outside the room must receive none.
+
+Clients use the websocket transport, so the ``websocket-client`` package
+must be installed.
+
+Usage:
+    python benchmarks/fanout_check.py --workers 4 --clients 12 --emits 50
+    python benchmarks/fanout_check.py --queue redis://localhost:6379/0
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOM = 'fanout-room'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port, queue, worker_index):
+    import eventlet
+    eventlet.monkey_patch()
+    sys.path.insert(0, REPO_ROOT)
+    import socketio
+    from fanout import socketio_options
+
+    options = socketio_options(queue)
+    if 'message_queue' in options:
+        options = {'client_manager': socketio.RedisManager(options['message_queue'])}
+    sio = socketio.Server(async_mode='eventlet', **options)
+
+    @sio.on('join')
+    def join(sid, data):
+        sio.enter_room(sid, data['room'])
+        return True
+
+    @sio.on('fire')
+    def fire(sid, data):
+        for n in range(data['count']):
+            sio.emit('tick', {'worker': worker_index, 'n': n}, room=ROOM)
+        return True
+
+    eventlet.wsgi.server(eventlet.listen(('127.0.0.1', port)), socketio.WSGIApp(sio), log_output=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=12, help='room members, spread over the workers')
+    parser.add_argument('--emits', type=int, default=50, help='events each worker sends to the room')
+    parser.add_argument('--queue', default='', help='queue URL (default: a private ipc:// broker)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    import socketio
+
+    broker = None
+    queue = args.queue
+    if not queue:
+        path = os.path.join(tempfile.mkdtemp(prefix='connectra-fanout-'), 'broker.sock')
+        broker = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'fanout.py'), path])
+        while not os.path.exists(path):
+            time.sleep(0.05)
+        queue = f"ipc://{path}"
+
+    ctx = multiprocessing.get_context('spawn')
+    ports = [free_port() for _ in range(args.workers)]
+    workers = [ctx.Process(target=serve, args=(port, queue, i), daemon=True) for i, port in enumerate(ports)]
+    for proc in workers:
+        proc.start()
+
+    received = collections.defaultdict(collections.Counter)
+    lock = threading.Lock()
+    clients = []
+
+    def make_client(name, port):
+        client = socketio.Client()
+
+        @client.on('tick')
+        def on_tick(data):
+            with lock:
+                received[name][(data['worker'], data['n'])] += 1
+
+        for _ in range(100):
+            try:
+                client.connect(f"http://127.0.0.1:{port}", transports=['websocket'])
+                return client
+            except socketio.exceptions.ConnectionError:
+                time.sleep(0.1)
+        raise RuntimeError(f"worker on port {port} did not come up")
+
+    try:
+        for i in range(args.clients):
+            client = make_client(f"member-{i}", ports[i % args.workers])
+            client.call('join', {'room': ROOM})
+            clients.append(client)
+        outsider = make_client('outsider', ports[0])
+        clients.append(outsider)
+        time.sleep(0.5)  # let every worker's listener attach to the queue
+
+        started = time.perf_counter()
+        for i in range(args.workers):
+            clients[i].call('fire', {'count': args.emits}, timeout=60)
+        expected = args.workers * args.emits
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            with lock:
+                if all(sum(received[f"member-{i}"].values()) >= expected for i in range(args.clients)):
+                    break
+            time.sleep(0.1)
+        time.sleep(0.5)  # catch any duplicates still in flight
+        elapsed = time.perf_counter() - started
+    finally:
+        for client in clients:
+            client.disconnect()
+        for proc in workers:
+            proc.terminate()
+        if broker:
+            broker.terminate()
+
+    failures = 0
+    wanted = {(w, n) for w in range(args.workers) for n in range(args.emits)}
+    for i in range(args.clients):
+        counts = received[f"member-{i}"]
+        missing = len(wanted - set(counts))
+        duplicated = sum(1 for c in counts.values() if c > 1)
+        if missing or duplicated:
+            failures += 1
+            print(f"  member-{i}: missing={missing} duplicated={duplicated}")
+    if received['outsider']:
+        failures += 1
+        print(f"  outsider received {sum(received['outsider'].values())} room events")
+    print(f"queue={queue.split('://')[0]} workers={args.workers} members={args.clients} "
+          f"emits={expected} deliveries={expected * args.clients} in {elapsed:.2f}s: "
+          f"{'OK, every member got every emit exactly once' if not failures else f'{failures} FAILED'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
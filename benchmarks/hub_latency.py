@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Socket.IO round-trip latency while the same worker is busy writing.
+
+Starts gunicorn (one eventlet worker by default) on a generated database
+twice: once with blocking I/O kept on the hub (CONNECTRA_IO_THREADS=0) and
+once offloaded to native threads (see offload.py). In each run --writers
+threads post chat messages as fast as the server takes them, with the JSON
+log compacted every --compact-every records so full snapshot writes happen
+throughout, while one Socket.IO client sends an acknowledged ``join_chat``
+every --ping-interval seconds and times the round trip. Any time the hub is
+blocked shows up directly in that latency.
+
+Prints the ping p50/p95/p99/max and the write rate for both runs; --save
+writes them as JSON.
+
+Usage:
+    python benchmarks/hub_latency.py
+    python benchmarks/hub_latency.py --users 5000 --global-messages 100000 --compact-every 1000
+    CONNECTRA_STORAGE=sqlite python benchmarks/hub_latency.py --workers 2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+import dataset
+from loadtest import free_port, percentile, start_server, stop_server
+
+
+def login(base_url, username):
+    http = requests.Session()
+    http.post(f"{base_url}/login", data={'email': f"{username}@example.com", 'password': dataset.PASSWORD})
+    return http
+
+
+def writer(base_url, username, stop, counts, lock):
+    http = None
+    n = 0
+    while not stop.is_set():
+        try:
+            if http is None:
+                http = login(base_url, username)
+            response = http.post(f"{base_url}/api/send_message", timeout=60,
+                                 data={'chat_id': 'global', 'content': f"hub latency write {n} @user0"})
+            outcome = 'ok' if response.status_code == 200 else 'failed'
+        except requests.RequestException:
+            # gunicorn restarts a worker whose hub stayed blocked past its timeout
+            outcome = 'failed'
+            http = None
+            time.sleep(0.5)
+        with lock:
+            counts[outcome] += 1
+        n += 1
+
+
+def ping(base_url, username, duration, interval, timeout):
+    """Acknowledged join_chat round trips in seconds, one every ``interval`` for ``duration``.
+
+    A ping that is not answered within ``timeout`` (or is cut off by a worker restart) counts as ``timeout``.
+    """
+    cookie = '; '.join(f"{name}={value}" for name, value in login(base_url, username).cookies.items())
+    samples, lost = [], 0
+    deadline = time.time() + duration
+    sio = None
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if sio is None:
+                sio = socketio.Client(reconnection=False)
+                sio.connect(base_url, headers={'Cookie': cookie}, transports=['websocket'], wait_timeout=timeout)
+            sio.call('join_chat', {'chat_id': 'global'}, timeout=timeout)
+            samples.append(time.perf_counter() - started)
+        except (socketio.exceptions.SocketIOError, OSError):
+            samples.append(max(timeout, time.perf_counter() - started))
+            lost += 1
+            if sio is not None:
+                sio.disconnect()
+            sio = None
+        time.sleep(max(0.0, interval - samples[-1]))
+    if sio is not None:
+        sio.disconnect()
+    return samples, lost
+
+
+def run(label, source, args, backend, io_threads):
+    workdir = tempfile.mkdtemp(prefix='connectra-hub-')
+    shutil.copytree(os.path.join(source, 'database'), os.path.join(workdir, 'database'))
+    port = free_port()
+    server = start_server(workdir, port, args.workers, backend, CONNECTRA_IO_THREADS=str(io_threads),
+                          CONNECTRA_WAL_COMPACT_EVERY=str(args.compact_every))
+    base_url = f"http://127.0.0.1:{port}"
+    stop = threading.Event()
+    counts, lock = {'ok': 0, 'failed': 0}, threading.Lock()
+    writers = [threading.Thread(target=writer, args=(base_url, f"user{i + 1}", stop, counts, lock), daemon=True)
+               for i in range(args.writers)]
+    try:
+        for thread in writers:
+            thread.start()
+        samples, lost = ping(base_url, 'user0', args.duration, args.ping_interval, args.ping_timeout)
+    finally:
+        stop.set()
+        for thread in writers:
+            thread.join(timeout=60)
+        stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {
+        'io_threads': io_threads, 'pings': len(samples), 'lost_pings': lost, 'writes_per_s': counts['ok'] / args.duration,
+        'failed_writes': counts['failed'], 'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000, 'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000 if samples else 0.0, 'mean_ms': statistics.fmean(samples) * 1000 if samples else 0.0,
+    }
+    print(f"  {label:<10} ping p50={result['p50_ms']:7.1f} ms p95={result['p95_ms']:7.1f} ms "
+          f"p99={result['p99_ms']:7.1f} ms max={result['max_ms']:7.1f} ms ({lost} lost)  "
+          f"writes {result['writes_per_s']:6.1f}/s ({result['failed_writes']} failed)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--writers', type=int, default=8, help='threads posting messages')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    parser.add_argument('--ping-interval', type=float, default=0.05)
+    parser.add_argument('--ping-timeout', type=float, default=10, help='seconds before a ping counts as lost')
+    parser.add_argument('--compact-every', type=int, default=500, help='JSON backend: log records per snapshot write')
+    parser.add_argument('--io-threads', type=int, default=8, help='CONNECTRA_IO_THREADS for the offloaded run')
+    parser.add_argument('--save', help='write both results to this JSON file')
+    dataset.add_arguments(parser)
+    parser.set_defaults(users=2000, global_messages=30000)
+    args = parser.parse_args()
+
+    backend = os.environ.get('CONNECTRA_STORAGE', 'json').lower()
+    source = tempfile.mkdtemp(prefix='connectra-hub-data-')
+    try:
+        path = dataset.write(dataset.generate_from_args(args), source, sqlite=backend == 'sqlite')
+        print(f"backend={backend} workers={args.workers} writers={args.writers} "
+              f"snapshot={os.path.getsize(path) / 1e6:.1f} MB compact_every={args.compact_every}")
+        results = {
+            'inline': run('inline', source, args, backend, 0),
+            'offloaded': run('offloaded', source, args, backend, args.io_threads),
+        }
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'backend': backend, 'config': vars(args), 'results': results}, f, indent=2)
+        print(f"saved {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Registration and login lookup benchmark for the user identity maps.
+
+Registers --users accounts the way /register does (email check, username from
+the email's local part made unique, insert, all in one store transaction),
+with local parts drawn from a small pool of common names so most usernames
+collide ("john", "john1", "john2", ...). After every --checkpoint accounts it
+prints the registration rate for that stretch and the latency of the login
+lookup (``find_user_by_email`` with an email in random case), which should stay
+flat as the user count grows. The old lookup (a scan of every user comparing
+lowercased emails) is timed on a few samples for comparison.
+
+On the JSON backend the registration rate also pays for folding the write-ahead
+log into the snapshot every --compact-every writes, which grows with the user
+count; pass a large value to time the identity maps alone.
+
+Usage:
+    python benchmarks/identity_bench.py --users 100000
+    CONNECTRA_STORAGE=sqlite python benchmarks/identity_bench.py --users 100000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from storage import open_store  # noqa: E402
+
+NAMES = ['john', 'jane', 'alex', 'sam', 'chris', 'maria', 'david', 'sarah', 'mike', 'emma',
+         'admin', 'info', 'test', 'hello', 'contact', 'user', 'dev', 'team', 'me', 'mail']
+DOMAINS = ['gmail.com', 'outlook.com', 'yahoo.com', 'icloud.com', 'proton.me', 'example.org']
+
+
+def register(store, email):
+    """The /register write path without Flask"""
+    with store.transaction():
+        if store.find_user_by_email(email):
+            return None
+        username = store.unique_username(email.split('@')[0])
+        store.insert('users', {
+            'id': username.lower().replace(' ', '_'), 'username': username, 'email': email,
+            'password': '', 'display_name': username, 'photo': None, 'avatar': None,
+            'online': False, 'bio': '', 'clips_liked': [], 'clips_shared': []
+        })
+        return username
+
+
+def legacy_find_user_by_email(users, email):
+    return next((u for u in users if u.get('email', '').lower() == email.lower()), None)
+
+
+def random_case(rng, text):
+    return ''.join(c.upper() if rng.random() < 0.3 else c for c in text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--checkpoint', type=int, default=10000, help='report every this many registrations')
+    parser.add_argument('--logins', type=int, default=2000, help='login lookups timed per checkpoint')
+    parser.add_argument('--legacy-logins', type=int, default=20, help='lookups timed with the old scan per checkpoint')
+    parser.add_argument('--compact-every', type=int, default=1000, help='JSON backend: log records per compaction')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    backend = os.environ.get('CONNECTRA_STORAGE', 'json').lower()
+    workdir = tempfile.mkdtemp(prefix='connectra-identity-')
+    options = {'compact_every': args.compact_every} if backend == 'json' else {}
+    store = open_store(backend, os.path.join(workdir, 'userbase.json'), os.path.join(workdir, 'connectra.db'), **options)
+    rng = random.Random(args.seed)
+    emails = []
+    print(f"backend={backend} users={args.users} names={len(NAMES)}")
+    try:
+        started = time.perf_counter()
+        while len(emails) < args.users:
+            # Same local part, different mail hosts: every new account collides on its base username
+            email = f"{rng.choice(NAMES)}@mx{len(emails)}.{rng.choice(DOMAINS)}"
+            if register(store, email):
+                emails.append(email)
+            if len(emails) % args.checkpoint and len(emails) != args.users:
+                continue
+            rate = args.checkpoint / (time.perf_counter() - started)
+            timings = []
+            for _ in range(args.logins):
+                email = random_case(rng, rng.choice(emails))
+                t = time.perf_counter()
+                assert store.find_user_by_email(email) is not None
+                timings.append((time.perf_counter() - t) * 1e6)
+            users = store.load()['users']
+            t = time.perf_counter()
+            for _ in range(args.legacy_logins):
+                legacy_find_user_by_email(users, random_case(rng, rng.choice(emails)))
+            legacy = (time.perf_counter() - t) * 1e6 / max(args.legacy_logins, 1)
+            print(f"  {len(emails):>8} users  register {rate:8.0f}/s  "
+                  f"login p50={statistics.median(timings):7.1f} us p95={sorted(timings)[int(len(timings) * 0.95)]:7.1f} us  "
+                  f"legacy scan {legacy:9.1f} us")
+            started = time.perf_counter()
+        assert register(store, emails[0].upper()) is None
+        print(f"  next usernames: {', '.join(store.unique_username(name) for name in NAMES[:3])}")
+    finally:
+        store.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: the real app under gunicorn, driven over HTTP and Socket.IO.
+
+Generates a database with dataset.py (or copies one made earlier with --data),
+starts gunicorn with the repo's gunicorn.conf.py in a scratch directory, and
+runs --concurrency virtual users for --duration seconds. Each virtual user
+logs in as a random generated user, opens a Socket.IO connection, joins the
+global chat and then loops over a weighted mix of the main flows:
+
+    login, home, send_message (global chat, with @mentions), open_dm
+    (create_dm + the DM page), like_clip, comment_clip, follow, view_clip
+
+plus two Socket.IO measurements: socketio_connect, and message_delivery (from
+sending a message to the sender's own socket receiving it from the room).
+
+Prints p50/p95/p99 latency and throughput per flow and the resident memory of
+the gunicorn processes (sampled from /proc). --save writes the results with
+the current git commit as a JSON baseline; --compare reads one and flags
+flows whose p95 or throughput got worse by more than --tolerance percent
+(exit status 1).
+
+Usage:
+    python benchmarks/loadtest.py --users 1000 --concurrency 20 --duration 30 --save before.json
+    python benchmarks/loadtest.py --users 1000 --concurrency 20 --duration 30 --compare before.json
+    CONNECTRA_STORAGE=sqlite python benchmarks/loadtest.py --workers 4
+    python benchmarks/dataset.py --out /tmp/big --users 100000 && python benchmarks/loadtest.py --data /tmp/big
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+import socketio
+
+import dataset
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative frequency of each flow in a virtual user's loop
+FLOW_WEIGHTS = {
+    'home': 3, 'send_message': 5, 'open_dm': 2, 'like_clip': 3, 'comment_clip': 1, 'follow': 1, 'view_clip': 3, 'login': 1,
+}
+DELIVERY_TIMEOUT = 5
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Server ---
+def start_server(workdir, port, workers, backend, **extra_env):
+    """gunicorn with the repo's config in ``workdir``, once it answers; ``extra_env`` adds CONNECTRA_* settings"""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, PORT=str(port), CONNECTRA_STORAGE=backend,
+               CONNECTRA_MEDIA_WORKER='false', CONNECTRA_SOCKETIO_QUEUE=f"ipc://{os.path.join(workdir, 'socketio.sock')}",
+               **extra_env)
+    if workers == 1:
+        env['CONNECTRA_SOCKETIO_QUEUE'] = ''
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'), '--workers', str(workers),
+         '--bind', f"127.0.0.1:{port}", '--pid', os.path.join(workdir, 'gunicorn.pid'), '--access-logfile', '/dev/null',
+         'wsgi:application'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {server.returncode}; see {log.name}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/", timeout=2).status_code == 200:
+                return server
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    stop_server(server)
+    raise SystemExit(f"gunicorn did not answer within 120s; see {log.name}")
+
+
+def stop_server(server):
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(server.pid, signal.SIGKILL)
+
+
+def process_tree_rss(root_pid):
+    """Resident memory in bytes of ``root_pid`` and its descendants (Linux /proc), and the process count"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, count, todo = 0, 0, [root_pid]
+    while todo:
+        pid = todo.pop()
+        todo.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                rss = next(line for line in f if line.startswith('VmRSS:'))
+            total += int(rss.split()[1]) * 1024
+            count += 1
+        except (OSError, StopIteration):
+            continue
+    return total, count
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid, self.interval = pid, interval
+        self.peak = self.last = self.processes = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not os.path.isdir('/proc'):
+            return
+        while not self.stopped.is_set():
+            self.last, self.processes = process_tree_rss(self.pid)
+            self.peak = max(self.peak, self.last)
+            self.stopped.wait(self.interval)
+
+
+# --- Virtual users ---
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.failures = {}
+
+    def record(self, flow, seconds, ok=True, reason=None):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(flow, []).append(seconds)
+            else:
+                self.errors[flow] = self.errors.get(flow, 0) + 1
+                key = f"{flow}: {reason}"
+                self.failures[key] = self.failures.get(key, 0) + 1
+
+
+class VirtualUser:
+    def __init__(self, base_url, data, results, rng):
+        self.base_url = base_url
+        self.results = results
+        self.rng = rng
+        self.usernames = [user['username'] for user in data['users']]
+        self.clip_ids = [clip['id'] for clip in data['clips']]
+        self.username = rng.choice(self.usernames)
+        self.http = requests.Session()
+        self.sio = None
+        self.pending = {}
+
+    def timed(self, flow, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=30, allow_redirects=False, **kwargs)
+            ok, reason = response.status_code < 400, f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            response, ok, reason = None, False, type(e).__name__
+        self.results.record(flow, time.perf_counter() - started, ok, reason)
+        return response if ok else None
+
+    def login(self):
+        response = self.timed('login', 'POST', '/login', data={'email': f"{self.username}@example.com", 'password': dataset.PASSWORD})
+        return response is not None and response.headers.get('Location', '').endswith('/home')
+
+    def connect_socket(self):
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_message', self.on_new_message)
+        cookie = '; '.join(f"{name}={value}" for name, value in self.http.cookies.items())
+        started = time.perf_counter()
+        try:
+            self.sio.connect(self.base_url, headers={'Cookie': cookie}, transports=['websocket'], wait_timeout=10)
+            # Waits for the server to handle the join, so the first message sent is already delivered to this socket
+            self.sio.call('join_chat', {'chat_id': 'global'}, timeout=10)
+            self.results.record('socketio_connect', time.perf_counter() - started)
+        except Exception as e:
+            self.results.record('socketio_connect', time.perf_counter() - started, ok=False, reason=type(e).__name__)
+            self.sio = None
+
+    def on_new_message(self, data):
+        message = data.get('message') if isinstance(data, dict) else None
+        token = (message or {}).get('raw_content', '').split(' ', 1)[0]
+        started = self.pending.pop(token, None)
+        if started is not None:
+            self.results.record('message_delivery', time.perf_counter() - started)
+
+    # Flows
+    def home(self):
+        self.timed('home', 'GET', '/home')
+
+    def send_message(self):
+        # The leading token lets the socket handler match the broadcast even if it beats the HTTP response
+        token = f"lt{self.rng.getrandbits(48):012x}"
+        mentions = ' '.join(f"@{name}" for name in self.rng.sample(self.usernames, self.rng.randint(0, 2)))
+        if self.sio is not None:
+            self.pending[token] = time.perf_counter()
+        if self.timed('send_message', 'POST', '/api/send_message',
+                      data={'chat_id': 'global', 'content': f"{token} load test {mentions}"}) is None:
+            self.pending.pop(token, None)
+
+    def open_dm(self):
+        other = self.rng.choice(self.usernames)
+        if other == self.username:
+            return
+        response = self.timed('open_dm', 'POST', '/api/create_dm', data={'participant': other})
+        if response is not None:
+            self.timed('open_dm', 'GET', f"/api/dm/{response.json()['chat_id']}")
+
+    def like_clip(self):
+        if self.clip_ids:
+            self.timed('like_clip', 'POST', f"/api/clips/{self.rng.choice(self.clip_ids)}/like")
+
+    def comment_clip(self):
+        if self.clip_ids:
+            self.timed('comment_clip', 'POST', f"/api/clips/{self.rng.choice(self.clip_ids)}/comment",
+                       data={'content': f"load test comment {self.rng.random():.6f}"})
+
+    def follow(self):
+        self.timed('follow', 'POST', f"/api/follow/{self.rng.choice(self.usernames)}")
+
+    def view_clip(self):
+        if self.clip_ids:
+            self.timed('view_clip', 'GET', f"/clips/{self.rng.choice(self.clip_ids)}")
+
+    def run(self, deadline):
+        if not self.login():
+            return
+        self.connect_socket()
+        flows, weights = zip(*FLOW_WEIGHTS.items())
+        while time.time() < deadline:
+            getattr(self, self.rng.choices(flows, weights)[0])()
+        # Messages still on their way count as failed deliveries once the wait is over
+        end = time.time() + DELIVERY_TIMEOUT
+        while self.pending and time.time() < end:
+            time.sleep(0.05)
+        for _ in list(self.pending):
+            self.results.record('message_delivery', 0, ok=False, reason='not received')
+        if self.sio is not None:
+            self.sio.disconnect()
+
+
+# --- Reporting ---
+def summarize(results, elapsed):
+    flows = {}
+    for flow in sorted(set(results.latencies) | set(results.errors)):
+        samples = results.latencies.get(flow, [])
+        flows[flow] = {
+            'count': len(samples), 'errors': results.errors.get(flow, 0), 'rps': len(samples) / elapsed,
+            'p50_ms': percentile(samples, 0.50) * 1000, 'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000, 'mean_ms': statistics.fmean(samples) * 1000 if samples else 0.0,
+        }
+    http = [flow for flow in flows if flow not in ('socketio_connect', 'message_delivery')]
+    return flows, sum(flows[flow]['count'] for flow in http) / elapsed
+
+
+def compare(report, baseline, tolerance):
+    """Print changes against ``baseline``; returns True if anything regressed by more than ``tolerance`` percent"""
+    print(f"compared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    regressed = False
+    rows = [('throughput', baseline.get('throughput_rps'), report['throughput_rps'], True)]
+    for flow, stats in report['flows'].items():
+        before = baseline.get('flows', {}).get(flow)
+        if before:
+            rows.append((f"{flow} p95", before['p95_ms'], stats['p95_ms'], False))
+    for name, before, after, higher_is_better in rows:
+        if not before:
+            continue
+        change = (after - before) / before * 100
+        worse = -change if higher_is_better else change
+        flag = 'REGRESSED' if worse > tolerance else ''
+        regressed = regressed or bool(flag)
+        print(f"  {name:<26} {before:10.1f} -> {after:10.1f}  {change:+6.1f}%  {flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='directory with a database/ made by dataset.py (copied, not modified)')
+    parser.add_argument('--concurrency', type=int, default=10, help='virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after every user logged in')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier --save to compare with')
+    parser.add_argument('--tolerance', type=float, default=10, help='percent change counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory (database, gunicorn.log)')
+    dataset.add_arguments(parser)
+    args = parser.parse_args()
+
+    backend = os.environ.get('CONNECTRA_STORAGE', 'json').lower()
+    workdir = tempfile.mkdtemp(prefix='connectra-load-')
+    if args.data:
+        shutil.copytree(os.path.join(args.data, 'database'), os.path.join(workdir, 'database'),
+                        ignore=shutil.ignore_patterns('*.wal', '*.lock'))
+        with open(os.path.join(workdir, 'database', 'userbase.json'), encoding='utf-8') as f:
+            data = json.load(f)
+        if backend == 'sqlite' and not os.path.exists(os.path.join(workdir, 'database', 'connectra.db')):
+            dataset.write(data, workdir, sqlite=True)
+    else:
+        started = time.perf_counter()
+        data = dataset.generate_from_args(args)
+        dataset.write(data, workdir, sqlite=backend == 'sqlite')
+        print(f"generated {len(data['users'])} users, {sum(len(c['messages']) for c in data['chats'])} messages, "
+              f"{len(data['clips'])} clips in {time.perf_counter() - started:.1f}s")
+
+    port = free_port()
+    print(f"starting gunicorn ({backend}, {args.workers} workers) in {workdir}")
+    started = time.perf_counter()
+    server = start_server(workdir, port, args.workers, backend)
+    startup = time.perf_counter() - started
+    memory = MemorySampler(server.pid)
+    memory.start()
+    results = Results()
+    try:
+        rng = random.Random(args.seed)
+        users = [VirtualUser(f"http://127.0.0.1:{port}", data, results, random.Random(rng.random()))
+                 for _ in range(args.concurrency)]
+        deadline = time.time() + args.duration
+        threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = min(time.perf_counter() - started, args.duration) or 1e-9
+    finally:
+        memory.stopped.set()
+        memory.join()
+        stop_server(server)
+
+    flows, throughput = summarize(results, elapsed)
+    report = {
+        'commit': git_commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'), 'backend': backend,
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'keep')},
+        'startup_s': startup, 'throughput_rps': throughput, 'flows': flows,
+        'memory': {'peak_rss_mb': memory.peak / 1e6, 'final_rss_mb': memory.last / 1e6, 'processes': memory.processes},
+    }
+    print(f"backend={backend} workers={args.workers} concurrency={args.concurrency} duration={elapsed:.0f}s "
+          f"startup={startup:.1f}s throughput={throughput:.1f} req/s "
+          f"rss peak={report['memory']['peak_rss_mb']:.0f} MB ({memory.processes} processes)")
+    print(f"  {'flow':<18}{'count':>8}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for flow, stats in flows.items():
+        print(f"  {flow:<18}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>8.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+    for failure, count in sorted(results.failures.items()):
+        print(f"  failed {count}x {failure}")
+    report['failures'] = results.failures
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.save}")
+    regressed = False
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressed = compare(report, json.load(f), args.tolerance)
+    if args.keep:
+        print(f"kept {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    failed = any(stats['errors'] for stats in flows.values())
+    sys.exit(1 if regressed or failed else 0)
+
+
+if __name__ == '__main__':
+    main()
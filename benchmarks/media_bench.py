@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Seek benchmark for clip streaming.
+
+Stores one clip in the blob store of a throwaway app directory and replays
+what a video player does when the user scrubs: a series of requests at
+random offsets. For each serving strategy it reports the bytes the worker
+sent and the worker CPU time per seek:
+
+    full        no Range support: every seek downloads the whole file
+    range       Range: bytes=<offset>-<offset + window> (HTTP 206)
+    revalidate  a cached copy revalidated with If-None-Match (HTTP 304)
+    x-accel     CONNECTRA_MEDIA_OFFLOAD=x-accel: nginx sends the bytes
+
+Usage:
+    python benchmarks/media_bench.py --size-mb 64 --seeks 50
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(client, url, seeks, headers_for):
+    sent = 0
+    start = time.process_time()
+    statuses = set()
+    for offset in seeks:
+        response = client.get(url, headers=headers_for(offset))
+        sent += len(response.get_data())
+        statuses.add(response.status_code)
+        response.close()
+    return sent / len(seeks), (time.process_time() - start) / len(seeks), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--seeks', type=int, default=50)
+    parser.add_argument('--window-kb', type=int, default=1024, help='bytes a player reads after each seek')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='connectra-media-')
+    shutil.copytree(os.path.join(REPO_ROOT, 'database'), os.path.join(workdir, 'database'),
+                    ignore=shutil.ignore_patterns('*.wal', '*.lock', '*.db*'))
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    import main as app_main
+
+    size = args.size_mb * 1024 * 1024
+    window = args.window_kb * 1024
+    filename = 'bench-clip.mp4'
+    with open('bench-clip.bin', 'wb') as f:
+        f.write(os.urandom(size))
+    app_main.blobs.put_file(f"clips/{filename}", 'bench-clip.bin', move=True)
+    url = f"/clips/{filename}"
+
+    client = app_main.app.test_client()
+    etag = client.get(url).headers['ETag']
+    rng = random.Random(11)
+    seeks = [rng.randrange(size - window) for _ in range(args.seeks)]
+
+    strategies = [
+        ('full', lambda offset: {}),
+        ('range', lambda offset: {'Range': f"bytes={offset}-{offset + window - 1}"}),
+        ('revalidate', lambda offset: {'If-None-Match': etag}),
+    ]
+    print(f"clip={args.size_mb} MiB seeks={args.seeks} window={args.window_kb} KiB")
+    print(f"  {'strategy':<12}{'bytes/seek':>14}{'worker ms/seek':>17}  status")
+    for name, headers_for in strategies:
+        sent, cpu, statuses = run(client, url, seeks, headers_for)
+        print(f"  {name:<12}{sent:>14,.0f}{cpu * 1000:>17.3f}  {sorted(statuses)}")
+
+    app_main.MEDIA_OFFLOAD = 'x-accel'
+    sent, cpu, statuses = run(client, url, seeks, lambda offset: {'Range': f"bytes={offset}-{offset + window - 1}"})
+    print(f"  {'x-accel':<12}{sent:>14,.0f}{cpu * 1000:>17.3f}  {sorted(statuses)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for @mention processing on the message send path.
+
+Builds a throwaway database with many users, then times main.process_mentions
+on messages that mention a mix of existing users (in random case) and unknown
+names. The previous implementation (a linear user scan plus one
+``str.replace`` per mention) is timed on the same messages for comparison.
+
+Usage:
+    python benchmarks/mentions_bench.py --users 100000 --mentions 50
+    CONNECTRA_STORAGE=sqlite python benchmarks/mentions_bench.py
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_process_mentions(content, db):
+    """process_mentions before the username index, kept for comparison"""
+    mentioned_users = []
+    for mention in re.findall(r'@(\w+)', content):
+        user = next((u for u in db['users'] if u['username'].lower() == mention.lower()), None)
+        if user:
+            mentioned_users.append(user['username'])
+            content = content.replace(f'@{mention}', f'<span class="mention" data-user="{user["username"]}">@{user["username"]}</span>')
+    return content, mentioned_users
+
+
+def prepare_database(workdir, user_count):
+    os.makedirs(os.path.join(workdir, 'database'))
+    users = [{
+        'id': f"user_{i}", 'username': f"User_{i}", 'email': f"user_{i}@example.com",
+        'password': '', 'display_name': f"User {i}", 'photo': None, 'avatar': None,
+        'bio': '', 'followers': [], 'following': [], 'clips_liked': [], 'clips_shared': []
+    } for i in range(user_count)]
+    path = os.path.join(workdir, 'database', 'userbase.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'users': users, 'chats': [], 'clips': [], 'blogs': []}, f)
+    return path
+
+
+def make_message(rng, user_count, mentions):
+    words = []
+    for n in range(mentions):
+        if n % 5 == 4:
+            words.append(f"@nobody_{rng.randrange(10 ** 6)}")
+        else:
+            name = f"User_{rng.randrange(user_count)}"
+            words.append('@' + (name.lower() if rng.random() < 0.5 else name.upper()))
+        words.append('lorem ipsum dolor')
+    return ' '.join(words)
+
+
+def timed(fn, messages):
+    start = time.perf_counter()
+    for message in messages:
+        fn(message)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--mentions', type=int, default=50, help='mentions per message')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--legacy-messages', type=int, default=3, help='messages timed with the old implementation (slow)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='connectra-mentions-')
+    userbase = prepare_database(workdir, args.users)
+    if os.environ.get('CONNECTRA_STORAGE', 'json').lower() == 'sqlite':
+        sys.path.insert(0, REPO_ROOT)
+        from storage import migrate_json_to_sqlite
+        os.environ['CONNECTRA_SQLITE_PATH'] = os.path.join(workdir, 'database', 'connectra.db')
+        migrate_json_to_sqlite(os.environ['CONNECTRA_SQLITE_PATH'], userbase)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    import main as app_main
+
+    rng = random.Random(8)
+    messages = [make_message(rng, args.users, args.mentions) for _ in range(args.messages)]
+
+    # Sanity check: both find the same users (the old version may also rewrite name prefixes)
+    db = app_main.load_db()
+    for message in messages[:args.legacy_messages]:
+        assert sorted(set(app_main.process_mentions(message)[1])) == sorted(set(legacy_process_mentions(message, db)[1]))
+
+    new = timed(app_main.process_mentions, messages)
+    legacy = timed(lambda m: legacy_process_mentions(m, db), messages[:args.legacy_messages]) if args.legacy_messages else None
+
+    print(f"backend={app_main.STORAGE_BACKEND} users={args.users} mentions/message={args.mentions}")
+    print(f"  process_mentions  {new * 1e6:10.1f} us/message")
+    if legacy is not None:
+        print(f"  legacy scan       {legacy * 1e6:10.1f} us/message   ({legacy / new:.0f}x slower)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Search latency benchmark with a synthetic corpus generator.
+
+Generates a chat corpus (a global chat plus direct chats between random
+users) whose words follow a Zipf distribution over a generated vocabulary,
+sprinkled with markdown, @mentions and emoji like the real welcome content,
+indexes it with search.SearchIndex, and times queries of different shapes:
+very common words, rare words, several words, prefixes (search as you type),
+emoji, and DM-only words that most users may not see. Prints p50/p95/max
+per shape and fails if any p95 is above --budget milliseconds.
+
+The index is built in a temporary directory, or in --index (kept, so later
+runs can skip generation with --reuse).
+
+Usage:
+    python benchmarks/search_bench.py --messages 200000
+    python benchmarks/search_bench.py --messages 2000000 --index /tmp/search.db
+    python benchmarks/search_bench.py --index /tmp/search.db --reuse
+"""
+
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from search import SearchIndex  # noqa: E402
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ro', 'ta', 'vi', 'zu', 'che', 'dra', 'fen', 'gol', 'hus', 'jin', 'pra', 'sol', 'tri', 'wen']
+COMMON = ['the', 'and', 'to', 'you', 'is', 'it', 'hi', 'lol', 'what', 'chat', 'clip', 'video', 'today', 'tomorrow']
+EMOJI = ['🎉', '😊', '👍', '🔥', '💬', '❤️', '😂', '🚀']
+BATCH = 5000
+
+
+def vocabulary(size, rng):
+    words = set(COMMON)
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    ordered = COMMON + sorted(words - set(COMMON))
+    return ordered
+
+
+def generate_text(rng, words, cum_weights, users):
+    picked = rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 25))
+    text = []
+    for word in picked:
+        roll = rng.random()
+        if roll < 0.03:
+            text.append(f"**{word}**")
+        elif roll < 0.05:
+            text.append(rng.choice(EMOJI))
+        elif roll < 0.06:
+            text.append(f"@{rng.choice(users)}")
+        text.append(word)
+    return ' '.join(text)
+
+
+def generate_corpus(index, message_count, user_count, dm_share, vocabulary_size, seed):
+    """Index ``message_count`` messages; returns (users, DM-only marker word)"""
+    rng = random.Random(seed)
+    words = vocabulary(vocabulary_size, rng)
+    # Cumulative weights once: choices() would otherwise re-sum them on every call
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    users = [f"user{i}" for i in range(user_count)]
+    chats = {'global': {'id': 'global', 'type': 'public'}}
+    pending = {}
+    for number in range(message_count):
+        if rng.random() < dm_share:
+            a, b = sorted(rng.sample(users, 2))
+            chat = chats.setdefault(f"dm_{a}_{b}", {'id': f"dm_{a}_{b}", 'type': 'direct', 'participants': [a, b]})
+            author = rng.choice(chat['participants'])
+            # A word that only ever appears in DMs between the first ten users
+            text = generate_text(rng, words, cum_weights, users) + (' zebrafish' if a < 'user10' and b < 'user10' else '')
+        else:
+            chat, author = chats['global'], rng.choice(users)
+            text = generate_text(rng, words, cum_weights, users)
+        pending.setdefault(chat['id'], []).append({
+            'id': f"m{number}", 'username': author, 'raw_content': text,
+            'timestamp': f"2025-01-01T00:00:00.{number:06d}"
+        })
+        if (number + 1) % BATCH == 0 or number + 1 == message_count:
+            for chat_id, messages in pending.items():
+                index.add_messages(chats[chat_id], messages)
+            pending = {}
+            print(f"\r  indexed {number + 1}/{message_count}", end='', flush=True)
+    print()
+    index.optimize()
+    return users, words
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--dm-share', type=float, default=0.3, help='fraction of messages sent in direct chats')
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200, help='queries per shape')
+    parser.add_argument('--budget', type=float, default=50, help='p95 budget in milliseconds')
+    parser.add_argument('--index', help='keep the index at this path')
+    parser.add_argument('--reuse', action='store_true', help='query an existing --index without generating')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = None
+    path = args.index
+    if not path:
+        workdir = tempfile.mkdtemp(prefix='connectra-search-')
+        path = os.path.join(workdir, 'search.db')
+    index = SearchIndex(path)
+    rng = random.Random(args.seed)
+    if args.reuse and args.index:
+        users = [f"user{i}" for i in range(args.users)]
+        words = vocabulary(args.vocabulary, random.Random(args.seed))
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        started = time.perf_counter()
+        users, words = generate_corpus(index, args.messages, args.users, args.dm_share, args.vocabulary, args.seed)
+        elapsed = time.perf_counter() - started
+        print(f"built {args.messages} messages in {elapsed:.1f}s ({args.messages / elapsed:.0f}/s), "
+              f"{os.path.getsize(path) / 1e6:.0f} MB")
+
+    rare = words[len(words) // 2:]
+    shapes = {
+        'common word': lambda: rng.choice(COMMON),
+        'rare word': lambda: rng.choice(rare),
+        'three words': lambda: ' '.join(rng.choice(words[:2000]) for _ in range(3)),
+        'prefix': lambda: rng.choice(words[100:5000])[:3],
+        'emoji': lambda: rng.choice(EMOJI),
+        'dm-only word': lambda: 'zebrafish ',
+        'next page': None,
+    }
+    print(f"docs={index.count()} queries={args.queries} per shape, budget p95 <= {args.budget:.0f} ms")
+    failed = False
+    for name, make_query in shapes.items():
+        timings = []
+        hits = 0
+        for _ in range(args.queries):
+            user = rng.choice(users)
+            if make_query is None:
+                _, cursor = index.search(rng.choice(COMMON), user, limit=20)
+                started = time.perf_counter()
+                results, _ = index.search(rng.choice(COMMON), user, before=cursor, limit=20)
+            else:
+                query = make_query()
+                started = time.perf_counter()
+                results, _ = index.search(query, user, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+            hits += bool(results)
+        p95 = percentile(timings, 0.95)
+        ok = p95 <= args.budget
+        failed = failed or not ok
+        print(f"  {name:<14} p50={statistics.median(timings):7.2f} ms  p95={p95:7.2f} ms  "
+              f"max={max(timings):7.2f} ms  hit={hits / args.queries:4.0%}  {'OK' if ok else 'SLOW'}")
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Lost-update stress benchmark for multi-worker storage.
+
+Imports the app once (like gunicorn's preload_app), forks several worker
+processes and has every worker fire like_clip, follow_user and
+api_send_message through the real Flask routes at the same time. Afterwards
+it reopens the store from disk and checks that no like, follow or message
+was lost.
+
+Usage:
+    python benchmarks/stress_storage.py --workers 8 --users 64 --messages 20
+    CONNECTRA_STORAGE=sqlite python benchmarks/stress_storage.py
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIP_ID = 'stress-clip'
+TARGET = 'stress_target'
+
+
+def prepare_database(workdir, user_count):
+    """Copy the shipped database and add the benchmark users and clip"""
+    shutil.copytree(os.path.join(REPO_ROOT, 'database'), os.path.join(workdir, 'database'),
+                    ignore=shutil.ignore_patterns('*.wal', '*.lock', '*.db*'))
+    path = os.path.join(workdir, 'database', 'userbase.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for username in [TARGET] + [f"stress_{i}" for i in range(user_count)]:
+        data['users'].append({
+            'id': username, 'username': username, 'email': f"{username}@example.com",
+            'password': '', 'display_name': username, 'photo': None, 'avatar': None,
+            'online': False, 'bio': '',
+            'clips_liked': [], 'clips_shared': []
+        })
+    data['clips'].append({
+        'id': CLIP_ID, 'title': 'Stress', 'description': '', 'video_filename': f"{CLIP_ID}.mp4",
+        'thumbnail': '', 'author': TARGET, 'created_at': '2025-01-01T00:00:00',
+        'views': 0, 'likes': 0, 'comments': [], 'duration': 0
+    })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return sum(len(c['messages']) for c in data['chats'] if c['id'] == 'global')
+
+
+def run_user(app, username, messages):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = username
+    statuses = [
+        client.post(f"/api/clips/{CLIP_ID}/like").status_code,
+        client.post(f"/api/follow/{TARGET}").status_code,
+    ]
+    for n in range(messages):
+        statuses.append(client.post('/api/send_message', data={'chat_id': 'global', 'content': f"{username} #{n}"}).status_code)
+    return statuses
+
+
+def worker(worker_index, worker_count, user_count, messages, threads):
+    import main
+    sys.stdout = open(os.devnull, 'w')
+    usernames = [f"stress_{i}" for i in range(worker_index, user_count, worker_count)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda u: run_user(main.app, u, messages), usernames))
+    failures = sum(1 for statuses in results for status in statuses if status != 200)
+    os._exit(1 if failures else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=max(2, multiprocessing.cpu_count()))
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--messages', type=int, default=10, help='global chat messages per user')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent requests per worker')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='connectra-stress-')
+    initial_messages = prepare_database(workdir, args.users)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    if os.environ.get('CONNECTRA_STORAGE', 'json').lower() == 'sqlite':
+        subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'storage.py'), 'migrate'], check=True)
+
+    import main as app_module  # preload before forking, as gunicorn does
+    import storage
+    import social
+
+    ctx = multiprocessing.get_context('fork')
+    started = time.perf_counter()
+    procs = [ctx.Process(target=worker, args=(i, args.workers, args.users, args.messages, args.threads))
+             for i in range(args.workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+
+    store = storage.open_store(app_module.STORAGE_BACKEND, app_module.USER_DB, app_module.SQLITE_DB)
+    clip = store.get('clips', CLIP_ID, shallow=True)
+    global_chat = store.get('chats', 'global')
+    store.close()
+    app_module.store.close()
+    graph = social.SocialGraph(app_module.SOCIAL_DB)
+    followers, _ = graph.followers(TARGET, limit=args.users + 1)
+
+    expected_messages = initial_messages + args.users * args.messages
+    checks = {
+        'clip likes': (len(set(clip.get('liked_by', []))), clip.get('likes'), args.users),
+        'followers': (len(set(followers)), graph.counts(TARGET)[0], args.users),
+        'global messages': (len({m['id'] for m in global_chat['messages']}), len(global_chat['messages']), expected_messages),
+    }
+    requests_sent = args.users * (2 + args.messages)
+    print(f"backend={app_module.STORAGE_BACKEND} workers={args.workers} users={args.users} "
+          f"requests={requests_sent} elapsed={elapsed:.2f}s throughput={requests_sent / elapsed:.0f} req/s")
+    lost = False
+    for name, (unique, stored, expected) in checks.items():
+        ok = unique == stored == expected
+        lost = lost or not ok
+        print(f"  {name:<16} expected={expected:<6} unique={unique:<6} stored={stored:<6} {'OK' if ok else 'LOST UPDATES'}")
+    failed_workers = [p.exitcode for p in procs if p.exitcode]
+    if failed_workers:
+        print(f"  {len(failed_workers)} worker(s) saw non-200 responses")
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if lost or failed_workers else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Content-addressed media storage for Connectra.
+
+Uploaded files (chat attachments, profile photos, clips) are stored once per
+distinct content under ``<root>/<sha[:2]>/<sha>``, however many times they are
+posted. Routes keep using the logical names they always had, such as
+``uploads/<uuid>.png`` or ``clips/<clip id>.mp4``; a small SQLite index maps
+each logical name to its blob and counts the names pointing at every blob, so
+a blob is deleted when its last name is released.
+
+Files saved before the blob store existed keep working: ``path`` returns None
+for names it does not know and the caller falls back to the old directory.
+``python blobs.py migrate`` moves those directories into the store.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_sha256 ON names (sha256);
+"""
+
+# Directories whose files are addressed as '<dir>/<filename>'
+MEDIA_DIRS = ('uploads', 'photos', 'clips')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Deduplicating file store with a name index and reference counts
+
+    Writes and releases run inside one SQLite write transaction, so a blob
+    cannot be deleted by one worker while another is adding a name to it.
+    """
+
+    def __init__(self, root, index_path):
+        self.root = root
+        self.index_path = index_path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _write(self, apply):
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = apply(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    # --- Writes ---
+    def put(self, name, sha256, size, move_into):
+        """Point ``name`` at the blob ``sha256``, calling ``move_into(path)`` only if that blob is new.
+
+        Returns True when the content was already stored (nothing new was written).
+        """
+        def apply(conn):
+            existing = conn.execute("SELECT sha256 FROM names WHERE name = ?", (name,)).fetchone()
+            if existing and existing[0] == sha256:
+                return True
+            if existing:
+                self._release(conn, name)
+            row = conn.execute("SELECT refs FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            path = self.blob_path(sha256)
+            duplicate = bool(row) and os.path.exists(path)
+            if not duplicate:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                move_into(path)
+            conn.execute(
+                "INSERT INTO blobs (sha256, size, refs) VALUES (?, ?, 1) "
+                "ON CONFLICT (sha256) DO UPDATE SET refs = refs + 1", (sha256, size)
+            )
+            conn.execute("INSERT INTO names (name, sha256) VALUES (?, ?)", (name, sha256))
+            return duplicate
+        return self._write(apply)
+
+    def put_staged(self, name, staged):
+        """Store an uploads.StagedFile under ``name``; a duplicate's staged bytes are simply dropped"""
+        return self.put(name, staged.sha256, staged.size, staged.move_to)
+
+    def put_file(self, name, path, move=False):
+        """Store an existing file under ``name``, moving it into the store or copying it"""
+        def move_into(destination):
+            if move:
+                os.replace(path, destination)
+            else:
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination))
+                os.close(fd)
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, destination)
+        duplicate = self.put(name, file_sha256(path), os.path.getsize(path), move_into)
+        if move and os.path.exists(path):
+            os.unlink(path)
+        return duplicate
+
+    def release(self, name):
+        """Forget ``name``; its blob is deleted once no other name points at it"""
+        self._write(lambda conn: self._release(conn, name))
+
+    def _release(self, conn, name):
+        row = conn.execute("SELECT sha256 FROM names WHERE name = ?", (name,)).fetchone()
+        if not row:
+            return
+        conn.execute("DELETE FROM names WHERE name = ?", (name,))
+        conn.execute("UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?", (row[0],))
+        if conn.execute("SELECT refs FROM blobs WHERE sha256 = ?", (row[0],)).fetchone()[0] <= 0:
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row[0],))
+            try:
+                os.unlink(self.blob_path(row[0]))
+            except FileNotFoundError:
+                pass
+
+    # --- Reads ---
+    def lookup(self, name):
+        """``(sha256, size)`` for a logical name, or None"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT b.sha256, b.size FROM names n JOIN blobs b ON b.sha256 = n.sha256 WHERE n.name = ?", (name,)
+            ).fetchone()
+
+    def path(self, name):
+        """Filesystem path of the blob behind ``name``, or None if the name is not stored here"""
+        found = self.lookup(name)
+        return self.blob_path(found[0]) if found else None
+
+    def stats(self):
+        with self.lock:
+            blobs, stored = self.conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM blobs").fetchone()
+            names, logical = self.conn.execute(
+                "SELECT count(*), coalesce(sum(b.size), 0) FROM names n JOIN blobs b ON b.sha256 = n.sha256"
+            ).fetchone()
+            return {'blobs': blobs, 'names': names, 'stored_bytes': stored, 'logical_bytes': logical}
+
+
+def migrate_directories(store, directories=MEDIA_DIRS, keep=False):
+    """Move (or with ``keep``, copy) every file in the legacy media directories into ``store``"""
+    moved = duplicates = 0
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+            if store.put_file(f"{directory}/{filename}", path, move=not keep):
+                duplicates += 1
+            moved += 1
+    return moved, duplicates
+
+
+if __name__ == '__main__':
+    # python blobs.py migrate [--keep]   (run from the app directory, like the server)
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('usage: python blobs.py migrate [--keep]')
+        sys.exit(2)
+    root = os.environ.get('CONNECTRA_BLOB_ROOT', os.path.join('media', 'blobs'))
+    index = os.environ.get('CONNECTRA_BLOB_INDEX', os.path.join('database', 'blobs.db'))
+    blob_store = BlobStore(root, index)
+    moved, duplicates = migrate_directories(blob_store, keep='--keep' in sys.argv[2:])
+    stats = blob_store.stats()
+    print(f"Imported {moved} files ({duplicates} duplicates) into {root}: "
+          f"{stats['logical_bytes']} logical bytes stored in {stats['stored_bytes']}")
@@ -0,0 +1,191 @@
+"""
+Cross-worker Socket.IO fan-out for Connectra.
+
+With several gunicorn workers each process only knows the sockets connected
+to it, so ``socketio.emit(..., room=participant)`` has to be relayed to every
+worker. ``CONNECTRA_SOCKETIO_QUEUE`` picks how:
+
+    (unset)                     single process, no relay
+    ipc:///tmp/connectra.sock   local broker over a Unix socket, no external service
+    redis://host:6379/0         Redis pub/sub (needs the optional ``redis`` package)
+
+The IPC broker is a small relay: workers open one publishing and one
+subscribing connection, and every frame published is written once to every
+subscriber, the publisher's own worker included. gunicorn.conf.py starts it
+next to the workers; it can also be run by hand with ``python fanout.py PATH``.
+"""
+
+import os
+import pickle
+import selectors
+import socket
+import struct
+import sys
+import time
+
+import socketio
+
+DEFAULT_IPC_PATH = '/tmp/connectra-socketio.sock'
+
+HEADER = struct.Struct('!I')
+ROLE_PUB = b'P'
+ROLE_SUB = b'S'
+
+
+def ipc_path(url):
+    return url[len('ipc://'):] or DEFAULT_IPC_PATH
+
+
+def socketio_options(url):
+    """Extra SocketIO() keyword arguments for the configured queue URL"""
+    if not url:
+        return {}
+    if url.startswith('ipc://'):
+        return {'client_manager': IPCManager(url)}
+    # redis://, rediss://, kafka://, zmq+... and kombu URLs are handled by Flask-SocketIO itself
+    return {'message_queue': url}
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('IPC broker closed the connection')
+        data += chunk
+    return data
+
+
+class IPCManager(socketio.PubSubManager):
+    """python-socketio client manager that relays through the local IPC broker"""
+    name = 'ipc'
+
+    def __init__(self, url='ipc://', channel='socketio', write_only=False, logger=None):
+        self.path = ipc_path(url)
+        self._pub = None
+        self._pub_pid = None
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self, role):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall(role)
+        return sock
+
+    def _publish(self, data):
+        payload = pickle.dumps(data)
+        frame = HEADER.pack(len(payload)) + payload
+        for attempt in range(2):
+            try:
+                if self._pub is None or self._pub_pid != os.getpid():
+                    self._pub = self._connect(ROLE_PUB)
+                    self._pub_pid = os.getpid()
+                self._pub.sendall(frame)
+                return
+            except OSError:
+                if self._pub is not None:
+                    self._pub.close()
+                self._pub = None
+                if attempt:
+                    self._get_logger().error('Cannot publish to IPC broker at %s', self.path)
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            sock = None
+            try:
+                sock = self._connect(ROLE_SUB)
+                retry_sleep = 1
+                while True:
+                    size, = HEADER.unpack(_recv_exact(sock, HEADER.size))
+                    yield _recv_exact(sock, size)
+            except OSError:
+                if sock is not None:
+                    sock.close()
+                self._get_logger().error('IPC broker at %s unavailable, retrying in %s secs', self.path, retry_sleep)
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+
+class _Peer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.role = None
+        self.inbox = b''
+        self.outbox = bytearray()
+
+
+def run_broker(path=DEFAULT_IPC_PATH):
+    """Relay every frame from publishers to all subscribers until killed"""
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # only this user's processes may publish
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(128)
+    server.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    subscribers = set()
+
+    def drop(peer):
+        selector.unregister(peer.sock)
+        peer.sock.close()
+        subscribers.discard(peer)
+
+    def flush(peer):
+        try:
+            sent = peer.sock.send(peer.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            drop(peer)
+            return
+        del peer.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if peer.outbox else 0)
+        selector.modify(peer.sock, events, peer)
+
+    while True:
+        for key, events in selector.select():
+            if key.fileobj is server:
+                conn, _ = server.accept()
+                conn.setblocking(False)
+                selector.register(conn, selectors.EVENT_READ, _Peer(conn))
+                continue
+            peer = key.data
+            if peer.sock.fileno() < 0:
+                continue  # dropped earlier in this round
+            if events & selectors.EVENT_WRITE:
+                flush(peer)
+            if not events & selectors.EVENT_READ or peer.sock.fileno() < 0:
+                continue
+            try:
+                chunk = peer.sock.recv(65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                chunk = b''
+            if not chunk:
+                drop(peer)
+                continue
+            peer.inbox += chunk
+            if peer.role is None:
+                peer.role, peer.inbox = peer.inbox[:1], peer.inbox[1:]
+                if peer.role == ROLE_SUB:
+                    subscribers.add(peer)
+            # Forward whole frames only
+            while len(peer.inbox) >= HEADER.size:
+                size, = HEADER.unpack_from(peer.inbox)
+                if len(peer.inbox) < HEADER.size + size:
+                    break
+                frame, peer.inbox = peer.inbox[:HEADER.size + size], peer.inbox[HEADER.size + size:]
+                for subscriber in list(subscribers):
+                    subscriber.outbox += frame
+                    flush(subscriber)
+
+
+if __name__ == '__main__':
+    run_broker(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IPC_PATH)
@@ -0,0 +1,83 @@
+"""
+Trending ranking for the Connectra clips feed.
+
+The chronological feed pages straight through the store's ``created_at``
+order (``store.clips_page``). ``TrendingFeed`` ranks every clip by engagement
+(views, likes, comments, shares) decayed by age, in the style of Hacker News'
+gravity formula. Ranking needs a pass over all clips, so it is not done per
+request: readers get the last ranking, and once it is older than ``interval``
+the next reader starts a refresh in the background.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+# Points per interaction; a view is cheap, a share is the strongest signal
+WEIGHTS = {'views': 0.1, 'likes': 1.0, 'comment_count': 2.0, 'shares': 3.0}
+GRAVITY = 1.5
+
+
+def created_timestamp(clip):
+    try:
+        return datetime.fromisoformat(clip.get('created_at') or '').timestamp()
+    except ValueError:
+        return 0.0
+
+
+def trending_score(clip, now):
+    engagement = sum(weight * (clip.get(field) or 0) for field, weight in WEIGHTS.items())
+    age_hours = max(now - created_timestamp(clip), 0) / 3600
+    return (engagement + 1) / (age_hours + 2) ** GRAVITY
+
+
+class TrendingFeed:
+    """Per-worker snapshot of clip ids, best first, refreshed at most every ``interval`` seconds"""
+
+    def __init__(self, store, interval=300):
+        self.store = store
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.ranking = None
+        self.updated = 0.0
+        self._refreshing = False
+        self._pid = None
+
+    def refresh(self):
+        now = time.time()
+        try:
+            clips = self.store.clips()
+            clips.sort(key=lambda clip: trending_score(clip, now), reverse=True)
+            with self.lock:
+                self.ranking = [clip['id'] for clip in clips]
+                self.updated = now
+        finally:
+            self._refreshing = False
+
+    def ranked(self, spawn=None):
+        """The current ranking; a stale one is refreshed through ``spawn(fn)`` (inline without it)"""
+        with self.lock:
+            if self._pid != os.getpid():
+                # A refresh in flight in the parent does not exist after fork()
+                self._pid = os.getpid()
+                self._refreshing = False
+            stale = self.ranking is None or time.time() - self.updated > self.interval
+            start = stale and not self._refreshing
+            if start:
+                self._refreshing = True
+        if start and (self.ranking is None or spawn is None):
+            self.refresh()
+        elif start:
+            spawn(self.refresh)
+        return self.ranking
+
+    def page(self, cursor=None, limit=20, spawn=None):
+        """``(clip ids, next_cursor)``; the cursor is an offset into the ranking"""
+        ranking = self.ranked(spawn)
+        try:
+            offset = max(int(cursor or 0), 0)
+        except ValueError:
+            offset = 0
+        end = offset + limit
+        return ranking[offset:end], (str(end) if end < len(ranking) else None)
@@ -5,6 +5,9 @@ This file configures Gunicorn with optimal settings for the chat app.
 """
 
 import os
+import sys
+import subprocess
+import time
 import multiprocessing
 
 # Server socket
@@ -12,6 +15,7 @@ bind = f"0.0.0.0:{os.environ.get('PORT', '2012')}"
 backlog = 2048
 
 # Worker processes
+# Storage is shared safely between workers (see storage.py); check with benchmarks/stress_storage.py
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "eventlet"
 worker_connections = 1000
@@ -58,10 +62,42 @@ preload_app = True
 # Enable threading for SocketIO
 threads = 2
 
+# Socket.IO fan-out between workers (see fanout.py). Without a queue an emit only
+# reaches clients of the worker that sent it, so default to the local IPC broker.
+if workers > 1:
+    os.environ.setdefault('CONNECTRA_SOCKETIO_QUEUE', 'ipc:///tmp/connectra-socketio.sock')
+fanout_broker = None
+# Clip transcoding/thumbnail worker (see mediajobs.py); set CONNECTRA_MEDIA_WORKER=false to run it elsewhere
+media_worker = None
+
 def when_ready(server):
     """Called just after the server is started."""
+    global fanout_broker, media_worker
+    queue = os.environ.get('CONNECTRA_SOCKETIO_QUEUE', '')
+    if queue.startswith('ipc://'):
+        from fanout import ipc_path
+        path = ipc_path(queue)
+        if os.path.exists(path):
+            os.unlink(path)
+        fanout_broker = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fanout.py'), path])
+        # Workers connect as soon as they boot, so wait for the broker to bind
+        for _ in range(50):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+        server.log.info("Socket.IO fan-out broker started on %s (pid: %s)", path, fanout_broker.pid)
+    if os.environ.get('CONNECTRA_MEDIA_WORKER', 'true').lower() == 'true':
+        media_worker = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mediajobs.py'), 'worker'])
+        server.log.info("Media job worker started (pid: %s)", media_worker.pid)
     server.log.info("Connectra server is ready. Listening on %s", bind)
 
+def on_exit(server):
+    """Called just before the master process exits."""
+    if fanout_broker:
+        fanout_broker.terminate()
+    if media_worker:
+        media_worker.terminate()
+
 def worker_int(worker):
     """Called just after a worker has been killed by a signal."""
     worker.log.info("Worker received INT or QUIT signal")
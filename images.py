@@ -0,0 +1,140 @@
+"""
+Resized avatar variants for Connectra.
+
+Avatars are shown at a few dozen pixels but uploaded at whatever size the
+camera produced. ``VariantCache`` renders square thumbnails at fixed SIZES,
+as WebP for browsers that accept it and JPEG (PNG when the image has
+transparency) otherwise, and keeps them in an on-disk cache that is trimmed
+to ``max_bytes``, least recently used first.
+
+Variants are keyed by the content hash of the source image, so they never go
+stale and files shared by several names share their variants too. Pillow is
+optional: without it ``get`` returns None and callers serve the original.
+"""
+
+import os
+import tempfile
+import time
+
+try:
+    from PIL import Image, ImageOps, features
+    HAS_WEBP = features.check('webp')
+except ImportError:  # Pillow not installed: originals only
+    Image = None
+    HAS_WEBP = False
+
+SIZES = (32, 64, 128, 256)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+# Only refresh a hit's mtime (its LRU position) this often, not on every request
+TOUCH_INTERVAL = 3600
+
+
+def pick_size(requested, sizes=SIZES):
+    """The smallest variant at least ``requested`` pixels wide, or None for a missing/invalid value"""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return None
+    if requested <= 0:
+        return None
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+
+class VariantCache:
+    """Size-limited directory of ``<key>_<size>.<ext>`` thumbnails"""
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, sizes=SIZES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.sizes = sizes
+
+    def _path(self, key, size, ext):
+        return os.path.join(self.root, key[:2], f"{key}_{size}.{ext}")
+
+    def cached(self, key, size, webp):
+        """Path of an existing variant, or None"""
+        for ext in (('webp',) if webp else ('jpg', 'png')):
+            path = self._path(key, size, ext)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if mtime < time.time() - TOUCH_INTERVAL:
+                os.utime(path)
+            return path
+        return None
+
+    def get(self, source, key, size, webp=False):
+        """Path of the ``size`` variant of ``source``, rendering it on first use; None without Pillow"""
+        webp = webp and HAS_WEBP
+        path = self.cached(key, size, webp)
+        if path or Image is None:
+            return path
+        try:
+            with Image.open(source) as image:
+                path = self._render(self._prepare(image, size), key, size, webp)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        self.trim()
+        return path
+
+    def generate(self, source, key):
+        """Render every size in both formats (run when an avatar is uploaded)"""
+        if Image is None:
+            return
+        with Image.open(source) as image:
+            image = self._prepare(image, self.sizes[-1])
+            for size in self.sizes:
+                for webp in ((True, False) if HAS_WEBP else (False,)):
+                    self._render(image, key, size, webp)
+        self.trim()
+
+    @staticmethod
+    def _prepare(image, size):
+        # JPEGs decode straight at a reduced scale; phone photos are rotated by their EXIF tag
+        image.draft('RGB', (size * 2, size * 2))
+        return ImageOps.exif_transpose(image)
+
+    def _render(self, image, key, size, webp):
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        thumb = ImageOps.fit(image.convert('RGBA' if has_alpha else 'RGB'), (size, size), Image.LANCZOS)
+        if webp:
+            ext, options = 'webp', {'format': 'WEBP', 'quality': WEBP_QUALITY, 'method': 4}
+        elif has_alpha:
+            ext, options = 'png', {'format': 'PNG', 'optimize': True}
+        else:
+            ext, options = 'jpg', {'format': 'JPEG', 'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+        path = self._path(key, size, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            thumb.save(f, **options)
+        os.replace(tmp_path, path)
+        return path
+
+    def trim(self):
+        """Delete least recently used variants until the cache is back under 90% of max_bytes"""
+        entries = []
+        total = 0
+        for directory in os.scandir(self.root) if os.path.isdir(self.root) else ():
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,22 +1,155 @@
-import json, os, hashlib, uuid, secrets
+import json, os, re, hashlib, uuid, secrets, atexit, time, mimetypes, subprocess
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, send_file, jsonify, make_response, g
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from functools import wraps
 from werkzeug.utils import secure_filename
 import requests
 from urllib.parse import urlencode
+from storage import open_store
+from fanout import socketio_options
+from presence import PresenceTracker
+from uploads import StagedFile, StreamingRequest, UploadPipeline, stage, purge_staging
+from blobs import BlobStore
+from mediajobs import JobQueue, probe, make_poster, make_rendition
+from images import VariantCache, pick_size
+from feed import TrendingFeed
+from counters import CounterBuffer
+from social import SocialGraph
+from usercache import UserCache
+from readstate import ReadState
+from search import SearchIndex
+from metrics import Metrics
+from profiler import Profiler
+from offload import Offload
+from pagecache import PageCache
 
 # Update DB path to userbase.json and adapt user fields
 USER_DB = os.path.join('database', 'userbase.json')
+SQLITE_DB = os.environ.get('CONNECTRA_SQLITE_PATH', os.path.join('database', 'connectra.db'))
+
+# Request latency, storage timing and Socket.IO counters, summed over every worker in METRICS_DB and served on
+# /metrics in the Prometheus text format; with CONNECTRA_METRICS_TOKEN set a scrape needs `Authorization: Bearer <token>`
+METRICS_DB = os.environ.get('CONNECTRA_METRICS_PATH', os.path.join('database', 'metrics.db'))
+METRICS_INTERVAL = float(os.environ.get('CONNECTRA_METRICS_INTERVAL', '5'))
+METRICS_TOKEN = os.environ.get('CONNECTRA_METRICS_TOKEN', '')
+metrics = Metrics(METRICS_DB, interval=METRICS_INTERVAL)
+metrics.histogram('connectra_http_request_duration_seconds', 'Flask request latency by endpoint, method and status')
+metrics.histogram('connectra_db_call_seconds', 'Time spent in load_db and save_db')
+metrics.counter('connectra_upload_bytes_total', 'Bytes of uploaded files by endpoint')
+metrics.counter('connectra_uploads_total', 'Uploaded files by endpoint')
+metrics.counter('connectra_socketio_connects_total', 'Socket.IO connections accepted')
+metrics.counter('connectra_socketio_disconnects_total', 'Socket.IO connections closed')
+metrics.counter('connectra_socketio_emits_total', 'Socket.IO events emitted by event name and target (room or broadcast)')
+metrics.gauge('connectra_socketio_clients', 'Connected Socket.IO clients')
+metrics.gauge('connectra_socketio_rooms', 'Socket.IO rooms (users and chats) by number of members')
+metrics.gauge('connectra_socketio_room_members', 'Memberships over all Socket.IO rooms')
+metrics.gauge('connectra_socketio_largest_room', 'Members of the largest Socket.IO room on any one worker', aggregate='max')
+atexit.register(metrics.flush)
+
+# Sampling profiler and slow-request capture, switched on per worker from the dev dashboard (see profiler.py);
+# CONNECTRA_SLOW_REQUEST_MS is the capture threshold until the dashboard sets one (0: off)
+PROFILER_DB = os.environ.get('CONNECTRA_PROFILER_PATH', os.path.join('database', 'profiler.db'))
+PROFILE_INTERVAL_MS = float(os.environ.get('CONNECTRA_PROFILE_INTERVAL_MS', '5'))
+SLOW_REQUEST_MS = float(os.environ.get('CONNECTRA_SLOW_REQUEST_MS', '0'))
+SLOW_REQUEST_KEEP = int(os.environ.get('CONNECTRA_SLOW_REQUEST_KEEP', '50'))
+profiler = Profiler(PROFILER_DB, interval=PROFILE_INTERVAL_MS / 1000, slow_ms=SLOW_REQUEST_MS, keep=SLOW_REQUEST_KEEP)
+
+# Snapshot writes, fsyncs, lock waits, upload copies and avatar renders run on native threads instead of
+# stalling the eventlet hub (see offload.py); at most IO_MAX_PENDING per worker, IO_THREADS=0 keeps them inline
+IO_THREADS = int(os.environ.get('CONNECTRA_IO_THREADS', '8'))
+IO_MAX_PENDING = int(os.environ.get('CONNECTRA_IO_MAX_PENDING', '64'))
+io_pool = Offload(threads=IO_THREADS, max_pending=IO_MAX_PENDING, metrics=metrics)
+
+# 'json': in-memory store, mutations go to userbase.json.wal and are compacted into USER_DB
+# 'sqlite': indexed tables in SQLITE_DB (import existing data with `python storage.py migrate`)
+STORAGE_BACKEND = os.environ.get('CONNECTRA_STORAGE', 'json').lower()
+store = open_store(
+    STORAGE_BACKEND, USER_DB, SQLITE_DB, metrics=metrics, offload=io_pool,
+    **({
+        'compact_every': int(os.environ.get('CONNECTRA_WAL_COMPACT_EVERY', '1000')),
+        'fsync': os.environ.get('CONNECTRA_WAL_FSYNC', 'False').lower() == 'true'
+    } if STORAGE_BACKEND == 'json' else {})
+)
+atexit.register(store.close)
+
+# Online status lives in a per-worker tracker merged through PRESENCE_DB; only last_seen reaches the store
+PRESENCE_DB = os.environ.get('CONNECTRA_PRESENCE_PATH', os.path.join('database', 'presence.db'))
+PRESENCE_GRACE = float(os.environ.get('CONNECTRA_PRESENCE_GRACE', '10'))
+LAST_SEEN_FLUSH_EVERY = 60
+presence = PresenceTracker(PRESENCE_DB, grace=PRESENCE_GRACE)
+
+# Clip views and shares are counted in memory and written in batches (0 writes every increment through)
+COUNTER_FLUSH_INTERVAL = float(os.environ.get('CONNECTRA_COUNTER_FLUSH_INTERVAL', '1'))
+counters = CounterBuffer(store, interval=COUNTER_FLUSH_INTERVAL)
+atexit.register(counters.flush)
+
+# Follows live in their own graph (indexed edges plus counts), not in lists on the user documents
+SOCIAL_DB = os.environ.get('CONNECTRA_SOCIAL_PATH', os.path.join('database', 'social.db'))
+social = SocialGraph(SOCIAL_DB)
+if social.needs_import():
+    social.import_user_lists(store.load().get('users', []))
+
+# Unread counts and read receipts: per-chat message numbers and per-user read positions
+READ_STATE_DB = os.environ.get('CONNECTRA_READ_STATE_PATH', os.path.join('database', 'readstate.db'))
+read_state = ReadState(READ_STATE_DB)
+if read_state.needs_import():
+    read_state.import_chats(store.load().get('chats', []))
+
+# Full-text search over messages, blogs and clips, updated on every write (rebuild with `python search.py reindex`)
+SEARCH_DB = os.environ.get('CONNECTRA_SEARCH_PATH', os.path.join('database', 'search.db'))
+search_index = SearchIndex(SEARCH_DB)
+if search_index.needs_import():
+    search_index.import_store(store.load())
+
+# Author names and avatars next to clips and comments are looked up at read time through this cache
+authors = UserCache(store)
+
+# Guest pages and the public blog and clips pages, rendered once per worker for everyone without an account and
+# dropped when a write records a change they are built from (see pagecache.py); 0 MB renders them every time
+PAGE_CACHE_MB = int(os.environ.get('CONNECTRA_PAGE_CACHE_MB', '32'))
+PAGE_CACHE_MAX_AGE = float(os.environ.get('CONNECTRA_PAGE_CACHE_MAX_AGE', '60'))
+page_cache = PageCache(store, max_bytes=PAGE_CACHE_MB * 1024 * 1024, max_age=PAGE_CACHE_MAX_AGE)
+
+# Uploads stream into UPLOAD_STAGING while the form is parsed; pipeline workers move them into place
+UPLOAD_STAGING = os.environ.get('CONNECTRA_UPLOAD_STAGING', os.path.join('uploads', '.staging'))
+UPLOAD_WORKERS = int(os.environ.get('CONNECTRA_UPLOAD_WORKERS', '2'))
+upload_pipeline = UploadPipeline(workers=UPLOAD_WORKERS)
+purge_staging(UPLOAD_STAGING)
+
+# Media files are stored once per content hash; 'uploads/<name>', 'photos/<name>' and 'clips/<name>'
+# stay the logical names (import older files with `python blobs.py migrate`)
+BLOB_ROOT = os.environ.get('CONNECTRA_BLOB_ROOT', os.path.join('media', 'blobs'))
+BLOB_INDEX = os.environ.get('CONNECTRA_BLOB_INDEX', os.path.join('database', 'blobs.db'))
+blobs = BlobStore(BLOB_ROOT, BLOB_INDEX)
+
+# Clip probing, poster frames and 720p renditions run in a separate process (`python mediajobs.py worker`,
+# started by gunicorn.conf.py); ffmpeg is optional, without it only duration and frame size are filled in
+MEDIA_JOBS_DB = os.environ.get('CONNECTRA_MEDIA_JOBS_PATH', os.path.join('database', 'jobs.db'))
+media_jobs = JobQueue(MEDIA_JOBS_DB)
+
+# Square avatar thumbnails (?s=32/64/128/256) rendered on upload, kept in a size-limited cache
+AVATAR_CACHE = os.environ.get('CONNECTRA_AVATAR_CACHE', os.path.join('media', 'variants'))
+AVATAR_CACHE_MB = int(os.environ.get('CONNECTRA_AVATAR_CACHE_MB', '256'))
+avatar_variants = VariantCache(AVATAR_CACHE, max_bytes=AVATAR_CACHE_MB * 1024 * 1024)
+
+# Media names are uuid-based and never reused, so responses are cacheable forever.
+# CONNECTRA_MEDIA_OFFLOAD hands the bytes to a front proxy instead of the eventlet worker:
+#   x-accel     nginx: `location /_media/ { internal; alias <BLOB_ROOT>/; }`
+#   x-sendfile  Apache mod_xsendfile / lighttpd
+MEDIA_MAX_AGE = 365 * 24 * 3600
+MEDIA_OFFLOAD = os.environ.get('CONNECTRA_MEDIA_OFFLOAD', '').lower()
+MEDIA_ACCEL_PREFIX = os.environ.get('CONNECTRA_MEDIA_ACCEL_PREFIX', '/_media/')
 
 def load_db():
-    with open(USER_DB, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Return the whole database. Write through store.set/append/... so changes are persisted."""
+    with metrics.timer('connectra_db_call_seconds', call='load_db'):
+        return store.load()
 
 def save_db(data):
-    with open(USER_DB, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    """Replace the whole database and snapshot it (slow path, prefer store ops)"""
+    with metrics.timer('connectra_db_call_seconds', call='save_db'):
+        store.replace(data)
 
 def hash_pw(pw):
     return hashlib.sha256(pw.encode()).hexdigest()
@@ -29,9 +162,42 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def anonymous_page(*kinds, query=()):
+    """Serve the page from page_cache to visitors without an account (guests included), with ETag/Last-Modified.
+
+    ``kinds`` are the change kinds the page is built from; ``query`` the parameters that select a different page.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not PAGE_CACHE_MB or session.get('user_id') not in (None, 'guest'):
+                return f(*args, **kwargs)
+            key = (request.path,) + tuple(request.args.get(name) for name in query)
+            page = page_cache.get(key)
+            if page is None:
+                token = page_cache.begin(kinds)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                page = page_cache.put(key, response.get_data(), response.mimetype, kinds, token)
+            response = make_response(page.body)
+            response.mimetype = page.mimetype
+            response.set_etag(page.etag)
+            response.last_modified = page.last_modified
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return decorated
+    return decorator
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
+StreamingRequest.staging_dir = UPLOAD_STAGING
+app.request_class = StreamingRequest
+app.config['USE_X_SENDFILE'] = MEDIA_OFFLOAD == 'x-sendfile'
 app.secret_key = 'connectra_secret_key'
-socketio = SocketIO(app, manage_session=False)
+# Relay emits between gunicorn workers: unset, ipc://<socket path> or redis://... (see fanout.py)
+SOCKETIO_QUEUE = os.environ.get('CONNECTRA_SOCKETIO_QUEUE', '')
+socketio = SocketIO(app, manage_session=False, **socketio_options(SOCKETIO_QUEUE))
 
 # OAuth Configuration - Replace with your actual OAuth app credentials
 OAUTH_CONFIG = {
@@ -75,15 +241,11 @@ def root():
 def login():
     error = None
     if request.method == 'POST':
-        db = load_db()
         email = request.form.get('email')
         password = request.form.get('password')
-        user = next((u for u in db['users'] if u.get('email', '').lower() == email.lower() and u['password'] == hash_pw(password)), None)
-        if user:
+        user = store.find_user_by_email(email)
+        if user and user['password'] == hash_pw(password):
             session['user_id'] = user['username']
-            # Update user online status
-            user['online'] = True
-            save_db(db)
             return redirect(url_for('home'))
         error = 'Invalid email or password.'
     return render_template('login.html', error=error)
@@ -92,53 +254,38 @@ def login():
 def register():
     error = None
     if request.method == 'POST':
-        db = load_db()
         full_name = request.form.get('username')  # This is actually full name now
         email = request.form.get('email')
         password = request.form.get('password')
-
-        # Check if email already exists
-        if any(u.get('email', '').lower() == email.lower() for u in db['users']):
-            error = 'Email already exists.'
-        else:
-            # Generate username from email
-            username = email.split('@')[0]
-            # Ensure username is unique
-            base_username = username
-            counter = 1
-            while any(u['username'].lower() == username.lower() for u in db['users']):
-                username = f"{base_username}{counter}"
-                counter += 1
-
-            user_id = username.lower().replace(' ', '_')
-            db['users'].append({
-                'id': user_id,
-                'username': username,
-                'email': email,
-                'password': hash_pw(password),
-                'display_name': full_name,
-                'photo': None,
-                'avatar': None,
-                'online': False,
-                'bio': '',
-                'followers': [],
-                'following': [],
-                'clips_liked': [],
-                'clips_shared': []
-            })
-            save_db(db)
-            return redirect(url_for('login'))
+        # Hold the write lock so two workers cannot claim the same email or username
+        with store.transaction():
+            # Check if email already exists
+            if store.find_user_by_email(email):
+                error = 'Email already exists.'
+            else:
+                # Generate a unique username from email
+                username = store.unique_username(email.split('@')[0])
+
+                user_id = username.lower().replace(' ', '_')
+                store.insert('users', {
+                    'id': user_id,
+                    'username': username,
+                    'email': email,
+                    'password': hash_pw(password),
+                    'display_name': full_name,
+                    'photo': None,
+                    'avatar': None,
+                    'online': False,
+                    'bio': '',
+                    'clips_liked': [],
+                    'clips_shared': []
+                })
+                push_user(username)
+                return redirect(url_for('login'))
     return render_template('register.html', error=error)
 
 @app.route('/logout')
 def logout():
-    if 'user_id' in session:
-        # Update user offline status
-        db = load_db()
-        user = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-        if user:
-            user['online'] = False
-            save_db(db)
     session.pop('user_id', None)
     return redirect(url_for('login'))
 
@@ -157,13 +304,10 @@ def dev_login_post():
         return render_template('dev_login.html', error='Invalid dev code.')
 
     # Check if user exists and password is correct
-    db = load_db()
-    user = next((u for u in db['users'] if u.get('email', '').lower() == email.lower() and u['password'] == hash_pw(password)), None)
-    if user:
+    user = store.find_user_by_email(email)
+    if user and user['password'] == hash_pw(password):
         session['user_id'] = user['username']
         session['is_dev'] = True
-        user['online'] = True
-        save_db(db)
         return redirect(url_for('dev_dashboard'))
 
     return render_template('dev_login.html', error='Invalid email or password.')
@@ -174,23 +318,25 @@ def dev_dashboard():
         return redirect(url_for('login'))
 
     db = load_db()
-    return render_template('dev_dashboard.html', users=db['users'], clips=db.get('clips', []), blogs=db.get('blogs', []))
+    online = presence.online_users()
+    follow_counts = social.counts_many(u['username'] for u in db['users'])
+    users = [dict(u, online=u['username'] in online, followers_count=follow_counts.get(u['username'], (0, 0))[0])
+             for u in db['users']]
+    return render_template('dev_dashboard.html', users=users, clips=db.get('clips', []), blogs=db.get('blogs', []))
 
 @app.route('/dev/delete-user/<user_id>', methods=['POST'])
 def dev_delete_user(user_id):
     if not session.get('is_dev'):
         return jsonify({'error': 'Unauthorized'}), 403
 
-    db = load_db()
-    # Find and remove user
-    user_to_remove = None
-    for i, user in enumerate(db['users']):
-        if user['id'] == user_id or user['username'] == user_id:
-            user_to_remove = db['users'].pop(i)
-            break
+    # Find and remove user (ids are lowercased usernames)
+    user_to_remove = store.find_users([user_id]).get(user_id.lower())
 
     if user_to_remove:
-        save_db(db)
+        store.delete('users', user_to_remove['username'])
+        social.remove_user(user_to_remove['username'])
+        read_state.remove_user(user_to_remove['username'])
+        push_user(user_to_remove['username'])
         return jsonify({'success': True, 'message': f'User {user_to_remove["username"]} deleted'})
     else:
         return jsonify({'error': 'User not found'}), 404
@@ -201,6 +347,66 @@ def dev_logout():
     session.pop('user_id', None)
     return redirect(url_for('login'))
 
+# --- Profiling ---
+# Slow requests to these endpoints are what the dashboard shows unless asked for others (?endpoints=all)
+PROFILED_ENDPOINTS = ('api_send_message', 'home', 'clips')
+
+@app.before_request
+def start_request_profile():
+    g.profile = profiler.request_started()
+    profiler.start(socketio.start_background_task, socketio.sleep)
+
+@app.after_request
+def finish_request_profile(response):
+    profiler.request_finished(g.pop('profile', None), request.endpoint, request.method, request.path, response.status_code)
+    return response
+
+@app.route('/dev/profiler')
+def dev_profiler_status():
+    """Workers, slow-request threshold, recent slow requests with their top stacks, saved profiles"""
+    if not session.get('is_dev'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    endpoints = request.args.get('endpoints')
+    endpoints = None if endpoints == 'all' else endpoints.split(',') if endpoints else PROFILED_ENDPOINTS
+    status = profiler.status(endpoints, limit=min(request.args.get('limit', 20, type=int), SLOW_REQUEST_KEEP))
+    status.update(endpoints=endpoints, current_pid=os.getpid())
+    return jsonify(status)
+
+@app.route('/dev/profiler/workers/<int:pid>', methods=['POST'])
+def dev_profiler_control(pid):
+    """Start ({"profiling": true}) or stop a worker's profiler; it applies this within a second"""
+    if not session.get('is_dev'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    profiler.set_profiling(pid, bool(data.get('profiling')))
+    return jsonify({'pid': pid, 'profiling': bool(data.get('profiling'))})
+
+@app.route('/dev/profiler/settings', methods=['POST'])
+def dev_profiler_settings():
+    """Set the slow-request threshold in milliseconds for every worker (0 turns capture off)"""
+    if not session.get('is_dev'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        slow_ms = max(float(data.get('slow_ms', 0)), 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'slow_ms must be a number'}), 400
+    profiler.set_slow_ms(slow_ms)
+    return jsonify({'slow_ms': slow_ms})
+
+@app.route('/dev/profiler/<kind>/<int:item_id>.txt')
+def dev_profiler_stacks(kind, item_id):
+    """Collapsed stacks of a saved profile or slow request, ready for flamegraph.pl or speedscope"""
+    if not session.get('is_dev'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    stacks = profiler.stacks(kind, item_id) if kind in ('profile', 'slow') else None
+    if stacks is None:
+        return jsonify({'error': 'Not found'}), 404
+    response = make_response(stacks)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['Content-Disposition'] = f'attachment; filename="{kind}-{item_id}.folded"'
+    return response
+
 # --- Demo OAuth Routes (No Real Credentials Needed) ---
 @app.route('/auth/google')
 def auth_google():
@@ -298,52 +504,38 @@ def auth_google_callback():
             return redirect(url_for('login', error='Email verification required'))
 
         # Create or update user
-        db = load_db()
-
-        # Generate username from email
-        username = email.split('@')[0]
-
-        # Ensure username is unique
-        base_username = username
-        counter = 1
-        while any(u['username'].lower() == username.lower() for u in db['users']):
-            username = f"{base_username}{counter}"
-            counter += 1
-
-        # Check if user exists by email
-        user = next((u for u in db['users'] if u.get('email', '').lower() == email.lower()), None)
-
-        if not user:
-            # Create new user with real Google data
-            user_id = username.lower().replace(' ', '_')
-            new_user = {
-                'id': user_id,
-                'username': username,
-                'email': email,
-                'password': '',  # No password for OAuth users
-                'display_name': name,
-                'photo': None,
-                'avatar': None,
-                'online': True,
-                'bio': f'Signed up with Google',
-                'followers': [],
-                'following': [],
-                'clips_liked': [],
-                'clips_shared': [],
-                'oauth_provider': 'google',
-                'oauth_id': email,
-                'oauth_picture': picture
-            }
-            db['users'].append(new_user)
-            save_db(db)
-            user = new_user
-        else:
-            # Update existing user
-            user['online'] = True
-            user['oauth_provider'] = 'google'
-            if picture:
-                user['oauth_picture'] = picture
-            save_db(db)
+        with store.transaction():
+            # Check if user exists by email
+            user = store.find_user_by_email(email)
+
+            if not user:
+                # Create new user with real Google data and a unique username from email
+                username = store.unique_username(email.split('@')[0])
+                user_id = username.lower().replace(' ', '_')
+                new_user = {
+                    'id': user_id,
+                    'username': username,
+                    'email': email,
+                    'password': '',  # No password for OAuth users
+                    'display_name': name,
+                    'photo': None,
+                    'avatar': None,
+                    'online': True,
+                    'bio': f'Signed up with Google',
+                    'clips_liked': [],
+                    'clips_shared': [],
+                    'oauth_provider': 'google',
+                    'oauth_id': email,
+                    'oauth_picture': picture
+                }
+                store.insert('users', new_user)
+                push_user(username)
+                user = new_user
+            else:
+                # Update existing user
+                store.set(('users', user['username'], 'oauth_provider'), 'google')
+                if picture:
+                    store.set(('users', user['username'], 'oauth_picture'), picture)
 
         # Set session
         session['user_id'] = user['username']
@@ -370,55 +562,41 @@ def oauth_callback():
     provider = oauth_data['provider']
 
     # Create or find user
-    db = load_db()
-
-    email = oauth_data['email']
-    name = oauth_data['name']
-
-    # Generate username from email
-    username = email.split('@')[0]
+    with store.transaction():
+        email = oauth_data['email']
+        name = oauth_data['name']
 
-    # Ensure username is unique
-    base_username = username
-    counter = 1
-    while any(u['username'].lower() == username.lower() for u in db['users']):
-        username = f"{base_username}{counter}"
-        counter += 1
-
-    # Check if user exists by email
-    user = next((u for u in db['users'] if u.get('email', '').lower() == email.lower()), None)
+        # Check if user exists by email
+        user = store.find_user_by_email(email)
 
-    if not user:
-        # Create new user with real OAuth data
-        user_id = username.lower().replace(' ', '_')
-        new_user = {
-            'id': user_id,
-            'username': username,
-            'email': email,
-            'password': '',  # No password for OAuth users
-            'display_name': name,
-            'photo': None,
-            'avatar': None,
-            'online': True,
-            'bio': f'Signed up with {provider.title()}',
-            'followers': [],
-            'following': [],
-            'clips_liked': [],
-            'clips_shared': [],
-            'oauth_provider': provider,
-            'oauth_id': email,
-            'oauth_picture': oauth_data.get('picture')
-        }
-        db['users'].append(new_user)
-        save_db(db)
-        user = new_user
-    else:
-        # Update existing user
-        user['online'] = True
-        user['oauth_provider'] = provider
-        if oauth_data.get('picture'):
-            user['oauth_picture'] = oauth_data['picture']
-        save_db(db)
+        if not user:
+            # Create new user with real OAuth data and a unique username from email
+            username = store.unique_username(email.split('@')[0])
+            user_id = username.lower().replace(' ', '_')
+            new_user = {
+                'id': user_id,
+                'username': username,
+                'email': email,
+                'password': '',  # No password for OAuth users
+                'display_name': name,
+                'photo': None,
+                'avatar': None,
+                'online': True,
+                'bio': f'Signed up with {provider.title()}',
+                'clips_liked': [],
+                'clips_shared': [],
+                'oauth_provider': provider,
+                'oauth_id': email,
+                'oauth_picture': oauth_data.get('picture')
+            }
+            store.insert('users', new_user)
+            push_user(username)
+            user = new_user
+        else:
+            # Update existing user
+            store.set(('users', user['username'], 'oauth_provider'), provider)
+            if oauth_data.get('picture'):
+                store.set(('users', user['username'], 'oauth_picture'), oauth_data['picture'])
 
     # Set session
     session['user_id'] = user['username']
@@ -439,33 +617,30 @@ def triton_logout():
 @app.route('/home')
 @login_required
 def home():
-    db = load_db()
-    user = next((u for u in db['users'] if u['username'] == session.get('user_id')), None) if 'user_id' in session else None
-    return render_template('home.html', user=user, users=db['users'])
+    online = presence.online_users()
+    users = [dict(u, online=u['username'] in online) for u in load_db()['users']]
+    user = next((u for u in users if u['username'] == session.get('user_id')), None) if 'user_id' in session else None
+    return render_template('home.html', user=user, users=users)
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    db = load_db()
-    user = next(u for u in db['users'] if u['username'] == session['user_id'])
+    user = store.get('users', session['user_id'])
     if request.method == 'POST':
         display_name = request.form.get('display_name', '').strip()
         bio = request.form.get('bio', '').strip()
         if display_name:
-            user['display_name'] = display_name
+            store.set(('users', user['username'], 'display_name'), display_name)
         if bio:
-            user['bio'] = bio
+            store.set(('users', user['username'], 'bio'), bio)
         if 'avatar' in request.files:
             file = request.files['avatar']
             if file and file.filename:
                 ext = os.path.splitext(file.filename)[1]
                 filename = secure_filename(f"{user['username']}_{uuid.uuid4().hex}{ext}")
-                # Create photos directory if it doesn't exist
-                os.makedirs('photos', exist_ok=True)
-                file.save(os.path.join('photos', filename))
-                user['avatar'] = filename
-                user['photo'] = filename  # Keep both for compatibility
-        save_db(db)
+                # Already streamed to disk; the old avatar stays until a worker has moved this one into photos/
+                upload_pipeline.submit(stage(file, UPLOAD_STAGING, io_pool), finalize_avatar, user['username'], filename)
+        push_user(user['username'])
         return redirect(url_for('profile'))
     return render_template('profile.html', user=user)
 
@@ -481,22 +656,26 @@ def guest_mode():
     return redirect(url_for('guest_home'))
 
 @app.route('/guest/home')
+@anonymous_page('chat', 'user')
 def guest_home():
     """Guest mode home page - view-only chat"""
-    db = load_db()
-    return render_template('guest_home.html', users=db['users'], chats=db.get('chats', []))
+    return render_template('guest_home.html', chats=store.chats())
 
 @app.route('/guest/clips')
+@anonymous_page('clip', 'user')
 def guest_clips():
     """Guest mode clips - view-only"""
-    db = load_db()
-    return render_template('guest_clips.html', clips=db.get('clips', []), users=db['users'])
+    cards, _ = clip_feed_page('latest', None, GUEST_CLIPS_LIMIT)
+    clip_authors = authors.get_many(card['author'] for card in cards)
+    return render_template('guest_clips.html', clips=cards, users=list(clip_authors.values()))
 
 @app.route('/guest/blog')
+@anonymous_page('blog', 'user')
 def guest_blog():
     """Guest mode blog - view-only"""
-    db = load_db()
-    return render_template('guest_blog.html', blogs=db.get('blogs', []), users=db['users'])
+    blogs = store.blogs()
+    blog_authors = authors.get_many(blog.get('author') for blog in blogs)
+    return render_template('guest_blog.html', blogs=blogs, users=list(blog_authors.values()))
 
 @app.route('/guest/exit')
 def exit_guest():
@@ -525,26 +704,83 @@ def oauth_debug():
     <p><a href="/login">← Back to Login</a></p>
     """
 
+def send_media(directory, filename):
+    """Serve a logical media name from the blob store, or from its directory if it predates the store.
+
+    Byte ranges, If-None-Match/If-Range and 304s come from werkzeug's conditional responses;
+    blobs get their SHA-256 as a strong ETag.
+    """
+    found = blobs.lookup(f"{directory}/{filename}")
+    if found is None:
+        response = send_from_directory(directory, filename, max_age=MEDIA_MAX_AGE)
+    elif MEDIA_OFFLOAD == 'x-accel':
+        sha256, size = found
+        response = make_response('')
+        response.set_etag(sha256)
+        response.headers['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response.cache_control.max_age = MEDIA_MAX_AGE
+        response = response.make_conditional(request)
+        if response.status_code == 200:
+            # nginx reads the file (and answers Range requests) from its internal location
+            response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}{sha256[:2]}/{sha256}"
+    else:
+        sha256, size = found
+        response = send_file(
+            os.path.abspath(blobs.blob_path(sha256)), mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            download_name=filename, etag=sha256, conditional=True, max_age=MEDIA_MAX_AGE
+        )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def media_source(directory, filename):
+    """``(path, content key)`` of a stored media file, or None"""
+    found = blobs.lookup(f"{directory}/{filename}")
+    if found:
+        return blobs.blob_path(found[0]), found[0]
+    # Predates the blob store: key it by path, mtime and size instead of hashing it per request
+    path = os.path.join(directory, secure_filename(filename))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return path, hashlib.sha256(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+
+def send_avatar(filename):
+    """Serve a profile photo, resized to the ?s= variant when one is asked for"""
+    size = pick_size(request.args.get('s'))
+    source = media_source('photos', filename) if size else None
+    webp = 'image/webp' in request.accept_mimetypes.values()
+    variant = io_pool.run(avatar_variants.get, *source, size, webp=webp) if source else None
+    if not variant:
+        return send_media('photos', filename)
+    response = send_file(
+        os.path.abspath(variant), mimetype=mimetypes.guess_type(variant)[0],
+        etag=os.path.basename(variant), conditional=True, max_age=MEDIA_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
 @app.route('/avatars/<filename>')
 def serve_avatar(filename):
-    return send_from_directory('photos', filename)
+    return send_avatar(filename)
 
 @app.route('/photos/<filename>')
 def serve_photo(filename):
-    return send_from_directory('photos', filename)
+    return send_avatar(filename)
 
 # --- Blog Routes ---
 @app.route('/blog')
+@anonymous_page('blog')
 def blog():
-    db = load_db()
-    blogs = db.get('blogs', [])
-    return render_template('blog.html', blogs=blogs)
+    return render_template('blog.html', blogs=store.blogs())
 
 @app.route('/blog/create', methods=['GET', 'POST'])
 @login_required
 def create_blog():
     if request.method == 'POST':
-        db = load_db()
         title = request.form.get('title', '').strip()
         content = request.form.get('content', '').strip()
         if title and content:
@@ -557,58 +793,105 @@ def create_blog():
                 'created_at': '',
                 'updated_at': ''
             }
-            if 'blogs' not in db:
-                db['blogs'] = []
-            db['blogs'].append(blog)
-            save_db(db)
+            store.insert('blogs', blog)
+            search_index.add_blog(blog)
+            record_change('blog', blog_id)
             return redirect(url_for('blog'))
     return render_template('create_blog.html')
 
 @app.route('/blog/<blog_id>')
 def view_blog(blog_id):
-    db = load_db()
-    blog = next((b for b in db.get('blogs', []) if b['id'] == blog_id), None)
+    blog = store.get('blogs', blog_id)
     if not blog:
         return redirect(url_for('blog'))
     return render_template('view_blog.html', blog=blog)
 
 # --- Clips Routes ---
+# The page renders the first screenful; clips.js pulls the rest from /api/clips/feed while scrolling
+CLIPS_FIRST_SCREEN = 3
+CLIP_PAGE_SIZE = 10
+MAX_CLIP_PAGE_SIZE = 50
+GUEST_CLIPS_LIMIT = 24
+trending = TrendingFeed(store, interval=int(os.environ.get('CONNECTRA_TRENDING_INTERVAL', '300')))
+
+def clip_cards(clips, viewer=None):
+    """Copies of ``clips`` carrying their author's display name and avatar and whether ``viewer`` follows them
+
+    One cached user lookup and one batched follow lookup per page.
+    """
+    found = authors.get_many(clip['author'] for clip in clips)
+    followed = social.following_among(viewer, [clip['author'] for clip in clips]) if viewer else set()
+    cards = []
+    for clip in clips:
+        author = found.get(clip['author'].lower(), {})
+        cards.append(dict(clip, author_display_name=author.get('display_name'), author_avatar=author.get('avatar'),
+                          author_followed=clip['author'] in followed))
+    return cards
+
+COMMENT_PAGE_SIZE = 20
+MAX_COMMENT_PAGE_SIZE = 100
+
+def comment_cards(comments, viewer=None):
+    """Copies of ``comments`` with their author's current display name and avatar and whether ``viewer`` liked them
+
+    ``liked_by`` stays on the server: a popular comment's list would otherwise ride along with every page.
+    """
+    comments = list(comments)
+    found = authors.get_many(comment['author'] for comment in comments)
+    cards = []
+    for comment in comments:
+        author = found.get(comment['author'].lower(), {})
+        card = {key: value for key, value in comment.items() if key != 'liked_by'}
+        card.update(author_display_name=author.get('display_name') or comment['author'], author_avatar=author.get('avatar'),
+                    liked=viewer in comment.get('liked_by', []))
+        cards.append(card)
+    return cards
+
+def clip_feed_page(sort, cursor, limit):
+    """One page of the 'latest' or 'trending' feed: ``(cards, next_cursor)``"""
+    if sort == 'trending':
+        ids, next_cursor = trending.page(cursor, limit, spawn=socketio.start_background_task)
+        comment_counts = store.comment_counts(ids)
+        clips = [dict(clip, comment_count=comment_counts.get(clip_id, 0))
+                 for clip_id, clip in ((clip_id, store.get('clips', clip_id, shallow=True)) for clip_id in ids) if clip]
+    else:
+        clips, next_cursor = store.clips_page(before=cursor, limit=limit)
+    return clip_cards([clip for clip in clips if is_ready(clip)], session.get('user_id')), next_cursor
+
 @app.route('/clips')
+@anonymous_page('clip', 'user', query=('sort',))
 def clips():
-    db = load_db()
-    clips = db.get('clips', [])
-    users = db.get('users', [])
-    # Sort by creation date, newest first
-    clips.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return render_template('clips.html', clips=clips, users=users)
+    sort = 'trending' if request.args.get('sort') == 'trending' else 'latest'
+    cards, next_cursor = clip_feed_page(sort, None, CLIPS_FIRST_SCREEN)
+    return render_template('clips.html', clips=cards, next_cursor=next_cursor, sort=sort)
+
+@app.route('/api/clips/feed')
+def api_clips_feed():
+    """Infinite scroll: ?cursor=<next_cursor>&limit=N[&sort=trending]"""
+    sort = 'trending' if request.args.get('sort') == 'trending' else 'latest'
+    limit = min(max(request.args.get('limit', CLIP_PAGE_SIZE, type=int), 1), MAX_CLIP_PAGE_SIZE)
+    cards, next_cursor = clip_feed_page(sort, request.args.get('cursor'), limit)
+    return jsonify({'clips': cards, 'next_cursor': next_cursor, 'sort': sort})
 
 @app.route('/clips/upload', methods=['GET', 'POST'])
 @login_required
 def upload_clip():
     if request.method == 'POST':
-        db = load_db()
         title = request.form.get('title', '').strip()
         description = request.form.get('description', '').strip()
 
         if 'video' in request.files:
             video_file = request.files['video']
             if video_file and video_file.filename:
-                # Create clips directory if it doesn't exist
-                os.makedirs('clips', exist_ok=True)
-
                 # Validate video file
                 ext = os.path.splitext(video_file.filename)[1].lower()
                 if ext not in ['.mp4', '.mov', '.avi', '.webm']:
                     return render_template('upload_clip.html', error='Please upload a valid video file (MP4, MOV, AVI, WEBM)')
 
-                # Save video file
+                # Already streamed to disk and hashed; the clip is listed once a worker has moved it into clips/
                 clip_id = str(uuid.uuid4())
                 filename = secure_filename(f"{clip_id}{ext}")
-                video_path = os.path.join('clips', filename)
-                video_file.save(video_path)
-
-                # Create thumbnail (placeholder for now)
-                thumbnail = f"{clip_id}_thumb.jpg"
+                staged = stage(video_file, UPLOAD_STAGING, io_pool)
 
                 # Save clip data
                 clip = {
@@ -616,73 +899,85 @@ def upload_clip():
                     'title': title or 'Untitled Clip',
                     'description': description,
                     'video_filename': filename,
-                    'thumbnail': thumbnail,
+                    'thumbnail': None,  # Poster frame, filled in by process_clip_job
+                    'rendition': None,
                     'author': session['user_id'],
                     'created_at': datetime.now().isoformat(),
                     'views': 0,
                     'likes': 0,
                     'comments': [],
-                    'duration': 0  # TODO: Get actual video duration
+                    'duration': 0,
+                    'width': None,
+                    'height': None,
+                    'size': staged.size,
+                    'sha256': staged.sha256,
+                    'status': 'processing',
+                    'media_status': 'queued'
                 }
 
-                if 'clips' not in db:
-                    db['clips'] = []
-                db['clips'].append(clip)
-                save_db(db)
+                store.insert('clips', clip)
+                search_index.add_clip(clip)
+                record_change('clip', clip_id)
+                upload_pipeline.submit(staged, finalize_clip, clip_id, filename, on_failure=fail_clip)
 
                 return redirect(url_for('clips'))
 
     return render_template('upload_clip.html')
 
+def count(path, current):
+    """Buffered increment of a counter; returns the caller's up-to-date value"""
+    counters.start(socketio.start_background_task, socketio.sleep)
+    return counters.incr(path, current)
+
 @app.route('/clips/<clip_id>')
 def view_clip(clip_id):
-    db = load_db()
-    clip = next((c for c in db.get('clips', []) if c['id'] == clip_id), None)
+    clip = store.get('clips', clip_id, shallow=True)
     if not clip:
+        # Clip ids never contain a dot, video file names always do: this route shadows serve_clip
+        if '.' in clip_id:
+            return serve_clip(clip_id)
         return redirect(url_for('clips'))
 
-    # Increment view count
-    clip['views'] += 1
-    save_db(db)
+    # Count the view (a copy: the store's own record only changes when the counter flushes)
+    clip = dict(clip, views=count(('clips', clip_id, 'views'), clip.get('views', 0)),
+                comment_count=store.comment_counts([clip_id]).get(clip_id, 0))
 
-    return render_template('view_clip.html', clip=clip)
+    # Newest comments first; older ones come from /api/clips/<clip_id>/comments
+    comments, next_cursor = store.comments(clip_id, limit=COMMENT_PAGE_SIZE)
+    return render_template('view_clip.html', clip=clip, comments=comment_cards(reversed(comments), session.get('user_id')),
+                           comments_cursor=next_cursor)
 
 @app.route('/clips/<filename>')
 def serve_clip(filename):
-    return send_from_directory('clips', filename)
+    return send_media('clips', filename)
 
 # --- Clips API ---
 @app.route('/api/clips/<clip_id>/like', methods=['POST'])
 @login_required
 def like_clip(clip_id):
-    db = load_db()
-    clip = next((c for c in db.get('clips', []) if c['id'] == clip_id), None)
-    if not clip:
-        return jsonify({'error': 'Clip not found'}), 404
-
-    user_id = session['user_id']
-    if 'liked_by' not in clip:
-        clip['liked_by'] = []
-
-    if user_id in clip['liked_by']:
-        # Unlike
-        clip['liked_by'].remove(user_id)
-        clip['likes'] = len(clip['liked_by'])
-        liked = False
-    else:
-        # Like
-        clip['liked_by'].append(user_id)
-        clip['likes'] = len(clip['liked_by'])
-        liked = True
+    with store.transaction():
+        clip = store.get('clips', clip_id, shallow=True)
+        if not clip:
+            return jsonify({'error': 'Clip not found'}), 404
+
+        user_id = session['user_id']
+        if user_id in clip.get('liked_by', []):
+            # Unlike
+            liked_by = store.remove(('clips', clip_id, 'liked_by'), user_id)
+            liked = False
+        else:
+            # Like
+            liked_by = store.append(('clips', clip_id, 'liked_by'), user_id)
+            liked = True
+        likes = store.set(('clips', clip_id, 'likes'), len(liked_by))
+    record_change('clip', clip_id)
 
-    save_db(db)
-    return jsonify({'liked': liked, 'likes': clip['likes']})
+    return jsonify({'liked': liked, 'likes': likes})
 
 @app.route('/api/clips/<clip_id>/comment', methods=['POST'])
 @login_required
 def comment_clip(clip_id):
-    db = load_db()
-    clip = next((c for c in db.get('clips', []) if c['id'] == clip_id), None)
+    clip = store.get('clips', clip_id, shallow=True)
     if not clip:
         return jsonify({'error': 'Clip not found'}), 404
 
@@ -690,100 +985,100 @@ def comment_clip(clip_id):
     if not content:
         return jsonify({'error': 'Comment cannot be empty'}), 400
 
-    # Get user info for comment
-    user = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-
+    # Only the username is stored: display name and avatar are looked up when comments are read
     comment = {
         'id': str(uuid.uuid4()),
         'author': session['user_id'],
-        'author_display_name': user['display_name'] if user else session['user_id'],
-        'author_avatar': user.get('avatar') if user else None,
         'content': content,
         'created_at': datetime.now().isoformat(),
         'likes': 0,
         'liked_by': []
     }
 
-    if 'comments' not in clip:
-        clip['comments'] = []
-    clip['comments'].append(comment)
-    save_db(db)
+    store.append(('clips', clip_id, 'comments'), comment)
+    record_change('clip', clip_id)
+
+    return jsonify(comment_cards([comment], session['user_id'])[0])
 
-    return jsonify(comment)
+@app.route('/api/clips/<clip_id>/comments')
+def api_clip_comments(clip_id):
+    """One page of comments, oldest first: ?cursor=<next_cursor>&limit=N walks back through older ones"""
+    if not store.get('clips', clip_id, shallow=True):
+        return jsonify({'error': 'Clip not found'}), 404
+    limit = min(max(request.args.get('limit', COMMENT_PAGE_SIZE, type=int), 1), MAX_COMMENT_PAGE_SIZE)
+    comments, next_cursor = store.comments(clip_id, before=request.args.get('cursor'), limit=limit)
+    return jsonify({'clip_id': clip_id, 'comments': comment_cards(comments, session.get('user_id')), 'next_cursor': next_cursor})
 
 # --- Following System ---
 @app.route('/api/follow/<username>', methods=['POST'])
 @login_required
 def follow_user(username):
-    db = load_db()
     current_user = session['user_id']
 
     if current_user == username:
         return jsonify({'error': 'Cannot follow yourself'}), 400
 
     # Find users
-    user_to_follow = next((u for u in db['users'] if u['username'] == username), None)
-    current_user_obj = next((u for u in db['users'] if u['username'] == current_user), None)
-
-    if not user_to_follow or not current_user_obj:
+    if not store.get('users', username, shallow=True) or not store.get('users', current_user, shallow=True):
         return jsonify({'error': 'User not found'}), 404
 
-    # Initialize arrays if they don't exist
-    if 'following' not in current_user_obj:
-        current_user_obj['following'] = []
-    if 'followers' not in user_to_follow:
-        user_to_follow['followers'] = []
-
-    # Check if already following
-    if username in current_user_obj['following']:
-        # Unfollow
-        current_user_obj['following'].remove(username)
-        user_to_follow['followers'].remove(current_user)
-        following = False
-    else:
-        # Follow
-        current_user_obj['following'].append(username)
-        user_to_follow['followers'].append(current_user)
-        following = True
-
-    save_db(db)
+    # Follow, or unfollow if already following (one graph transaction, counts included)
+    following, followers_count, following_count = social.toggle(current_user, username)
 
     return jsonify({
         'following': following,
-        'followers_count': len(user_to_follow['followers']),
-        'following_count': len(current_user_obj['following'])
+        'followers_count': followers_count,
+        'following_count': following_count
     })
 
-# --- Sharing System ---
-@app.route('/api/clips/<clip_id>/share', methods=['POST'])
+FOLLOW_PAGE_SIZE = 50
+MAX_FOLLOW_PAGE_SIZE = 200
+
+def follow_page(username, direction):
+    """Read ?cursor=<next_cursor>&limit=N and return one page of followers or followed users"""
+    limit = min(max(request.args.get('limit', FOLLOW_PAGE_SIZE, type=int), 1), MAX_FOLLOW_PAGE_SIZE)
+    fetch = social.followers if direction == 'followers' else social.following
+    usernames, next_cursor = fetch(username, before=request.args.get('cursor'), limit=limit)
+    found = store.find_users(usernames)
+    users = [public_user(found[name.lower()]) for name in usernames if name.lower() in found]
+    return {'username': username, direction: users, 'next_cursor': next_cursor}
+
+@app.route('/api/user/<username>/followers')
 @login_required
-def share_clip(clip_id):
-    db = load_db()
-    clip = next((c for c in db.get('clips', []) if c['id'] == clip_id), None)
-    if not clip:
-        return jsonify({'error': 'Clip not found'}), 404
+def api_user_followers(username):
+    if not store.get('users', username, shallow=True):
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify(follow_page(username, 'followers'))
 
-    user = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-    if not user:
+@app.route('/api/user/<username>/following')
+@login_required
+def api_user_following(username):
+    if not store.get('users', username, shallow=True):
         return jsonify({'error': 'User not found'}), 404
+    return jsonify(follow_page(username, 'following'))
 
-    # Initialize shares tracking
-    if 'shares' not in clip:
-        clip['shares'] = 0
-        clip['shared_by'] = []
-    if 'clips_shared' not in user:
-        user['clips_shared'] = []
+# --- Sharing System ---
+@app.route('/api/clips/<clip_id>/share', methods=['POST'])
+@login_required
+def share_clip(clip_id):
+    with store.transaction():
+        clip = store.get('clips', clip_id, shallow=True)
+        if not clip:
+            return jsonify({'error': 'Clip not found'}), 404
 
-    # Track share
-    if clip_id not in user['clips_shared']:
-        user['clips_shared'].append(clip_id)
-        clip['shared_by'].append(session['user_id'])
-        clip['shares'] += 1
+        user = store.get('users', session['user_id'])
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
 
-    save_db(db)
+        # Track share
+        shares = clip.get('shares', 0)
+        if clip_id not in user.get('clips_shared', []):
+            store.append(('users', user['username'], 'clips_shared'), clip_id)
+            store.append(('clips', clip_id, 'shared_by'), session['user_id'])
+            shares = count(('clips', clip_id, 'shares'), shares)
 
     return jsonify({
-        'shares': clip['shares'],
+        'shares': shares,
         'shared': True
     })
 
@@ -791,64 +1086,48 @@ def share_clip(clip_id):
 @app.route('/api/comments/<comment_id>/like', methods=['POST'])
 @login_required
 def like_comment(comment_id):
-    db = load_db()
     current_user = session['user_id']
 
-    # Find comment in all clips
-    comment = None
-    for clip in db.get('clips', []):
-        for c in clip.get('comments', []):
-            if c['id'] == comment_id:
-                comment = c
-                break
-        if comment:
-            break
-
-    if not comment:
-        return jsonify({'error': 'Comment not found'}), 404
-
-    # Initialize likes if not present
-    if 'liked_by' not in comment:
-        comment['liked_by'] = []
-        comment['likes'] = 0
-
-    # Toggle like
-    if current_user in comment['liked_by']:
-        comment['liked_by'].remove(current_user)
-        comment['likes'] = len(comment['liked_by'])
-        liked = False
-    else:
-        comment['liked_by'].append(current_user)
-        comment['likes'] = len(comment['liked_by'])
-        liked = True
-
-    save_db(db)
+    # Find comment through the comment id index
+    with store.transaction():
+        clip_id, comment = store.find_comment(comment_id)
+        if not comment:
+            return jsonify({'error': 'Comment not found'}), 404
+
+        # Toggle like
+        path = ('clips', clip_id, 'comments', comment_id)
+        if current_user in comment.get('liked_by', []):
+            liked_by = store.remove(path + ('liked_by',), current_user)
+            liked = False
+        else:
+            liked_by = store.append(path + ('liked_by',), current_user)
+            liked = True
+        likes = store.set(path + ('likes',), len(liked_by))
 
-    return jsonify({'liked': liked, 'likes': comment['likes']})
+    return jsonify({'liked': liked, 'likes': likes})
 
 # --- User Profile API ---
 @app.route('/api/user/<username>')
 @login_required
 def get_user_profile(username):
-    db = load_db()
-    user = next((u for u in db['users'] if u['username'] == username), None)
+    user = store.get('users', username, shallow=True)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    # Get user's clips
-    user_clips = [c for c in db.get('clips', []) if c['author'] == username]
+    # Get user's clips (without their comments; comment_count says how many)
+    user_clips = [c for c in store.clips() if c['author'] == username and is_ready(c)]
 
     # Check if current user is following this user
-    current_user_obj = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-    is_following = username in current_user_obj.get('following', []) if current_user_obj else False
+    is_following = social.is_following(session['user_id'], username)
+    followers_count, following_count = social.counts(username)
 
     profile_data = {
         'username': user['username'],
         'display_name': user['display_name'],
         'bio': user.get('bio', ''),
         'avatar': user.get('avatar'),
-        'followers_count': len(user.get('followers', [])),
-        'following_count': len(user.get('following', [])),
+        'followers_count': followers_count,
+        'following_count': following_count,
         'clips_count': len(user_clips),
         'is_following': is_following,
         'clips': user_clips[:10]  # Latest 10 clips
@@ -856,51 +1135,241 @@ def get_user_profile(username):
 
     return jsonify(profile_data)
 
+# --- Search ---
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+SEARCH_SCOPES = {'messages': 'message', 'blogs': 'blog', 'clips': 'clip'}
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    """?q=<words>[&scope=messages|blogs|clips]&cursor=<next_cursor>&limit=N, newest matches first.
+
+    Direct-chat messages only match for their participants (see search.py).
+    """
+    scope = SEARCH_SCOPES.get(request.args.get('scope'))
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), MAX_SEARCH_PAGE_SIZE)
+    results, next_cursor = search_index.search(request.args.get('q', ''), session['user_id'], scope,
+                                               before=request.args.get('cursor'), limit=limit)
+    visible = []
+    for result in results:
+        if result['kind'] == 'clip':
+            # Clips still being processed are not listed anywhere else either
+            clip = store.get('clips', result['id'], shallow=True)
+            if not clip or not is_ready(clip):
+                continue
+        if result['kind'] == 'message':
+            result['chat_id'] = result.pop('parent_id')
+        else:
+            result.pop('parent_id')
+        visible.append(result)
+    return jsonify({'results': visible, 'next_cursor': next_cursor, 'scope': request.args.get('scope') or 'all'})
+
+# --- Live updates ---
+# Clients load the user and chat lists once, then follow Socket.IO deltas
+# (user_status, user_update, chat_update, new_message). Every delta carries the
+# change-feed version; after a reconnect the client asks /api/sync for what it missed.
+PUBLIC_USER_FIELDS = ('id', 'username', 'display_name', 'avatar', 'photo', 'bio', 'last_seen')
+MAX_SYNC_CHANGES = 1000
+
+def public_user(user):
+    """The fields of a user record other users may see (no email, password hash or OAuth ids)"""
+    info = {field: user.get(field) for field in PUBLIC_USER_FIELDS}
+    info['online'] = presence.is_online(user['username'])
+    return info
+
+def chat_summary(chat, viewer, unread_count=0):
+    """Chat-list entry as ``viewer`` sees it, or None if the chat is not in their list"""
+    if chat.get('type') == 'direct':
+        other_participant = next((p for p in chat['participants'] if p != viewer), None)
+        if viewer not in chat['participants'] or not other_participant:
+            return None
+    elif chat.get('type') != 'public' and chat['id'] != 'global':
+        return None
+    latest, _ = store.messages(chat['id'], limit=1)
+    last_message = latest[0] if latest else None
+    if chat.get('type') != 'direct':
+        return {'id': chat['id'], 'type': 'public', 'name': chat['name'], 'last_message': last_message, 'unread_count': unread_count}
+    other_user = store.get('users', other_participant)
+    return {
+        'id': chat['id'],
+        'type': 'direct',
+        'other_user': {
+            'username': other_participant,
+            'display_name': other_user['display_name'] if other_user else other_participant,
+            'avatar': other_user['avatar'] if other_user else None,
+            'online': presence.is_online(other_participant)
+        },
+        'last_message': last_message,
+        'unread_count': unread_count
+    }
+
+def chat_audience(chat):
+    """Usernames allowed to see a chat, or None for public chats"""
+    return chat['participants'] if chat.get('type') == 'direct' else None
+
+def record_change(kind, key, audience=None):
+    """Log a change for /api/sync and the page cache and return its version"""
+    page_cache.invalidate(kind)
+    return store.record_change({'kind': kind, 'key': key, 'audience': audience})
+
+_last_seen_flushed_at = 0
+
+def publish_presence(changes):
+    """Broadcast one user_status batch for the transitions a presence tick settled"""
+    version = store.record_change({'kind': 'presence', 'key': None, 'audience': None, 'usernames': sorted(changes)})
+    socketio.emit('user_status', {
+        'statuses': [{'username': username, 'online': online} for username, online in changes.items()],
+        'version': version
+    })
+    if time.monotonic() - _last_seen_flushed_at >= LAST_SEEN_FLUSH_EVERY:
+        persist_last_seen()
+
+def persist_last_seen():
+    """Write the pending last_seen timestamps in one transaction"""
+    global _last_seen_flushed_at
+    _last_seen_flushed_at = time.monotonic()
+    batch = presence.take_last_seen()
+    if not batch:
+        return
+    with store.transaction():
+        for username, last_seen in batch.items():
+            if store.get('users', username, shallow=True):
+                store.set(('users', username, 'last_seen'), last_seen)
+
+# Runs before store.close (atexit is last-in, first-out)
+atexit.register(presence.close)
+atexit.register(persist_last_seen)
+
+def push_user(username):
+    """Tell every client a user was added, edited or deleted"""
+    user = store.get('users', username)
+    authors.forget(username)
+    version = record_change('user', username)
+    socketio.emit('user_update', {'username': username, 'user': public_user(user) if user else None, 'version': version})
+
+def push_chat(chat):
+    """Send a chat's list entry to everyone who can see it and return the change version"""
+    audience = chat_audience(chat)
+    version = record_change('chat', chat['id'], audience)
+    if audience is None:
+        socketio.emit('chat_update', {'chat': chat_summary(chat, None), 'version': version})
+    else:
+        for participant in audience:
+            summary = chat_summary(chat, participant, read_state.unread_count(participant, chat['id']))
+            socketio.emit('chat_update', {'chat': summary, 'version': version}, room=participant)
+    return version
+
+def push_unread(chat, sender):
+    """Send a direct chat's new unread counts to its participants' rooms after ``sender`` posted.
+
+    In public chats only the sender's own count is pushed: the others get new_message in the chat room
+    and count it themselves, which keeps a post O(1) however many users can see the chat.
+    """
+    for participant in chat_audience(chat) or [sender]:
+        count = 0 if participant == sender else read_state.unread_count(participant, chat['id'])
+        socketio.emit('unread_update', {'counts': {chat['id']: count}}, room=participant)
+
+@app.route('/api/sync')
+@login_required
+def api_sync():
+    """Users and chats changed after ?since=<version>; ``reset`` means reload /api/users and /api/user_chats"""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'version': store.version(), 'reset': True})
+    changes, version = store.changes_since(since)
+    # Blog and clip changes only invalidate cached pages
+    changes = changes and [change for change in changes if change['kind'] in ('user', 'chat', 'presence')]
+    if changes is None or len(changes) > MAX_SYNC_CHANGES:
+        return jsonify({'version': version, 'reset': True})
+
+    current_user = session['user_id']
+    changed = {'user': {}, 'chat': {}}
+    for change in changes:
+        if change['kind'] == 'presence':
+            changed['user'].update(dict.fromkeys(change['usernames'], True))
+        elif change['audience'] is None or current_user in change['audience']:
+            changed[change['kind']][change['key']] = True
+    users, removed_users, chats = [], [], []
+    for username in changed['user']:
+        user = store.get('users', username)
+        if user:
+            users.append(public_user(user))
+        else:
+            removed_users.append(username)
+    for chat_id in changed['chat']:
+        chat = store.get('chats', chat_id, shallow=True)
+        summary = chat_summary(chat, current_user, read_state.unread_count(current_user, chat_id)) if chat else None
+        if summary:
+            chats.append(summary)
+    return jsonify({'version': version, 'users': users, 'removed_users': removed_users, 'chats': chats})
+
 # --- API for chat/messages ---
 @app.route('/api/users')
 @login_required
 def api_users():
-    db = load_db()
-    return jsonify(db['users'])
+    return jsonify([public_user(u) for u in load_db()['users']])
 
 @app.route('/api/chats')
 @login_required
 def api_chats():
-    db = load_db()
-    return jsonify(db['chats'])
+    """Chats visible to the current user, without messages (page them with api_chat_messages)"""
+    current_user = session['user_id']
+    return jsonify([c for c in store.chats() if c.get('type') != 'direct' or current_user in c.get('participants', [])])
 
-def process_mentions(content, db):
-    """Process @ mentions in message content and return mentioned users"""
-    import re
-    mentioned_users = []
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
 
-    # Find all @username mentions
-    mentions = re.findall(r'@(\w+)', content)
+def message_page(chat_id):
+    """Read ?before=<cursor>&limit=N and return one page of the chat as a dict"""
+    limit = min(max(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), 1), MAX_MESSAGE_PAGE_SIZE)
+    messages, next_cursor = store.messages(chat_id, before=request.args.get('before'), limit=limit)
+    return {'chat_id': chat_id, 'messages': messages, 'next_cursor': next_cursor}
 
-    for mention in mentions:
-        # Find user by username
-        user = next((u for u in db['users'] if u['username'].lower() == mention.lower()), None)
-        if user:
-            mentioned_users.append(user['username'])
-            # Replace @username with clickable mention in content
-            content = content.replace(f'@{mention}', f'<span class="mention" data-user="{user["username"]}">@{user["username"]}</span>')
+@app.route('/api/chats/<chat_id>/messages')
+@login_required
+def api_chat_messages(chat_id):
+    """Page backwards through a chat's history with stable cursors"""
+    chat = store.get('chats', chat_id, shallow=True)
+    if not chat:
+        return jsonify({'error': 'Chat not found'}), 404
+    if chat.get('type') == 'direct' and session['user_id'] not in chat['participants']:
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(message_page(chat_id))
 
-    return content, mentioned_users
+MENTION_PATTERN = re.compile(r'@(\w+)')
+
+def process_mentions(content):
+    """Process @ mentions in message content and return mentioned users"""
+    # One indexed, case-insensitive lookup for every distinct name in the message
+    users = store.find_users({name.lower() for name in MENTION_PATTERN.findall(content)})
+    if not users:
+        return content, []
+    mentioned = {}
+
+    def render(match):
+        user = users.get(match.group(1).lower())
+        if not user:
+            return match.group(0)
+        mentioned[user['username']] = True
+        return f'<span class="mention" data-user="{user["username"]}">@{user["username"]}</span>'
+
+    # Single pass: each @word is replaced where it stands, so @dolan never rewrites part of @dolanp
+    return MENTION_PATTERN.sub(render, content), list(mentioned)
 
 @app.route('/api/send_message', methods=['POST'])
 @login_required
 def api_send_message():
-    db = load_db()
     chat_id = request.form['chat_id']
     content = request.form.get('content', '')
     user_id = session['user_id']
 
     # Find user ID for the message
-    user = next((u for u in db['users'] if u['username'] == user_id), None)
+    user = store.get('users', user_id)
     user_id_for_msg = user['id'] if user else user_id
 
     # Process @ mentions
-    processed_content, mentioned_users = process_mentions(content, db)
+    processed_content, mentioned_users = process_mentions(content)
 
     from datetime import datetime
     message = {
@@ -915,67 +1384,71 @@ def api_send_message():
         'attachments': []
     }
 
-    # Handle file uploads
+    # Handle file uploads: streamed to disk with size and hash while the form was parsed,
+    # so the message goes out now and a pipeline worker moves the file into uploads/
+    staged_uploads = []
     if 'file' in request.files:
         file = request.files['file']
         if file and file.filename:
-            # Create uploads directory if it doesn't exist
-            os.makedirs('uploads', exist_ok=True)
             ext = os.path.splitext(file.filename)[1]
             filename = secure_filename(f"{uuid.uuid4().hex}{ext}")
-            file_path = os.path.join('uploads', filename)
-            file.save(file_path)
+            staged = stage(file, UPLOAD_STAGING, io_pool)
 
             # Determine file type
             file_type = 'image' if ext.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp'] else \
                        'video' if ext.lower() in ['.mp4', '.avi', '.mov', '.webm'] else \
                        'document'
 
-            message['attachments'].append({
+            attachment = {
+                'id': uuid.uuid4().hex,
                 'filename': file.filename,
                 'stored_filename': filename,
                 'type': file_type,
-                'size': os.path.getsize(file_path)
-            })
+                'size': staged.size,
+                'sha256': staged.sha256,
+                'status': 'processing'
+            }
+            message['attachments'].append(attachment)
+            staged_uploads.append((staged, attachment))
 
             if not content:  # If no text content, set content to indicate file
                 message['content'] = f"Shared a {file_type}: {file.filename}"
 
-    # Find or create chat
-    chat = next((c for c in db['chats'] if c['id'] == chat_id), None)
-    if not chat:
-        # Create new chat if it doesn't exist (for DMs)
-        if chat_id.startswith('dm_'):
-            participants = chat_id.replace('dm_', '').split('_')
-            chat = {
-                'id': chat_id,
-                'name': f"DM: {' & '.join(participants)}",
-                'type': 'direct',
-                'participants': participants,
-                'messages': []
-            }
-            db['chats'].append(chat)
+    # Find or create chat (under the write lock so two workers cannot both create it)
+    with store.transaction():
+        chat = store.get('chats', chat_id, shallow=True)
+        created = not chat
+        if not chat:
+            # Create new chat if it doesn't exist (for DMs)
+            if chat_id.startswith('dm_'):
+                participants = chat_id.replace('dm_', '').split('_')
+                chat = {
+                    'id': chat_id,
+                    'name': f"DM: {' & '.join(participants)}",
+                    'type': 'direct',
+                    'participants': participants,
+                    'messages': []
+                }
+                store.insert('chats', chat)
+                read_state.add_chat(chat_id, participants)
 
-    chat['messages'].append(message)
-    save_db(db)
+        store.append(('chats', chat_id, 'messages'), message)
+    read_state.posted(chat_id, message['id'], user_id)
+    search_index.add_message(chat, message)
+
+    # A new chat goes out as a chat-list entry; otherwise clients update last_message from new_message
+    version = push_chat(chat) if created else record_change('chat', chat_id, chat_audience(chat))
 
     # Emit real-time update to all participants
     print(f"Emitting new_message for chat {chat_id}")
-    if chat['type'] == 'direct':
-        # For DMs, emit to both participants
-        for participant in chat['participants']:
-            print(f"Emitting to participant: {participant}")
-            socketio.emit('new_message', {
-                'chat_id': chat_id,
-                'message': message
-            }, room=participant)
-    else:
-        # For group chats, emit to the chat room
-        print(f"Emitting to chat room: {chat_id}")
-        socketio.emit('new_message', {
-            'chat_id': chat_id,
-            'message': message
-        }, room=chat_id)
+    emit_to_chat(chat, 'new_message', {
+        'chat_id': chat_id,
+        'message': message,
+        'version': version
+    })
+    push_unread(chat, user_id)
+    for staged, attachment in staged_uploads:
+        upload_pipeline.submit(staged, finalize_attachment, chat, message['id'], attachment, on_failure=fail_attachment)
 
     # Send notifications to mentioned users
     for mentioned_user in mentioned_users:
@@ -989,15 +1462,121 @@ def api_send_message():
 
     return jsonify(message), 200
 
+def emit_to_chat(chat, event, payload):
+    """Emit to both participants' rooms for DMs, to the chat room for group chats"""
+    if chat['type'] == 'direct':
+        for participant in chat['participants']:
+            socketio.emit(event, payload, room=participant)
+    else:
+        socketio.emit(event, payload, room=chat['id'])
+
+# --- Upload finalize steps (run on upload_pipeline workers) ---
+def is_ready(item):
+    """False while an uploaded clip is still being finalized (or after finalizing it failed)"""
+    return item.get('status', 'ready') == 'ready'
+
+def set_attachment_status(chat, message_id, attachment, status):
+    store.set(('chats', chat['id'], 'messages', message_id, 'attachments', attachment['id'], 'status'), status)
+    record_change('chat', chat['id'], chat_audience(chat))
+    emit_to_chat(chat, 'message_updated', {
+        'chat_id': chat['id'],
+        'message_id': message_id,
+        'attachment': dict(attachment, status=status)
+    })
+
+def finalize_attachment(staged, chat, message_id, attachment):
+    blobs.put_staged(f"uploads/{attachment['stored_filename']}", staged)
+    set_attachment_status(chat, message_id, attachment, 'ready')
+
+def fail_attachment(chat, message_id, attachment):
+    set_attachment_status(chat, message_id, attachment, 'failed')
+
+def finalize_avatar(staged, username, filename):
+    blobs.put_staged(f"photos/{filename}", staged)
+    previous = (store.get('users', username, shallow=True) or {}).get('avatar')
+    store.set(('users', username, 'avatar'), filename)
+    store.set(('users', username, 'photo'), filename)  # Keep both for compatibility
+    if previous and previous != filename:
+        blobs.release(f"photos/{previous}")
+    media_jobs.enqueue('avatar', {'filename': filename})
+    push_user(username)
+
+def finalize_clip(staged, clip_id, filename):
+    blobs.put_staged(f"clips/{filename}", staged)
+    store.set(('clips', clip_id, 'status'), 'ready')
+    record_change('clip', clip_id)
+    media_jobs.enqueue('clip', {'clip_id': clip_id})
+    socketio.emit('clip_updated', {'clip_id': clip_id, 'status': 'ready'})
+
+def fail_clip(clip_id, filename):
+    store.set(('clips', clip_id, 'status'), 'failed')
+    record_change('clip', clip_id)
+    socketio.emit('clip_updated', {'clip_id': clip_id, 'status': 'failed'})
+
+# --- Media jobs (run by `python mediajobs.py worker`) ---
+def update_clip_media(clip_id, updates):
+    with store.transaction():
+        for key, value in updates.items():
+            store.set(('clips', clip_id, key), value)
+    record_change('clip', clip_id)
+    socketio.emit('clip_updated', dict(updates, clip_id=clip_id))
+
+def process_clip_job(payload):
+    """Probe a clip and attach its poster frame and web rendition to the record
+
+    Each step is saved as soon as it is done and skipped when the job is retried, so a failed
+    rendition neither loses the poster nor makes the next attempt render it again.
+    """
+    clip_id = payload['clip_id']
+    clip = store.get('clips', clip_id, shallow=True)
+    if not clip:
+        return
+    source = blobs.path(f"clips/{clip['video_filename']}") or os.path.join('clips', clip['video_filename'])
+    if not clip.get('duration'):
+        info = probe(source)
+        clip = dict(clip, duration=info.get('duration') or 0, width=info.get('width'), height=info.get('height'))
+        update_clip_media(clip_id, {key: clip[key] for key in ('duration', 'width', 'height')})
+    failed = []
+    if not clip.get('thumbnail'):
+        try:
+            poster = make_poster(source, clip['duration'])
+            if poster:
+                blobs.put_file(f"clips/{clip_id}_thumb.jpg", poster, move=True)
+                update_clip_media(clip_id, {'thumbnail': f"{clip_id}_thumb.jpg"})
+        except (subprocess.SubprocessError, OSError) as exc:
+            failed.append(f"poster: {exc}")
+    if not clip.get('rendition'):
+        try:
+            rendition = make_rendition(source)
+            if rendition:
+                blobs.put_file(f"clips/{clip_id}_720p.mp4", rendition, move=True)
+                update_clip_media(clip_id, {'rendition': f"{clip_id}_720p.mp4"})
+        except (subprocess.SubprocessError, OSError) as exc:
+            failed.append(f"rendition: {exc}")
+    if failed:
+        # Retried by the job queue; fail_clip_job runs once it gives up
+        raise RuntimeError('; '.join(failed))
+    update_clip_media(clip_id, {'media_status': 'ready'})
+
+def fail_clip_job(payload):
+    """The job queue gave up on a clip: keep whatever steps finished and mark the rest failed"""
+    if store.get('clips', payload['clip_id'], shallow=True):
+        update_clip_media(payload['clip_id'], {'media_status': 'failed'})
+
+def process_avatar_job(payload):
+    """Render every avatar size ahead of the first request for it"""
+    source = media_source('photos', payload['filename'])
+    if source:
+        avatar_variants.generate(*source)
+
 @app.route('/uploads/<filename>')
 def serve_upload(filename):
-    return send_from_directory('uploads', filename)
+    return send_media('uploads', filename)
 
 # --- API for direct messages ---
 @app.route('/api/create_dm', methods=['POST'])
 @login_required
 def api_create_dm():
-    db = load_db()
     participant1 = session['user_id']
     participant2 = request.form['participant']
 
@@ -1006,26 +1585,27 @@ def api_create_dm():
     dm_id = f"dm_{participants[0]}_{participants[1]}"
 
     # Check if DM already exists
-    existing_dm = next((c for c in db['chats'] if c['id'] == dm_id), None)
-    if not existing_dm:
-        dm_chat = {
-            'id': dm_id,
-            'name': f"DM: {participant1} & {participant2}",
-            'type': 'direct',
-            'participants': [participant1, participant2],  # Keep original usernames
-            'messages': [],
-            'created_at': datetime.now().isoformat()
-        }
-        db['chats'].append(dm_chat)
-        save_db(db)
+    with store.transaction():
+        existing_dm = store.get('chats', dm_id, shallow=True)
+        if not existing_dm:
+            dm_chat = {
+                'id': dm_id,
+                'name': f"DM: {participant1} & {participant2}",
+                'type': 'direct',
+                'participants': [participant1, participant2],  # Keep original usernames
+                'messages': [],
+                'created_at': datetime.now().isoformat()
+            }
+            store.insert('chats', dm_chat)
+            read_state.add_chat(dm_id, dm_chat['participants'])
+            push_chat(dm_chat)
 
     return jsonify({'chat_id': dm_id})
 
 @app.route('/api/dm/<chat_id>')
 @login_required
 def api_get_dm(chat_id):
-    db = load_db()
-    chat = next((c for c in db['chats'] if c['id'] == chat_id), None)
+    chat = store.get('chats', chat_id, shallow=True)
     if not chat:
         return jsonify({'error': 'Chat not found'}), 404
 
@@ -1034,69 +1614,101 @@ def api_get_dm(chat_id):
     if current_user not in chat['participants']:
         return jsonify({'error': 'Access denied'}), 403
 
+    # Latest page only; older history comes from api_chat_messages with next_cursor
+    page = message_page(chat_id)
+    chat = {k: v for k, v in chat.items() if k != 'messages'}
+    chat.update(messages=page['messages'], next_cursor=page['next_cursor'],
+                read_receipts=read_state.receipts(chat_id, chat['participants']))
     return jsonify(chat)
 
 @app.route('/api/user_chats')
 @login_required
 def api_user_chats():
-    """Get all chats for the current user"""
-    db = load_db()
+    """Get all chats for the current user, newest activity first"""
     current_user = session['user_id']
-    user_chats = []
-
-    for chat in db['chats']:
-        if chat['type'] == 'direct' and current_user in chat['participants']:
-            # Get the other participant's info
-            other_participant = next((p for p in chat['participants'] if p != current_user), None)
-            if other_participant:
-                other_user = next((u for u in db['users'] if u['username'] == other_participant), None)
-                chat_info = {
-                    'id': chat['id'],
-                    'type': 'direct',
-                    'other_user': {
-                        'username': other_participant,
-                        'display_name': other_user['display_name'] if other_user else other_participant,
-                        'avatar': other_user['avatar'] if other_user else None,
-                        'online': other_user['online'] if other_user else False
-                    },
-                    'last_message': chat['messages'][-1] if chat['messages'] else None,
-                    'unread_count': 0  # TODO: Implement unread count
-                }
-                user_chats.append(chat_info)
-        elif chat['type'] == 'public' or chat['id'] == 'global':
-            user_chats.append({
-                'id': chat['id'],
-                'type': 'public',
-                'name': chat['name'],
-                'last_message': chat['messages'][-1] if chat['messages'] else None
-            })
-
-    return jsonify(user_chats)
+    # One read-state query lists the user's chats with their unread counts; other users' chats are never touched
+    inbox = read_state.inbox(current_user)
+    chats = (store.get('chats', chat_id, shallow=True) for chat_id in inbox)
+    summaries = [summary for summary in (chat_summary(chat, current_user, inbox[chat['id']]) for chat in chats if chat) if summary]
+    summaries.sort(key=lambda summary: (summary['last_message'] or {}).get('timestamp') or '', reverse=True)
+    return jsonify(summaries)
+
+# --- Metrics ---
+ROOM_SIZE_BANDS = ((1, '1'), (10, '2-10'), (100, '11-100'), (float('inf'), '101+'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start(socketio.start_background_task, socketio.sleep)
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('connectra_http_request_duration_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method, status=response.status_code)
+        # Only look at files if the route parsed the form (reading request.files here would parse it)
+        if 'files' in request.__dict__:
+            for file in request.files.values():
+                if isinstance(file.stream, StagedFile) and file.stream.size:
+                    metrics.inc('connectra_uploads_total', endpoint=endpoint)
+                    metrics.inc('connectra_upload_bytes_total', file.stream.size, endpoint=endpoint)
+    return response
+
+_socketio_emit = socketio.emit
+
+def counted_emit(event, *args, **kwargs):
+    """socketio.emit that counts events; flask_socketio.emit in handlers goes through it too"""
+    target = 'room' if kwargs.get('to') or kwargs.get('room') else 'broadcast'
+    metrics.inc('connectra_socketio_emits_total', event=event, target=target)
+    return _socketio_emit(event, *args, **kwargs)
+
+socketio.emit = counted_emit
+
+@metrics.collect
+def socketio_room_gauges():
+    """This worker's clients and room sizes (each client's own sid room left out)"""
+    rooms = socketio.server.manager.rooms.get('/', {}) if socketio.server else {}
+    clients = rooms.get(None, {})
+    sizes = [len(members) for room, members in rooms.items() if room is not None and room not in clients]
+    bands = {label: 0 for _, label in ROOM_SIZE_BANDS}
+    for size in sizes:
+        bands[next(label for bound, label in ROOM_SIZE_BANDS if size <= bound)] += 1
+    return ([('connectra_socketio_clients', {}, len(clients)),
+             ('connectra_socketio_room_members', {}, sum(sizes)),
+             ('connectra_socketio_largest_room', {}, max(sizes, default=0))] +
+            [('connectra_socketio_rooms', {'members': label}, count) for label, count in bands.items()])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: totals over every worker"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}' and not session.get('is_dev'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 # --- SocketIO for real-time chat ---
 @socketio.on('connect')
 def on_connect():
+    metrics.inc('connectra_socketio_connects_total')
+    metrics.start(socketio.start_background_task, socketio.sleep)
+    profiler.start(socketio.start_background_task, socketio.sleep)
     if 'user_id' in session:
         # Join user to their personal room for DMs
         join_room(session['user_id'])
-        # Update user online status
-        db = load_db()
-        user = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-        if user:
-            user['online'] = True
-            save_db(db)
-        emit('user_status', {'username': session['user_id'], 'online': True}, broadcast=True)
+        # Counted in memory; the presence loop broadcasts the status change
+        presence.connect(session['user_id'])
+        presence.start(socketio.start_background_task, publish_presence, socketio.sleep)
 
 @socketio.on('disconnect')
 def on_disconnect():
+    metrics.inc('connectra_socketio_disconnects_total')
     if 'user_id' in session:
-        # Update user offline status
-        db = load_db()
-        user = next((u for u in db['users'] if u['username'] == session['user_id']), None)
-        if user:
-            user['online'] = False
-            save_db(db)
-        emit('user_status', {'username': session['user_id'], 'online': False}, broadcast=True)
+        # Marked offline only if no other tab or worker holds a socket after the grace period
+        presence.disconnect(session['user_id'])
 
 @socketio.on('join_chat')
 def on_join_chat(data):
@@ -1111,6 +1723,32 @@ def on_leave_chat(data):
     leave_room(chat_id)
     emit('left_chat', {'chat_id': chat_id})
 
+MAX_MARK_READ = 100
+
+@socketio.on('mark_read')
+def on_mark_read(data):
+    """Batched read positions: {'reads': {chat_id: last read message id, or null for the latest}}"""
+    username = session.get('user_id')
+    if not username or not isinstance(data, dict) or not isinstance(data.get('reads'), dict):
+        return
+    reads, direct = {}, []
+    for chat_id, message_id in list(data['reads'].items())[:MAX_MARK_READ]:
+        chat = store.get('chats', chat_id, shallow=True)
+        audience = chat_audience(chat) if chat else []
+        if audience is None or username in audience:
+            reads[chat_id] = message_id if isinstance(message_id, str) else None
+            if audience:
+                direct.append(chat)
+    if not reads:
+        return
+    # Every tab of this user clears its badges; the other side of a DM sees how far it has been read
+    emit('unread_update', {'counts': read_state.mark_read(username, reads)}, room=username)
+    for chat in direct:
+        message_id = read_state.receipts(chat['id'], [username]).get(username)
+        for participant in chat['participants']:
+            if participant != username:
+                socketio.emit('read_receipt', {'chat_id': chat['id'], 'username': username, 'message_id': message_id}, room=participant)
+
 @socketio.on('typing')
 def on_typing(data):
     chat_id = data['chat_id']
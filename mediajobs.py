@@ -0,0 +1,289 @@
+"""
+Media processing jobs for Connectra.
+
+Uploading a clip only stores the original. The slow work runs in a separate
+worker process, off the web workers:
+
+* probe the duration and frame size (ffprobe when installed, otherwise a
+  pure-Python reader for MP4/MOV and AVI headers);
+* extract a small JPEG poster frame (needs ffmpeg);
+* make a compact 720p H.264/AAC rendition with the index at the front so it
+  streams (needs ffmpeg).
+
+New avatars get their resized variants rendered here as well (see images.py).
+
+Jobs live in a small SQLite queue (``database/jobs.db``) so any web worker can
+enqueue and the worker process survives restarts. A job that keeps failing is
+retried up to ``MAX_ATTEMPTS`` times, then handed to its kind's give-up handler
+(the clip's record is marked failed); one whose worker died is picked up again
+after ``STALE_AFTER`` seconds.
+
+Run the worker with ``python mediajobs.py worker`` from the app directory;
+gunicorn.conf.py starts one next to the web workers.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+MAX_ATTEMPTS = 3
+STALE_AFTER = 30 * 60
+POSTER_WIDTH = 480
+RENDITION_HEIGHT = 720
+
+
+class JobQueue:
+    """Durable FIFO of ``(kind, payload)`` jobs shared by every process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # One connection per process, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def enqueue(self, kind, payload):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)", (kind, json.dumps(payload), time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self):
+        """Take the oldest runnable job as ``(id, kind, payload)``, or None"""
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND claimed_at < ?) ORDER BY id LIMIT 1", (time.time() - STALE_AFTER,)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                        (time.time(), row[0])
+                    )
+            finally:
+                conn.execute('COMMIT')
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def finish(self, job_id):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET status = 'done', error = NULL WHERE id = ?", (job_id,))
+
+    def fail(self, job_id, error):
+        """Requeue the job, or mark it failed after MAX_ATTEMPTS; returns True if it will be retried"""
+        with self.lock:
+            attempts = self.conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            retry = attempts < MAX_ATTEMPTS
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ? WHERE id = ?", ('queued' if retry else 'failed', error, job_id)
+            )
+            return retry
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, count(*) FROM jobs GROUP BY status").fetchall())
+
+
+# --- Probing ---
+def _mp4_boxes(f, start, end):
+    """Yield ``(type, payload offset, payload end)`` for the boxes between two offsets"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        payload = offset + 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < 8:
+            return
+        yield box_type, payload, min(offset + size, end)
+        offset += size
+
+
+def probe_mp4(path):
+    """Duration and frame size from an MP4/MOV ``moov`` box, without decoding anything"""
+    info = {}
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        for box_type, start, stop in _mp4_boxes(f, 0, end):
+            if box_type != b'moov':
+                continue
+            for child, cstart, cstop in _mp4_boxes(f, start, stop):
+                if child == b'mvhd':
+                    f.seek(cstart)
+                    version = f.read(1)[0]
+                    if version == 1:
+                        f.seek(cstart + 20)
+                        timescale, duration = struct.unpack('>IQ', f.read(12))
+                    else:
+                        f.seek(cstart + 12)
+                        timescale, duration = struct.unpack('>II', f.read(8))
+                    if timescale:
+                        info['duration'] = round(duration / timescale, 3)
+                elif child == b'trak' and 'width' not in info:
+                    for grandchild, gstart, gstop in _mp4_boxes(f, cstart, cstop):
+                        if grandchild == b'tkhd' and gstop - gstart >= 8:
+                            f.seek(gstop - 8)
+                            width, height = struct.unpack('>II', f.read(8))
+                            if width and height:
+                                info['width'], info['height'] = width >> 16, height >> 16
+            break
+    return info
+
+
+def probe_avi(path):
+    """Duration and frame size from the AVI main header (``avih``)"""
+    with open(path, 'rb') as f:
+        header = f.read(88)
+    if len(header) < 88 or header[:4] != b'RIFF' or header[8:12] != b'AVI ' or header[24:28] != b'avih':
+        return {}
+    usec_per_frame, _, _, _, frames, _, _, _, width, height = struct.unpack('<10I', header[32:72])
+    info = {'width': width, 'height': height}
+    if usec_per_frame and frames:
+        info['duration'] = round(frames * usec_per_frame / 1e6, 3)
+    return info
+
+
+def probe_ffprobe(path):
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        capture_output=True, check=True, timeout=120
+    ).stdout
+    data = json.loads(output)
+    info = {}
+    if data.get('format', {}).get('duration'):
+        info['duration'] = round(float(data['format']['duration']), 3)
+    video = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+    if video:
+        info['width'], info['height'] = video.get('width'), video.get('height')
+    return info
+
+
+def probe(path):
+    """``{'duration', 'width', 'height'}`` as far as they can be found out"""
+    if shutil.which('ffprobe'):
+        try:
+            return probe_ffprobe(path)
+        except (subprocess.SubprocessError, ValueError, OSError):
+            pass
+    try:
+        return probe_mp4(path) or probe_avi(path)
+    except (OSError, struct.error, IndexError):
+        return {}
+
+
+# --- ffmpeg steps ---
+def make_poster(source, duration=None):
+    """Path of a temporary JPEG poster frame, or None without ffmpeg"""
+    if not shutil.which('ffmpeg'):
+        return None
+    fd, target = tempfile.mkstemp(suffix='.jpg')
+    os.close(fd)
+    at = min(1.0, (duration or 0) / 2)
+    try:
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', '-ss', str(at), '-i', source, '-frames:v', '1',
+             '-vf', f"scale={POSTER_WIDTH}:-2", '-q:v', '5', target],
+            check=True, timeout=300
+        )
+    except BaseException:
+        os.unlink(target)
+        raise
+    return target
+
+
+def make_rendition(source):
+    """Path of a temporary web-friendly MP4 rendition, or None without ffmpeg"""
+    if not shutil.which('ffmpeg'):
+        return None
+    fd, target = tempfile.mkstemp(suffix='.mp4')
+    os.close(fd)
+    try:
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-y', '-i', source,
+             '-vf', f"scale=-2:'min({RENDITION_HEIGHT},ih)'", '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28',
+             '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', target],
+            check=True, timeout=3600
+        )
+    except BaseException:
+        os.unlink(target)
+        raise
+    return target
+
+
+def run_worker(queue, handlers, poll_interval=1.0, once=False, give_up=None):
+    """Claim and run jobs forever (or until the queue is empty with ``once``)
+
+    ``give_up[kind](payload)`` runs once a job of that kind has failed for the last time.
+    """
+    while True:
+        job = queue.claim()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        job_id, kind, payload = job
+        try:
+            handlers[kind](payload)
+        except Exception as exc:
+            retry = queue.fail(job_id, f"{type(exc).__name__}: {exc}")
+            print(f"Job {job_id} ({kind}) failed{', will retry' if retry else ''}: {exc}", file=sys.stderr)
+            if not retry and kind in (give_up or {}):
+                try:
+                    give_up[kind](payload)
+                except Exception as give_up_exc:
+                    print(f"Job {job_id} ({kind}) give-up handler failed: {give_up_exc}", file=sys.stderr)
+        else:
+            queue.finish(job_id)
+
+
+if __name__ == '__main__':
+    # python mediajobs.py worker [--once]   (run from the app directory, like the server)
+    if len(sys.argv) < 2 or sys.argv[1] != 'worker':
+        print('usage: python mediajobs.py worker [--once]')
+        sys.exit(2)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    handlers = {'clip': main.process_clip_job, 'avatar': main.process_avatar_job}
+    run_worker(main.media_jobs, handlers, once='--once' in sys.argv[2:], give_up={'clip': main.fail_clip_job})
@@ -0,0 +1,254 @@
+"""
+Metrics for Connectra, served on ``/metrics`` in the Prometheus text format.
+
+Three kinds of series:
+
+* counters (``inc``) only go up: requests, bytes, Socket.IO emits;
+* histograms (``observe``) count observations into fixed buckets and keep
+  their sum, exported as ``<name>_bucket{le=...}``, ``<name>_sum`` and
+  ``<name>_count`` like the Prometheus client libraries do;
+* gauges are read from the collectors registered with ``collect`` (for
+  example the Socket.IO room sizes) whenever the worker flushes.
+
+Recording a sample only touches a dict in memory. Every ``interval`` seconds
+(and before answering a scrape) a worker adds its pending counter and bucket
+deltas to a SQLite file shared by all gunicorn workers, so a scrape of any
+worker returns totals over every worker, including ones that have since been
+recycled by ``max_requests``. Gauges are stored per worker and summed (or
+maxed) over the workers that have flushed within the last few intervals.
+"""
+
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds: from a cached read to a slow upload
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Gauges of workers that have not flushed for this many intervals are left out
+STALE_INTERVALS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    le TEXT NOT NULL DEFAULT '',
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels, le)
+);
+CREATE TABLE IF NOT EXISTS gauges (
+    pid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (pid, name, labels)
+);
+"""
+
+
+def format_labels(labels):
+    """``{'a': 'x', 'b': 1}`` as ``a="x",b="1"`` (sorted, escaped)"""
+    return ','.join(
+        f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in sorted(labels.items())
+    )
+
+
+def format_value(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else format_value(bound)
+
+
+class Metrics:
+    """Per-worker metric buffer flushed into a shared SQLite file"""
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.families = {}
+        self.collectors = []
+        self.pending = {}
+        self.histograms = {}
+        self._conn = None
+        self._conn_pid = None
+        self._pid = os.getpid()
+        self._loop_pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._conn_pid != os.getpid():
+            self._conn_pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _check_fork(self):
+        # Samples copied from the parent by fork() are the parent's to flush
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.pending = {}
+            self.histograms = {}
+
+    # --- Definitions ---
+    def counter(self, name, help):
+        self.families.setdefault(name, ('counter', help, None))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.families.setdefault(name, ('histogram', help, tuple(buckets) + (float('inf'),)))
+
+    def gauge(self, name, help, aggregate='sum'):
+        """``aggregate`` combines the workers' values: 'sum' or 'max'"""
+        self.families.setdefault(name, ('gauge', help, aggregate))
+
+    def collect(self, collector):
+        """Register ``collector() -> [(gauge name, labels dict, value)]``, called on every flush"""
+        self.collectors.append(collector)
+        return collector
+
+    # --- Recording ---
+    def inc(self, name, amount=1, **labels):
+        key = (name, format_labels(labels))
+        with self.lock:
+            self._check_fork()
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        bounds = self.families[name][2]
+        key = (name, format_labels(labels))
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(bounds) + [0.0]
+            histogram[bisect.bisect_left(bounds, value)] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # --- Sharing ---
+    def _gauge_rows(self):
+        rows = []
+        for collector in self.collectors:
+            try:
+                rows.extend(collector())
+            except Exception:
+                logger.exception('Metrics collector %s failed', getattr(collector, '__name__', collector))
+        return [(name, format_labels(labels), value) for name, labels, value in rows]
+
+    def flush(self):
+        """Add this worker's pending deltas to the shared totals and refresh its gauges"""
+        with self.lock:
+            self._check_fork()
+            counters, self.pending = self.pending, {}
+            histograms, self.histograms = self.histograms, {}
+        rows = [(name, labels, '', value) for (name, labels), value in counters.items()]
+        for (name, labels), histogram in histograms.items():
+            total = 0
+            for bound, count in zip(self.families[name][2], histogram):
+                total += count
+                rows.append((f"{name}_bucket", labels, format_bound(bound), total))
+            rows.append((f"{name}_sum", labels, '', histogram[-1]))
+            rows.append((f"{name}_count", labels, '', total))
+        gauges = self._gauge_rows()
+        now = time.time()
+        try:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    "INSERT INTO samples (name, labels, le, value) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value", rows
+                )
+                conn.execute("DELETE FROM gauges WHERE pid = ? OR updated_at < ?",
+                             (os.getpid(), now - STALE_INTERVALS * self.interval))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO gauges (pid, name, labels, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    ((os.getpid(), name, labels, value, now) for name, labels, value in gauges)
+                )
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        except Exception:
+            # Keep the deltas for the next flush rather than dropping them
+            with self.lock:
+                for key, value in counters.items():
+                    self.pending[key] = self.pending.get(key, 0) + value
+                for key, histogram in histograms.items():
+                    merged = self.histograms.setdefault(key, [0] * (len(histogram) - 1) + [0.0])
+                    for i, value in enumerate(histogram):
+                        merged[i] += value
+            logger.exception('Metrics flush failed; %d series kept for the next one', len(counters) + len(histograms))
+
+    def start(self, spawn, sleep=time.sleep):
+        """Start this worker's flush loop with ``spawn`` unless it is already running"""
+        if self._loop_pid == os.getpid():
+            return
+        with self.lock:
+            if self._loop_pid == os.getpid():
+                return
+            self._loop_pid = os.getpid()
+        spawn(self._run, sleep)
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.interval)
+            self.flush()
+
+    # --- Export ---
+    def render(self):
+        """Totals over every worker in the Prometheus text exposition format"""
+        self.flush()
+        cutoff = time.time() - STALE_INTERVALS * self.interval
+        with self.lock:
+            samples = self.conn.execute("SELECT name, labels, le, value FROM samples").fetchall()
+            gauges = self.conn.execute(
+                "SELECT name, labels, sum(value), max(value) FROM gauges WHERE updated_at >= ? GROUP BY name, labels",
+                (cutoff,)
+            ).fetchall()
+        series = {}
+        for name, labels, le, value in samples:
+            series.setdefault(name, []).append((labels, le, value))
+        for name, labels, total, largest in gauges:
+            aggregate = self.families.get(name, ('gauge', '', 'sum'))[2]
+            series.setdefault(name, []).append((labels, '', largest if aggregate == 'max' else total))
+
+        lines = []
+        for family, (kind, help, bounds) in sorted(self.families.items()):
+            names = [f"{family}_bucket", f"{family}_sum", f"{family}_count"] if kind == 'histogram' else [family]
+            if not any(name in series for name in names):
+                continue
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} {kind}")
+            for name in names:
+                rows = series.get(name, [])
+                # Buckets of one series must be listed in increasing order of their bound
+                rows.sort(key=lambda row: (row[0], float(row[1]) if row[1] else 0))
+                for labels, le, value in rows:
+                    if le:
+                        labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                    lines.append(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
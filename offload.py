@@ -0,0 +1,90 @@
+"""
+Blocking I/O offload for Connectra's eventlet workers.
+
+An eventlet worker runs every request and Socket.IO connection as a greenlet
+on one OS thread. Anything that blocks that thread without going through the
+hub (writing and fsyncing a large snapshot, waiting on another worker's file
+lock, copying an upload, rendering an image) stalls every other greenlet in
+the worker, Socket.IO heartbeats included.
+
+``Offload.run(fn, *args)`` runs such a call on eventlet's pool of native
+threads (``eventlet.tpool``) and parks only the calling greenlet until it
+returns. At most ``max_pending`` calls per worker are queued or running; a
+greenlet asking for more waits its turn (on the hub, not the OS thread), so
+a burst of uploads cannot pile up unbounded work behind the pool.
+
+Outside a green thread of a monkey-patched eventlet process there is no hub
+to protect and ``run`` simply calls the function: in the threading dev
+server, in scripts, and in the gunicorn master while it preloads the app
+(a thread pool started there would not survive the fork into the workers).
+``threads=0`` switches offloading off, for comparison in
+benchmarks/hub_latency.py.
+
+Pure-Python work yields the GIL to the hub every few milliseconds while it
+runs on a pool thread. A single long C call (``json.loads`` of a whole
+snapshot) does not, so offloading helps the I/O around it but not the call
+itself.
+"""
+
+import os
+import time
+
+try:
+    from eventlet import patcher, tpool
+    from eventlet.semaphore import Semaphore
+    from greenlet import getcurrent
+except ImportError:  # No eventlet: nothing to offload from
+    tpool = None
+
+
+class Offload:
+    """Per-worker gate in front of eventlet's native thread pool"""
+
+    def __init__(self, threads=8, max_pending=64, metrics=None):
+        self.threads = threads
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self._slots = None
+        self._pid = None
+        if metrics:
+            metrics.histogram('connectra_offload_wait_seconds', 'Time blocking calls waited for an offload slot')
+            metrics.histogram('connectra_offload_seconds', 'Time blocking calls ran on the native thread pool, by call')
+            metrics.gauge('connectra_offload_pending', 'Blocking calls queued or running on the native thread pool')
+            metrics.collect(lambda: [('connectra_offload_pending', {}, self.pending)])
+
+    @property
+    def active(self):
+        """True on a green thread of an eventlet-patched process, where blocking calls must leave the hub"""
+        return (bool(self.threads) and tpool is not None and patcher.is_monkey_patched('thread')
+                and getcurrent().parent is not None)
+
+    def _gate(self):
+        # The pool and its semaphore belong to the worker; the master never starts them
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            tpool.set_num_threads(self.threads)
+            self._slots = Semaphore(self.max_pending)
+        return self._slots
+
+    def run(self, fn, *args, **kwargs):
+        """``fn(*args, **kwargs)`` on a native thread, or inline when there is no hub to protect"""
+        if not self.active:
+            return fn(*args, **kwargs)
+        slots = self._gate()
+        started = time.perf_counter()
+        with slots:
+            running = time.perf_counter()
+            try:
+                return tpool.execute(fn, *args, **kwargs)
+            finally:
+                if self.metrics:
+                    name = getattr(fn, '__name__', 'call')
+                    self.metrics.observe('connectra_offload_wait_seconds', running - started)
+                    self.metrics.observe('connectra_offload_seconds', time.perf_counter() - running, call=name)
+
+    @property
+    def pending(self):
+        """Calls queued or running in this worker"""
+        if self._slots is None or self._pid != os.getpid():
+            return 0
+        return self.max_pending - self._slots.balance
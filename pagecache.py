@@ -0,0 +1,124 @@
+"""
+Rendered-page cache for Connectra's anonymous pages.
+
+Guest mode and the public blog and clips pages show every visitor without
+an account the same HTML, yet each view used to read the store and render
+the template again. ``PageCache`` keeps the rendered bodies per worker, keyed
+by route and the query parameters that select the page, so a repeat view
+costs a dictionary lookup and no storage read. Each page carries an ETag
+(a hash of its body) and a Last-Modified time for browsers to revalidate
+against.
+
+A page names the change-feed kinds it is built from (``'blog'``, ``'clip'``,
+``'chat'``, ``'user'``). Mutation routes record such a change for every
+write; the worker that wrote drops the affected pages at once
+(``invalidate``), the others when they next follow the store's change feed,
+at most every ``check_interval`` seconds, like ``usercache.UserCache``. If
+the feed has moved past what is retained, the whole cache is cleared.
+Anything that changes without a feed entry (view counts, the trending order)
+is picked up once a page is ``max_age`` seconds old.
+
+The cache holds at most ``max_bytes`` of page bodies, least recently used
+first out.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+Page = namedtuple('Page', 'body mimetype etag last_modified kinds stored')
+
+
+class PageCache:
+    """Per-worker ``{key: Page}`` kept coherent through the change feed"""
+
+    def __init__(self, store, max_bytes=32 * 1024 * 1024, max_age=60, check_interval=1.0):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        self.size = 0
+        # Bumped per kind on every invalidation (and all at once by clear), so a page rendered across one is not stored
+        self.generations = {}
+        self.epoch = 0
+        self.version = None
+        self.checked = 0.0
+
+    def _sync(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked < self.check_interval:
+                return
+            self.checked = now
+            since = self.version
+        if since is None:
+            changes, version = None, self.store.version()
+        else:
+            changes, version = self.store.changes_since(since)
+        if changes is None:
+            self.clear()
+        else:
+            self.invalidate(*{change.get('kind') for change in changes})
+        with self.lock:
+            self.version = version
+
+    def _drop(self, key):
+        page = self.pages.pop(key)
+        self.size -= len(page.body)
+
+    def get(self, key):
+        """The cached page for ``key``, or None"""
+        self._sync()
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                return None
+            if time.monotonic() - page.stored > self.max_age:
+                self._drop(key)
+                return None
+            self.pages.move_to_end(key)
+            return page
+
+    def begin(self, kinds):
+        """Token for a page about to be rendered from ``kinds``; hand it back to ``put``"""
+        with self.lock:
+            return self._token(kinds)
+
+    def _token(self, kinds):
+        return (self.epoch,) + tuple(self.generations.get(kind, 0) for kind in kinds)
+
+    def put(self, key, body, mimetype, kinds, token):
+        """Cache a rendered page and return it; pages invalidated since ``begin`` are returned but not kept"""
+        page = Page(body, mimetype, hashlib.sha256(body).hexdigest()[:32], datetime.now(timezone.utc).replace(microsecond=0),
+                    tuple(kinds), time.monotonic())
+        if len(body) > self.max_bytes:
+            return page
+        with self.lock:
+            if self._token(kinds) != token:
+                return page
+            if key in self.pages:
+                self._drop(key)
+            self.pages[key] = page
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.pages)))
+        return page
+
+    def invalidate(self, *kinds):
+        """Drop the pages built from any of ``kinds`` (this worker's own writes need not wait for the next sync)"""
+        kinds = set(kinds)
+        with self.lock:
+            for kind in kinds:
+                self.generations[kind] = self.generations.get(kind, 0) + 1
+            for key in [key for key, page in self.pages.items() if kinds.intersection(page.kinds)]:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.pages.clear()
+            self.size = 0
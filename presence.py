@@ -0,0 +1,198 @@
+"""
+Presence tracking for Connectra.
+
+Each worker counts its own Socket.IO connections per user in memory; connect
+and disconnect never touch the main database. Once per ``interval`` a worker
+flushes the counts that changed to a small shared SQLite board
+(``database/presence.db``) and settles status transitions there:
+
+* a user is online while the sum of their sockets over all live workers is
+  above zero, so several tabs and several workers count once;
+* a user whose count drops to zero stays online for ``grace`` seconds, so a
+  page reload or a flaky mobile connection does not flap their status;
+* transitions are decided inside one write transaction, so exactly one worker
+  reports each of them and the caller can broadcast them as one batch.
+
+Only "last seen" timestamps are meant to be persisted; ``take_last_seen``
+hands them out in batches.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sockets (
+    pid INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (pid, username)
+);
+CREATE INDEX IF NOT EXISTS sockets_username ON sockets (username);
+
+CREATE TABLE IF NOT EXISTS status (
+    username TEXT PRIMARY KEY,
+    online INTEGER NOT NULL,
+    zero_since REAL
+);
+"""
+
+# How often dead workers' rows are swept from the board, in seconds
+PRUNE_EVERY = 30
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PresenceTracker:
+    """Per-worker socket counts merged through a shared SQLite board"""
+
+    def __init__(self, path, grace=10, interval=1.0):
+        self.path = path
+        self.grace = grace
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._local = {}
+        self._dirty = set()
+        self._online = set()
+        self._read_at = 0
+        self._pruned_at = 0
+        self._last_seen = {}
+        self._conn = None
+        self._pid = None
+        self._loop_pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local, self._dirty = {}, set()
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    # --- Socket events (memory only) ---
+    def connect(self, username):
+        with self.lock:
+            self.conn  # forked workers start from empty counts
+            self._local[username] = self._local.get(username, 0) + 1
+            self._dirty.add(username)
+
+    def disconnect(self, username):
+        with self.lock:
+            self.conn
+            count = self._local.get(username, 0) - 1
+            if count > 0:
+                self._local[username] = count
+            else:
+                self._local.pop(username, None)
+            self._dirty.add(username)
+
+    # --- Reads ---
+    def online_users(self):
+        """Usernames currently shown as online, at most ``interval`` seconds old"""
+        with self.lock:
+            if time.monotonic() - self._read_at > self.interval:
+                self._online = {row[0] for row in self.conn.execute("SELECT username FROM status WHERE online = 1")}
+                self._read_at = time.monotonic()
+            return self._online
+
+    def is_online(self, username):
+        return username in self.online_users()
+
+    # --- Settling ---
+    def tick(self):
+        """Flush local counts and settle transitions; returns ``{username: online}`` decided by this worker"""
+        now = time.time()
+        changes = {}
+        last_seen = {}
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                pid = os.getpid()
+                for username in self._dirty:
+                    count = self._local.get(username, 0)
+                    if count:
+                        conn.execute("INSERT OR REPLACE INTO sockets (pid, username, count) VALUES (?, ?, ?)", (pid, username, count))
+                    else:
+                        conn.execute("DELETE FROM sockets WHERE pid = ? AND username = ?", (pid, username))
+                self._dirty.clear()
+                if now - self._pruned_at >= PRUNE_EVERY:
+                    self._pruned_at = now
+                    for (other,) in conn.execute("SELECT DISTINCT pid FROM sockets").fetchall():
+                        if other != pid and not pid_alive(other):
+                            conn.execute("DELETE FROM sockets WHERE pid = ?", (other,))
+
+                live = {row[0] for row in conn.execute("SELECT username FROM sockets GROUP BY username HAVING sum(count) > 0")}
+                shown = {row[0]: row[1] for row in conn.execute("SELECT username, zero_since FROM status WHERE online = 1")}
+                for username in live - shown.keys():
+                    conn.execute("INSERT OR REPLACE INTO status (username, online, zero_since) VALUES (?, 1, NULL)", (username,))
+                    changes[username] = True
+                for username, zero_since in shown.items():
+                    if username in live:
+                        if zero_since is not None:
+                            # Came back within the grace period: nothing to report
+                            conn.execute("UPDATE status SET zero_since = NULL WHERE username = ?", (username,))
+                    elif zero_since is None:
+                        conn.execute("UPDATE status SET zero_since = ? WHERE username = ?", (now, username))
+                    elif now - zero_since >= self.grace:
+                        conn.execute("UPDATE status SET online = 0, zero_since = NULL WHERE username = ?", (username,))
+                        changes[username] = False
+                        # Last seen when the final socket went away, not when the grace period ran out
+                        last_seen[username] = datetime.fromtimestamp(zero_since).isoformat()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self._online = (set(shown) | {u for u, online in changes.items() if online}) - \
+                {u for u, online in changes.items() if not online}
+            self._read_at = time.monotonic()
+            self._last_seen.update(last_seen)
+        return changes
+
+    def take_last_seen(self):
+        """Pop the ``{username: iso timestamp}`` batch collected since the last call"""
+        with self.lock:
+            batch, self._last_seen = self._last_seen, {}
+            return batch
+
+    def start(self, spawn, on_changes, sleep=time.sleep):
+        """Start this worker's settle loop with ``spawn`` unless it is already running"""
+        with self.lock:
+            if self._loop_pid == os.getpid():
+                return
+            self._loop_pid = os.getpid()
+        spawn(self._run, on_changes, sleep)
+
+    def _run(self, on_changes, sleep):
+        """Settle every ``interval`` seconds and pass non-empty batches to ``on_changes``"""
+        while True:
+            sleep(self.interval)
+            try:
+                changes = self.tick()
+            except sqlite3.Error:
+                continue
+            if changes:
+                on_changes(changes)
+
+    def close(self):
+        """Drop this worker's sockets from the board"""
+        with self.lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.execute("DELETE FROM sockets WHERE pid = ?", (self._pid,))
+                self._conn.close()
+                self._conn = None
+                self._pid = None
@@ -0,0 +1,348 @@
+"""
+Sampling profiler and slow-request capture for Connectra.
+
+A native sampler thread (a real OS thread even when eventlet has patched
+``threading``) wakes every ``interval`` seconds and reads the stack of every
+other thread with ``sys._current_frames()``. Under eventlet all greenlets
+share the worker's main thread, so its sampled stack is whatever greenlet
+holds the hub at that moment: a request stuck in ``json.dump`` or a
+synchronous SQLite call shows up there, while the hub waiting for I/O (and
+threads parked on a queue or condition) show up as ``(idle)``. Stacks are kept collapsed (``outer;inner;leaf count``, the
+input of flamegraph.pl and speedscope).
+
+Two things use the samples:
+
+* profiling a worker: every sample is counted until it is stopped, then the
+  collapsed profile is saved;
+* slow-request capture: samples taken while a Flask request runs are counted
+  against that request (found through its ``Flask.wsgi_app`` frame), and if
+  it takes longer than the threshold its stacks are saved with its endpoint
+  and duration. Only the last ``keep`` slow requests are kept.
+
+The sampler only runs while one of the two is switched on. Workers are
+controlled through a SQLite file shared by every gunicorn worker: the dev
+dashboard writes the wanted state for a worker pid (or the slow-request
+threshold for all of them), and each worker's ``poll`` loop applies it and
+records a heartbeat, so the dashboard can list workers whichever one serves
+it.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Flask
+
+try:
+    from eventlet import patcher
+    _threading = patcher.original('threading')
+    _time = patcher.original('time')
+except ImportError:  # No eventlet: the standard modules are the native ones
+    import threading as _threading
+    _time = time
+
+WSGI_APP_CODE = Flask.wsgi_app.__code__
+IDLE = '(idle)'
+
+# Innermost frames of threads that are parked rather than working (the eventlet hub is matched by directory)
+IDLE_FRAMES = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get')}
+
+# Workers that have not polled for this long are left off the dashboard
+WORKER_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    profiling INTEGER NOT NULL DEFAULT 0,
+    samples INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS control (
+    pid INTEGER PRIMARY KEY,
+    profiling INTEGER NOT NULL,
+    requested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    stopped_at REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    stacks TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slow_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pid INTEGER NOT NULL,
+    endpoint TEXT,
+    method TEXT,
+    path TEXT,
+    status INTEGER,
+    duration_ms REAL NOT NULL,
+    at REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    stacks TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slow_requests_endpoint ON slow_requests (endpoint, id);
+"""
+
+
+def collapse(stacks):
+    """``Counter({stack: count})`` as collapsed-stack text, heaviest first"""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Profiler:
+    """Per-worker sampler plus the shared control file for the dev dashboard"""
+
+    def __init__(self, path, interval=0.005, slow_ms=0, keep=50, poll_interval=1.0, keep_profiles=20):
+        self.path = path
+        self.interval = interval
+        self.default_slow_ms = slow_ms
+        self.keep = keep
+        self.keep_profiles = keep_profiles
+        self.poll_interval = poll_interval
+        # A native lock for what the sampler thread shares (it is not a greenlet); db_lock for the connection
+        self.lock = _threading.Lock()
+        self.db_lock = threading.RLock()
+        self.slow_ms = slow_ms
+        self.profiling = False
+        self.profile = Counter()
+        self.profile_started = None
+        self.profile_samples = 0
+        self.active = {}
+        self.names = {}
+        self._thread = None
+        self._conn = None
+        self._conn_pid = None
+        self._pid = os.getpid()
+        self._loop_pid = None
+        self._started_at = time.time()
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._conn_pid != os.getpid():
+            self._conn_pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _check_fork(self):
+        # The sampler thread and any profile in progress belong to the parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+            self._started_at = time.time()
+            self.profiling = False
+            self.profile = Counter()
+            self.active = {}
+
+    def _write(self, apply):
+        with self.db_lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = apply(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    def _read(self, query, args=()):
+        with self.db_lock:
+            return self.conn.execute(query, args).fetchall()
+
+    # --- Sampling ---
+    def _name(self, code):
+        name = self.names.get(code)
+        if name is None:
+            name = self.names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def _sample(self):
+        me = _threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            names = []
+            request = None
+            code = frame.f_code
+            idle = (f'{os.sep}hubs{os.sep}' in code.co_filename or
+                    (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES)
+            while frame is not None:
+                if frame.f_code is WSGI_APP_CODE:
+                    request = id(frame)
+                names.append(self._name(frame.f_code))
+                frame = frame.f_back
+            stack = IDLE if idle else ';'.join(reversed(names))
+            with self.lock:
+                if self.profiling:
+                    self.profile[stack] += 1
+                    self.profile_samples += 1
+                if request in self.active:
+                    self.active[request][stack] += 1
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not (self.profiling or self.slow_ms > 0):
+                    self._thread = None
+                    return
+            try:
+                self._sample()
+            except Exception:
+                pass  # A thread exiting mid-walk; the next tick will do
+            _time.sleep(self.interval)
+
+    def _ensure_sampler(self):
+        with self.lock:
+            if self._thread is not None or not (self.profiling or self.slow_ms > 0):
+                return
+            thread = self._thread = _threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        thread.start()
+
+    # --- Requests ---
+    def request_started(self):
+        """Call at the start of a request; returns a token for ``request_finished`` (None when not capturing)"""
+        self._check_fork()
+        if self.slow_ms <= 0:
+            return None
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code is not WSGI_APP_CODE:
+            frame = frame.f_back
+        if frame is None:
+            return None
+        with self.lock:
+            self.active[id(frame)] = Counter()
+        return id(frame), time.perf_counter()
+
+    def request_finished(self, token, endpoint, method, path, status):
+        """Save the request's stacks if it was slower than the threshold"""
+        if token is None:
+            return
+        key, started = token
+        duration_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            stacks = self.active.pop(key, None)
+        if stacks is None or self.slow_ms <= 0 or duration_ms < self.slow_ms:
+            return
+
+        def apply(conn):
+            conn.execute(
+                "INSERT INTO slow_requests (pid, endpoint, method, path, status, duration_ms, at, samples, stacks) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.getpid(), endpoint, method, path, status, duration_ms, time.time(), sum(stacks.values()), collapse(stacks))
+            )
+            conn.execute("DELETE FROM slow_requests WHERE id <= (SELECT max(id) FROM slow_requests) - ?", (self.keep,))
+        self._write(apply)
+
+    # --- Control ---
+    def start(self, spawn, sleep=time.sleep):
+        """Start this worker's control loop with ``spawn`` unless it is already running"""
+        if self._loop_pid == os.getpid():
+            return
+        self._check_fork()
+        self._loop_pid = os.getpid()
+        spawn(self._poll_loop, sleep)
+
+    def _poll_loop(self, sleep):
+        while True:
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass  # Busy or briefly unavailable: the next poll retries
+            sleep(self.poll_interval)
+
+    def poll(self):
+        """Apply the dashboard's wanted state to this worker and record a heartbeat"""
+        self._check_fork()
+        pid = os.getpid()
+        row = self._read("SELECT profiling FROM control WHERE pid = ?", (pid,))
+        self.slow_ms = self._slow_ms_setting()
+        wanted = bool(row and row[0][0])
+        finished = None
+        with self.lock:
+            if wanted and not self.profiling:
+                self.profiling, self.profile, self.profile_samples = True, Counter(), 0
+                self.profile_started = time.time()
+            elif self.profiling and not wanted:
+                self.profiling = False
+                finished = (self.profile_started, self.profile_samples, self.profile)
+                self.profile = Counter()
+            samples = self.profile_samples
+
+        def apply(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (pid, started_at, heartbeat, profiling, samples) VALUES (?, ?, ?, ?, ?)",
+                (pid, self._started_at, now, int(self.profiling), samples)
+            )
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - WORKER_TIMEOUT,))
+            conn.execute("DELETE FROM control WHERE pid NOT IN (SELECT pid FROM workers)")
+            if finished:
+                started_at, count, stacks = finished
+                conn.execute("INSERT INTO profiles (pid, started_at, stopped_at, samples, stacks) VALUES (?, ?, ?, ?, ?)",
+                             (pid, started_at, now, count, collapse(stacks)))
+                conn.execute("DELETE FROM profiles WHERE id <= (SELECT max(id) FROM profiles) - ?", (self.keep_profiles,))
+        self._write(apply)
+        self._ensure_sampler()
+
+    def set_profiling(self, pid, profiling):
+        """Ask worker ``pid`` to start or stop profiling (applied on its next poll)"""
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO control (pid, profiling, requested_at) VALUES (?, ?, ?)",
+            (pid, int(profiling), time.time())
+        ))
+
+    def set_slow_ms(self, slow_ms):
+        """Capture requests slower than ``slow_ms`` in every worker (0 switches capture off)"""
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES ('slow_ms', ?)", (str(slow_ms),)
+        ))
+        self.slow_ms = slow_ms
+        self._ensure_sampler()
+
+    def _slow_ms_setting(self):
+        row = self._read("SELECT value FROM settings WHERE key = 'slow_ms'")
+        return float(row[0][0]) if row else self.default_slow_ms
+
+    # --- Dashboard reads ---
+    def status(self, endpoints=None, limit=20):
+        """Workers, the threshold, recent slow requests (optionally for some endpoints) and saved profiles"""
+        workers = [dict(zip(('pid', 'started_at', 'heartbeat', 'profiling', 'samples', 'requested'), row)) for row in self._read(
+            "SELECT w.pid, w.started_at, w.heartbeat, w.profiling, w.samples, c.profiling FROM workers w "
+            "LEFT JOIN control c ON c.pid = w.pid WHERE w.heartbeat >= ? ORDER BY w.pid", (time.time() - WORKER_TIMEOUT,)
+        )]
+        query = "SELECT id, pid, endpoint, method, path, status, duration_ms, at, samples, stacks FROM slow_requests"
+        args = []
+        if endpoints:
+            query += f" WHERE endpoint IN ({', '.join('?' * len(endpoints))})"
+            args = list(endpoints)
+        slow = []
+        for row in self._read(query + " ORDER BY id DESC LIMIT ?", args + [limit]):
+            item = dict(zip(('id', 'pid', 'endpoint', 'method', 'path', 'status', 'duration_ms', 'at', 'samples'), row[:9]))
+            item['top_stacks'] = row[9].splitlines()[:5]
+            slow.append(item)
+        profiles = [dict(zip(('id', 'pid', 'started_at', 'stopped_at', 'samples'), row)) for row in self._read(
+            "SELECT id, pid, started_at, stopped_at, samples FROM profiles ORDER BY id DESC LIMIT ?", (limit,)
+        )]
+        return {'slow_ms': self._slow_ms_setting(),
+                'workers': workers, 'slow_requests': slow, 'profiles': profiles}
+
+    def stacks(self, kind, item_id):
+        """Collapsed stacks of a saved profile or slow request, or None"""
+        table = {'profile': 'profiles', 'slow': 'slow_requests'}[kind]
+        rows = self._read(f"SELECT stacks FROM {table} WHERE id = ?", (item_id,))
+        return rows[0][0] if rows else None
@@ -0,0 +1,220 @@
+"""
+Read state for Connectra chats: unread counts and read receipts.
+
+Every message posted to a chat takes the chat's next sequence number, and
+every member of a chat has a read position in it (the sequence number and id
+of the last message they have read). A user's unread count for a chat is
+then ``chat seq - read seq``, so:
+
+* posting a message is O(1) however many people can see the chat: one
+  counter bump, one row for the message, and the author's own read position
+  moved past it;
+* marking chats read is one transaction for any number of chats;
+* ``inbox`` returns the chats in a user's list with their unread counts in
+  one indexed query, without looking at anybody else's chats.
+
+Direct-chat participants get a read position when the chat is registered.
+Public chats are in everybody's list; a user's position in one starts where
+it was the first time their inbox was read, rather than counting the whole
+history of the global chat as unread.
+
+The state lives in its own SQLite file shared by every worker, like the
+presence tracker and the social graph. The chats already in the store are
+imported once on first use, with direct chats marked as read by their
+participants.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL DEFAULT 0,
+    public INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS chats_public ON chats (public);
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS reads (
+    username TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL DEFAULT 0,
+    message_id TEXT,
+    read_at REAL,
+    PRIMARY KEY (username, chat_id)
+);
+CREATE INDEX IF NOT EXISTS reads_chat ON reads (chat_id, username);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ReadState:
+    """Per-chat message sequence numbers and per-user read positions in one SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _write(self, apply):
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = apply(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _register(conn, chat_id, participants, seq=0):
+        conn.execute("INSERT OR IGNORE INTO chats (chat_id, seq, public) VALUES (?, ?, ?)",
+                     (chat_id, seq, int(participants is None)))
+        conn.executemany("INSERT OR IGNORE INTO reads (username, chat_id) VALUES (?, ?)",
+                         ((username, chat_id) for username in participants or ()))
+
+    @staticmethod
+    def _advance(conn, username, chat_id, seq, message_id):
+        # Read positions only move forward: a late "read" for an older message changes nothing
+        conn.execute(
+            "INSERT INTO reads (username, chat_id, seq, message_id, read_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (username, chat_id) DO UPDATE SET seq = excluded.seq, message_id = excluded.message_id, "
+            "read_at = excluded.read_at WHERE excluded.seq > reads.seq",
+            (username, chat_id, seq, message_id, time.time())
+        )
+
+    @staticmethod
+    def _unread(conn, username, chat_id):
+        row = conn.execute(
+            "SELECT c.seq - coalesce(r.seq, c.seq) FROM chats c LEFT JOIN reads r "
+            "ON r.chat_id = c.chat_id AND r.username = ? WHERE c.chat_id = ?", (username, chat_id)
+        ).fetchone()
+        return max(row[0], 0) if row else 0
+
+    # --- Writes ---
+    def add_chat(self, chat_id, participants=None):
+        """Register a chat: a direct chat between ``participants``, or a public one without them"""
+        self._write(lambda conn: self._register(conn, chat_id, participants))
+
+    def posted(self, chat_id, message_id, author):
+        """Number a new message and move its author's read position past it; returns its sequence number"""
+        def apply(conn):
+            conn.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (chat_id,))
+            conn.execute("UPDATE chats SET seq = seq + 1 WHERE chat_id = ?", (chat_id,))
+            seq = conn.execute("SELECT seq FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+            conn.execute("INSERT OR IGNORE INTO messages (chat_id, message_id, seq) VALUES (?, ?, ?)", (chat_id, message_id, seq))
+            self._advance(conn, author, chat_id, seq, message_id)
+            return seq
+        return self._write(apply)
+
+    def mark_read(self, username, reads):
+        """Apply ``{chat_id: message_id}`` read positions (None means the latest message) in one transaction.
+
+        Returns ``{chat_id: unread count}`` for those chats afterwards.
+        """
+        def apply(conn):
+            counts = {}
+            for chat_id, message_id in reads.items():
+                if message_id is None:
+                    row = conn.execute(
+                        "SELECT seq, (SELECT message_id FROM messages m WHERE m.chat_id = c.chat_id AND m.seq = c.seq) "
+                        "FROM chats c WHERE chat_id = ?", (chat_id,)
+                    ).fetchone()
+                else:
+                    row = conn.execute(
+                        "SELECT seq, message_id FROM messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+                    ).fetchone()
+                if row:
+                    self._advance(conn, username, chat_id, row[0], row[1])
+                counts[chat_id] = self._unread(conn, username, chat_id)
+            return counts
+        return self._write(apply)
+
+    def remove_user(self, username):
+        self._write(lambda conn: conn.execute("DELETE FROM reads WHERE username = ?", (username,)))
+
+    # --- Reads ---
+    def inbox(self, username):
+        """``{chat_id: unread count}`` for the user's direct chats and every public chat"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT c.chat_id, c.seq, r.seq FROM reads r JOIN chats c ON c.chat_id = r.chat_id WHERE r.username = ? "
+                "UNION ALL SELECT c.chat_id, c.seq, NULL FROM chats c WHERE c.public = 1 AND NOT EXISTS "
+                "(SELECT 1 FROM reads r WHERE r.chat_id = c.chat_id AND r.username = ?)", (username, username)
+            ).fetchall()
+        unseen = [chat_id for chat_id, _, read_seq in rows if read_seq is None]
+        if unseen:
+            # First look at these public chats: start from where they are now
+            def apply(conn):
+                conn.executemany(
+                    "INSERT OR IGNORE INTO reads (username, chat_id, seq) SELECT ?, chat_id, seq FROM chats WHERE chat_id = ?",
+                    ((username, chat_id) for chat_id in unseen)
+                )
+            self._write(apply)
+        return {chat_id: 0 if read_seq is None else max(seq - read_seq, 0) for chat_id, seq, read_seq in rows}
+
+    def unread_count(self, username, chat_id):
+        with self.lock:
+            return self._unread(self.conn, username, chat_id)
+
+    def receipts(self, chat_id, usernames):
+        """``{username: id of the last message they read}`` for those with a read position in the chat"""
+        names = list(set(usernames))
+        if not names:
+            return {}
+        with self.lock:
+            return dict(self.conn.execute(
+                f"SELECT username, message_id FROM reads WHERE chat_id = ? AND message_id IS NOT NULL "
+                f"AND username IN ({', '.join('?' * len(names))})", [chat_id] + names
+            ))
+
+    # --- Import ---
+    def import_chats(self, chats):
+        """Register chat documents and number their messages, with direct chats read by their participants, once"""
+        def apply(conn):
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'imported_chats'").fetchone():
+                return 0
+            imported = 0
+            for chat in chats:
+                messages = chat.get('messages') or []
+                participants = chat.get('participants') if chat.get('type') == 'direct' else None
+                self._register(conn, chat['id'], participants, len(messages))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO messages (chat_id, message_id, seq) VALUES (?, ?, ?)",
+                    ((chat['id'], message['id'], seq) for seq, message in enumerate(messages, 1) if message.get('id'))
+                )
+                for participant in participants or ():
+                    self._advance(conn, participant, chat['id'], len(messages), messages[-1].get('id') if messages else None)
+                imported += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('imported_chats', ?)", (str(time.time()),))
+            return imported
+        return self._write(apply)
+
+    def needs_import(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'imported_chats'").fetchone() is None
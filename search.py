@@ -0,0 +1,304 @@
+"""
+Full-text search for Connectra.
+
+``SearchIndex`` keeps an inverted index (an SQLite FTS5 table) over chat
+messages, blog posts and clips in its own file, shared by every worker like
+the presence tracker and the social graph. Documents are added as they are
+written (``add_message``, ``add_blog``, ``add_clip``); the content already in
+the store is imported once on first use, and ``python search.py reindex``
+rebuilds the index from scratch.
+
+Text goes through ``tokenize`` before it reaches FTS5, and queries go
+through the same function, so both sides agree on what a word is:
+
+* markdown and HTML markup are dropped (``**bold**`` is ``bold``, a link is
+  its text plus the host of its URL), as is the mojibake in old welcome
+  messages (``ðŸŽ‰`` is read back as 🎉);
+* words are case-folded with accents removed (``Café`` finds ``cafe``);
+* each emoji is a word of its own (``e1f389`` for 🎉), without skin-tone
+  modifiers or variation selectors, so searching for 🎉 finds it.
+
+Who may see a document is indexed with it: public content carries the
+``public`` access token and a direct-chat message one token per participant,
+and every query is restricted to ``public`` plus the searching user's token.
+Access control is part of the index lookup, not a filter over results.
+
+Results come newest first (FTS5 rowid order) with the last rowid as the
+cursor, so a page costs O(limit) index steps rather than a ranking pass over
+every match; this is what keeps queries fast on millions of messages (see
+benchmarks/search_bench.py).
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    parent_id TEXT,
+    author TEXT,
+    created_at TEXT,
+    preview TEXT,
+    UNIQUE (kind, doc_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(
+    body, kind, access, tokenize = 'unicode61 remove_diacritics 0', prefix = '2 3'
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+KINDS = ('message', 'blog', 'clip')
+PREVIEW_LENGTH = 200
+MAX_TOKENS = 5000
+MAX_QUERY_TOKENS = 8
+
+EMOJI = (
+    '\U0001F1E6-\U0001F1FF'  # regional indicators (flags)
+    '\U0001F300-\U0001F3FA\U0001F400-\U0001FAFF'  # pictographs, skipping the skin-tone modifiers
+    '\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF'  # symbols, dingbats, arrows
+)
+TOKEN_PATTERN = re.compile(f'[{EMOJI}]|[^\\W_]+')
+LINK_PATTERN = re.compile(r'!?\[([^\]]*)\]\(\s*(?:https?://)?([^/\s)]*)[^)]*\)')
+URL_PATTERN = re.compile(r'https?://([^/\s]+)\S*')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# UTF-8 sequences read as cp1252: a lead byte (Â/Ã for 2 bytes, â for 3, ð for 4) and continuation bytes
+MOJIBAKE_PATTERN = re.compile('[ÂÃâð][{}]+'.format(re.escape(bytes(range(0x80, 0xc0)).decode('cp1252', errors='ignore'))))
+
+
+def fix_mojibake(text):
+    """Undo UTF-8 that was decoded as cp1252 somewhere on its way into the database"""
+    def repair(match):
+        try:
+            return match.group(0).encode('cp1252').decode('utf-8')
+        except UnicodeError:
+            return match.group(0)
+    return MOJIBAKE_PATTERN.sub(repair, text)
+
+
+def tokenize(text):
+    """Words and emoji of ``text``, normalized for indexing and for queries"""
+    if not text:
+        return []
+    text = fix_mojibake(text)
+    text = LINK_PATTERN.sub(r' \1 \2 ', text)
+    text = URL_PATTERN.sub(r' \1 ', text)
+    text = TAG_PATTERN.sub(' ', text)
+    text = ''.join(ch for ch in unicodedata.normalize('NFKD', text.casefold()) if not unicodedata.combining(ch))
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group(0)
+        tokens.append(f'e{ord(token):x}' if len(token) == 1 and not token.isalnum() else token[:64])
+        if len(tokens) >= MAX_TOKENS:
+            break
+    return tokens
+
+
+def user_token(username):
+    # Hex keeps any username a single index word
+    return 'u' + username.lower().encode('utf-8').hex()
+
+
+def message_text(message):
+    return message.get('raw_content') or message.get('content') or ''
+
+
+def message_access(chat):
+    """Access tokens for a chat's messages: its participants for a direct chat, else public"""
+    if chat.get('type') == 'direct':
+        return [user_token(participant) for participant in chat.get('participants', [])]
+    return ['public']
+
+
+def preview(text):
+    text = ' '.join(TAG_PATTERN.sub(' ', fix_mojibake(text or '')).split())
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + '…'
+
+
+class SearchIndex:
+    """FTS5 index over messages, blogs and clips with per-document access tokens"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _write(self, apply):
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = apply(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _put(conn, *args):
+        # Re-adding a document replaces it (and moves it to the newest position)
+        SearchIndex._drop(conn, args[0], args[1])
+        SearchIndex._insert(conn, *args)
+
+    @staticmethod
+    def _insert(conn, kind, doc_id, text, access, parent_id=None, author=None, created_at=None, shown=None):
+        rowid = conn.execute(
+            "INSERT INTO docs (kind, doc_id, parent_id, author, created_at, preview) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, doc_id, parent_id, author, created_at, preview(text if shown is None else shown))
+        ).lastrowid
+        conn.execute("INSERT INTO terms (rowid, body, kind, access) VALUES (?, ?, ?, ?)",
+                     (rowid, ' '.join(tokenize(text)), kind, ' '.join(access)))
+
+    @staticmethod
+    def _drop(conn, kind, doc_id):
+        row = conn.execute("SELECT id FROM docs WHERE kind = ? AND doc_id = ?", (kind, doc_id)).fetchone()
+        if row:
+            conn.execute("DELETE FROM terms WHERE rowid = ?", row)
+            conn.execute("DELETE FROM docs WHERE id = ?", row)
+
+    @staticmethod
+    def _message_args(chat, message):
+        return ('message', message['id'], message_text(message), message_access(chat), chat['id'],
+                message.get('username') or message.get('user_id'), message.get('timestamp'))
+
+    @staticmethod
+    def _blog_args(blog):
+        return ('blog', blog['id'], f"{blog.get('title', '')}\n{blog.get('content', '')}", ['public'], None,
+                blog.get('author') or blog.get('author_id'), blog.get('created_at'), blog.get('title'))
+
+    @staticmethod
+    def _clip_args(clip):
+        return ('clip', clip['id'], f"{clip.get('title', '')}\n{clip.get('description', '')}", ['public'], None,
+                clip.get('author'), clip.get('created_at'), clip.get('title'))
+
+    # --- Writes ---
+    def add_message(self, chat, message):
+        self.add_messages(chat, [message])
+
+    def add_messages(self, chat, messages):
+        """Index several messages of one chat in one transaction"""
+        def apply(conn):
+            for message in messages:
+                if message.get('id'):
+                    self._put(conn, *self._message_args(chat, message))
+        self._write(apply)
+
+    def add_blog(self, blog):
+        self._write(lambda conn: self._put(conn, *self._blog_args(blog)))
+
+    def add_clip(self, clip):
+        self._write(lambda conn: self._put(conn, *self._clip_args(clip)))
+
+    def remove(self, kind, doc_id):
+        self._write(lambda conn: self._drop(conn, kind, doc_id))
+
+    # --- Reads ---
+    def search(self, query, username, scope=None, before=None, limit=20):
+        """Documents matching every word of ``query`` that ``username`` may see, newest first.
+
+        The last word also matches as a prefix (search as you type). ``scope`` is one of KINDS or None
+        for all of them. Returns ``(results, next_cursor)``.
+        """
+        tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+        if not tokens:
+            return [], None
+        # Tokens are letters, digits or e<hex>, so they are safe inside quotes
+        terms = [f'body : "{token}"' for token in tokens]
+        if not query.endswith(' '):
+            terms[-1] += '*'
+        expression = ' AND '.join(terms) + f' AND (access : "public" OR access : "{user_token(username)}")'
+        if scope in KINDS:
+            expression += f' AND kind : "{scope}"'
+        try:
+            before = int(before) if before else None
+        except ValueError:
+            return [], None
+        with self.lock:
+            if before:
+                ids = self.conn.execute(
+                    "SELECT rowid FROM terms WHERE terms MATCH ? AND rowid < ? ORDER BY rowid DESC LIMIT ?",
+                    (expression, before, limit + 1)
+                ).fetchall()
+            else:
+                ids = self.conn.execute(
+                    "SELECT rowid FROM terms WHERE terms MATCH ? ORDER BY rowid DESC LIMIT ?", (expression, limit + 1)
+                ).fetchall()
+            ids = [row[0] for row in ids]
+            rows = self.conn.execute(
+                f"SELECT id, kind, doc_id, parent_id, author, created_at, preview FROM docs "
+                f"WHERE id IN ({', '.join('?' * len(ids[:limit]))})", ids[:limit]
+            ).fetchall() if ids else []
+        by_id = {row[0]: row for row in rows}
+        results = [
+            {'kind': kind, 'id': doc_id, 'parent_id': parent_id, 'author': author, 'created_at': created_at, 'preview': text}
+            for _, kind, doc_id, parent_id, author, created_at, text in (by_id[i] for i in ids[:limit] if i in by_id)
+        ]
+        return results, (str(ids[limit - 1]) if len(ids) > limit else None)
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM docs").fetchone()[0]
+
+    # --- Import ---
+    def import_store(self, data, force=False):
+        """Index every message, blog and clip of a store dump, oldest first, once (``force`` rebuilds)"""
+        def apply(conn):
+            if not force and conn.execute("SELECT 1 FROM meta WHERE key = 'imported_store'").fetchone():
+                return 0
+            conn.execute("DELETE FROM terms")
+            conn.execute("DELETE FROM docs")
+            documents = [self._message_args(chat, message)
+                         for chat in data.get('chats', []) for message in chat.get('messages', []) if message.get('id')]
+            documents += [self._blog_args(blog) for blog in data.get('blogs', []) if blog.get('id')]
+            documents += [self._clip_args(clip) for clip in data.get('clips', []) if clip.get('id')]
+            # Rowids double as the newest-first order
+            documents.sort(key=lambda args: args[6] or '')
+            for args in documents:
+                self._insert(conn, *args)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_store', ?)", (str(time.time()),))
+            return len(documents)
+        return self._write(apply)
+
+    def needs_import(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'imported_store'").fetchone() is None
+
+    def optimize(self):
+        """Merge the index segments (worth running after a large import)"""
+        self._write(lambda conn: conn.execute("INSERT INTO terms (terms) VALUES ('optimize')"))
+
+
+if __name__ == '__main__':
+    # python search.py reindex   (run from the app directory, like the server)
+    if len(sys.argv) < 2 or sys.argv[1] != 'reindex':
+        print('usage: python search.py reindex')
+        sys.exit(2)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    started = time.perf_counter()
+    indexed = main.search_index.import_store(main.store.load(), force=True)
+    main.search_index.optimize()
+    print(f"Indexed {indexed} documents in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,231 @@
+"""
+Social graph for Connectra.
+
+Who follows whom used to live in ``followers``/``following`` lists on every
+user document: membership checks and unfollows scanned the lists, and a
+popular account's whole follower list was rewritten with its user record.
+``SocialGraph`` keeps the edges in their own SQLite file instead, one row per
+follow with indexes in both directions, plus a ``counts`` row per user that
+is updated in the same transaction as the edge. So:
+
+* follow, unfollow and "does A follow B" are index lookups;
+* follower and following counts are a single row read;
+* follower lists are paged newest first with keyset cursors;
+* ``following_among`` answers "which of these users does A follow" for a
+  whole page of clips in one query.
+
+The lists already stored on user documents are imported once on first use;
+after that the graph is the only place follows are written.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from storage import encode_cursor, decode_cursor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS follows (
+    follower TEXT NOT NULL,
+    followee TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (follower, followee)
+);
+CREATE INDEX IF NOT EXISTS follows_followee ON follows (followee, created_at, follower);
+CREATE INDEX IF NOT EXISTS follows_follower ON follows (follower, created_at, followee);
+CREATE TABLE IF NOT EXISTS counts (
+    username TEXT PRIMARY KEY,
+    followers INTEGER NOT NULL DEFAULT 0,
+    following INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SocialGraph:
+    """Follow edges with maintained counts, shared by every worker through one SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # One connection per worker, never shared across fork()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _write(self, apply):
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = apply(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    @staticmethod
+    def _bump(conn, follower, followee, amount):
+        conn.executemany("INSERT OR IGNORE INTO counts (username) VALUES (?)", ((follower,), (followee,)))
+        conn.execute("UPDATE counts SET following = following + ? WHERE username = ?", (amount, follower))
+        conn.execute("UPDATE counts SET followers = followers + ? WHERE username = ?", (amount, followee))
+
+    @staticmethod
+    def _add(conn, follower, followee, created_at=None):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO follows (follower, followee, created_at) VALUES (?, ?, ?)",
+            (follower, followee, time.time() if created_at is None else created_at)
+        )
+        if cursor.rowcount:
+            SocialGraph._bump(conn, follower, followee, 1)
+        return bool(cursor.rowcount)
+
+    # --- Writes ---
+    def follow(self, follower, followee):
+        """Add an edge; False if it already existed"""
+        return self._write(lambda conn: self._add(conn, follower, followee))
+
+    def unfollow(self, follower, followee):
+        """Remove an edge; False if there was none"""
+        def apply(conn):
+            cursor = conn.execute("DELETE FROM follows WHERE follower = ? AND followee = ?", (follower, followee))
+            if cursor.rowcount:
+                self._bump(conn, follower, followee, -1)
+            return bool(cursor.rowcount)
+        return self._write(apply)
+
+    def toggle(self, follower, followee):
+        """Follow, or unfollow if already following: ``(following, followee's followers, follower's following)``"""
+        def apply(conn):
+            cursor = conn.execute("DELETE FROM follows WHERE follower = ? AND followee = ?", (follower, followee))
+            if cursor.rowcount:
+                self._bump(conn, follower, followee, -1)
+            else:
+                self._add(conn, follower, followee)
+            followers = conn.execute("SELECT followers FROM counts WHERE username = ?", (followee,)).fetchone()[0]
+            following = conn.execute("SELECT following FROM counts WHERE username = ?", (follower,)).fetchone()[0]
+            return not cursor.rowcount, followers, following
+        return self._write(apply)
+
+    def remove_user(self, username):
+        """Drop every edge touching ``username`` and fix the counts on the other ends"""
+        def apply(conn):
+            conn.execute(
+                "UPDATE counts SET followers = followers - 1 WHERE username IN "
+                "(SELECT followee FROM follows WHERE follower = ?)", (username,)
+            )
+            conn.execute(
+                "UPDATE counts SET following = following - 1 WHERE username IN "
+                "(SELECT follower FROM follows WHERE followee = ?)", (username,)
+            )
+            conn.execute("DELETE FROM follows WHERE follower = ? OR followee = ?", (username, username))
+            conn.execute("DELETE FROM counts WHERE username = ?", (username,))
+        self._write(apply)
+
+    # --- Reads ---
+    def is_following(self, follower, followee):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM follows WHERE follower = ? AND followee = ?", (follower, followee)
+            ).fetchone() is not None
+
+    def following_among(self, follower, usernames):
+        """The subset of ``usernames`` that ``follower`` follows"""
+        names = list(set(usernames))
+        found = set()
+        with self.lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT followee FROM follows WHERE follower = ? AND followee IN ({', '.join('?' * len(chunk))})",
+                    [follower] + chunk
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def counts(self, username):
+        """``(followers, following)``"""
+        with self.lock:
+            row = self.conn.execute("SELECT followers, following FROM counts WHERE username = ?", (username,)).fetchone()
+            return tuple(row) if row else (0, 0)
+
+    def counts_many(self, usernames):
+        """``{username: (followers, following)}`` for users with any edges"""
+        names = list(set(usernames))
+        found = {}
+        with self.lock:
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT username, followers, following FROM counts WHERE username IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+                found.update((username, (followers, following)) for username, followers, following in rows)
+        return found
+
+    def followers(self, username, before=None, limit=50):
+        """Newest followers first: ``(usernames, next_cursor)``"""
+        return self._page('followee', 'follower', username, before, limit)
+
+    def following(self, username, before=None, limit=50):
+        """Newest follows first: ``(usernames, next_cursor)``"""
+        return self._page('follower', 'followee', username, before, limit)
+
+    def _page(self, key_column, other_column, username, before, limit):
+        # Keyset pagination over the (key, created_at, other) index, so a page costs O(limit)
+        with self.lock:
+            if before:
+                created_at, other = decode_cursor(before)
+                if other is None:
+                    return [], None
+                rows = self.conn.execute(
+                    f"SELECT {other_column}, created_at FROM follows WHERE {key_column} = ? AND "
+                    f"(created_at < ? OR (created_at = ? AND {other_column} < ?)) "
+                    f"ORDER BY created_at DESC, {other_column} DESC LIMIT ?",
+                    (username, created_at, created_at, other, limit + 1)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    f"SELECT {other_column}, created_at FROM follows WHERE {key_column} = ? "
+                    f"ORDER BY created_at DESC, {other_column} DESC LIMIT ?", (username, limit + 1)
+                ).fetchall()
+        page = [name for name, _ in rows[:limit]]
+        if len(rows) <= limit:
+            return page, None
+        return page, encode_cursor({'created_at': rows[limit - 1][1], 'id': rows[limit - 1][0]}, 'created_at')
+
+    # --- Import ---
+    def import_user_lists(self, users):
+        """Copy the ``followers``/``following`` lists of user documents into the graph, once"""
+        def apply(conn):
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'imported_user_lists'").fetchone():
+                return 0
+            added = 0
+            for user in users:
+                for followee in user.get('following') or []:
+                    added += self._add(conn, user['username'], followee, 0)
+                for follower in user.get('followers') or []:
+                    added += self._add(conn, follower, user['username'], 0)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('imported_user_lists', ?)", (str(time.time()),))
+            return added
+        return self._write(apply)
+
+    def needs_import(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'imported_user_lists'").fetchone() is None
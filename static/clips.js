@@ -2,10 +2,19 @@
 let currentVideoIndex = 0;
 let videos = [];
 let isPlaying = false;
+let videoObserver = null;
+let feedSort = 'latest';
+let feedCursor = null;
+let loadingClips = false;
+const renderedClipIds = new Set();
 
 // Initialize clips
 document.addEventListener('DOMContentLoaded', function() {
     videos = document.querySelectorAll('.clip-video');
+    const feed = document.getElementById('clips-feed');
+    feedSort = feed.dataset.sort || 'latest';
+    feedCursor = feed.dataset.nextCursor || null;
+    document.querySelectorAll('.clip-item').forEach(item => renderedClipIds.add(item.dataset.clipId));
     setupIntersectionObserver();
     setupKeyboardControls();
     
@@ -23,7 +32,7 @@ function setupIntersectionObserver() {
         threshold: 0.5
     };
 
-    const observer = new IntersectionObserver((entries) => {
+    videoObserver = new IntersectionObserver((entries) => {
         entries.forEach(entry => {
             const video = entry.target;
             if (entry.isIntersecting) {
@@ -31,6 +40,10 @@ function setupIntersectionObserver() {
                 video.play();
                 updatePlayPauseButton(video, true);
                 currentVideoIndex = Array.from(videos).indexOf(video);
+                // Fetch the next page while the last couple of clips are still playing
+                if (currentVideoIndex >= videos.length - 2) {
+                    loadMoreClips();
+                }
             } else {
                 // Pause video when out of view
                 video.pause();
@@ -40,10 +53,121 @@ function setupIntersectionObserver() {
     }, options);
 
     videos.forEach(video => {
-        observer.observe(video);
+        videoObserver.observe(video);
     });
 }
 
+// Infinite scroll: append the next page of the feed
+async function loadMoreClips() {
+    if (loadingClips || !feedCursor) return;
+    loadingClips = true;
+    try {
+        const params = new URLSearchParams({ cursor: feedCursor, sort: feedSort });
+        const response = await fetch(`/api/clips/feed?${params}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        const feed = document.getElementById('clips-feed');
+        data.clips.forEach(clip => {
+            // A trending page can repeat a clip when the ranking was refreshed in between
+            if (renderedClipIds.has(clip.id)) return;
+            renderedClipIds.add(clip.id);
+            feed.insertAdjacentHTML('beforeend', renderClipItem(clip));
+            videoObserver.observe(feed.lastElementChild.querySelector('.clip-video'));
+        });
+        videos = document.querySelectorAll('.clip-video');
+        feedCursor = data.next_cursor;
+    } catch (error) {
+        console.error('Error loading clips:', error);
+    } finally {
+        loadingClips = false;
+    }
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
+// Same markup as the clip items rendered by clips.html
+function renderClipItem(clip) {
+    const id = escapeHtml(clip.id);
+    const author = escapeHtml(clip.author);
+    const poster = clip.thumbnail ? ` poster="/clips/${escapeHtml(clip.thumbnail)}"` : '';
+    return `
+        <div class="clip-item" data-clip-id="${id}">
+            <div class="clip-video-container">
+                <video class="clip-video" loop muted playsinline preload="none"${poster}>
+                    <source src="/clips/${escapeHtml(clip.rendition || clip.video_filename)}" type="video/mp4">
+                </video>
+                <div class="clip-overlay">
+                    <div class="clip-info">
+                        <div class="clip-author" onclick="viewProfile('${author}')">
+                            <div class="author-avatar">
+                                ${clip.author_avatar ? `<img src="/photos/${escapeHtml(clip.author_avatar)}?s=64" alt="Avatar">` : '<i class="fas fa-user-circle"></i>'}
+                            </div>
+                            <div class="author-info">
+                                <span class="author-name">${escapeHtml(clip.author_display_name || clip.author)}</span>
+                                <span class="author-handle">@${author}</span>
+                            </div>
+                            <button class="follow-btn${clip.author_followed ? ' following' : ''}" onclick="toggleFollow('${author}', event)" data-username="${author}">
+                                ${followButtonLabel(clip.author_followed)}
+                            </button>
+                        </div>
+                        <h3 class="clip-title">${escapeHtml(clip.title)}</h3>
+                        ${clip.description ? `<p class="clip-description">${escapeHtml(clip.description)}</p>` : ''}
+                        <div class="clip-stats">
+                            <span><i class="fas fa-eye"></i> ${(clip.views || 0).toLocaleString()}</span>
+                            <span><i class="fas fa-heart"></i> ${(clip.likes || 0).toLocaleString()}</span>
+                            <span><i class="fas fa-comment"></i> ${clip.comment_count || 0}</span>
+                            <span><i class="fas fa-share"></i> ${clip.shares || 0}</span>
+                        </div>
+                    </div>
+                    <div class="clip-actions">
+                        <button class="action-btn like-btn" onclick="toggleLike('${id}')">
+                            <i class="fas fa-heart"></i>
+                            <span class="like-count">${(clip.likes || 0).toLocaleString()}</span>
+                        </button>
+                        <button class="action-btn comment-btn" onclick="toggleComments('${id}')">
+                            <i class="fas fa-comment"></i>
+                            <span class="comment-count">${clip.comment_count || 0}</span>
+                        </button>
+                        <button class="action-btn share-btn" onclick="shareClip('${id}')">
+                            <i class="fas fa-share"></i>
+                            <span class="share-count">${clip.shares || 0}</span>
+                        </button>
+                        <button class="action-btn bookmark-btn" onclick="toggleBookmark('${id}')">
+                            <i class="far fa-bookmark"></i>
+                        </button>
+                        <button class="action-btn more-btn" onclick="showClipOptions('${id}')">
+                            <i class="fas fa-ellipsis-v"></i>
+                        </button>
+                    </div>
+                </div>
+                <div class="play-pause-btn" onclick="togglePlayPause(this)">
+                    <i class="fas fa-play"></i>
+                </div>
+            </div>
+            <div class="comments-section" id="comments-${id}" style="display: none;">
+                <div class="comments-header">
+                    <h4>Comments</h4>
+                    <button class="close-comments" onclick="toggleComments('${id}')">
+                        <i class="fas fa-times"></i>
+                    </button>
+                </div>
+                <button class="load-earlier-comments" style="display: none;" onclick="loadComments('${id}')">Load earlier comments</button>
+                <div class="comments-list"></div>
+                <div class="comment-form">
+                    <input type="text" placeholder="Add a comment..." id="comment-input-${id}">
+                    <button onclick="addComment('${id}')">
+                        <i class="fas fa-paper-plane"></i>
+                    </button>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
 // Setup keyboard controls
 function setupKeyboardControls() {
     document.addEventListener('keydown', (e) => {
@@ -176,12 +300,70 @@ function createHeartAnimation(button) {
     }, 1000);
 }
 
+// Comments are not part of the feed: each clip's are fetched a page at a time when first opened
+const commentCursors = {};
+
+function renderComment(comment) {
+    const commentId = escapeHtml(comment.id);
+    return `
+        <div class="comment" data-comment-id="${commentId}">
+            <div class="comment-header">
+                <div class="comment-author-info">
+                    <div class="comment-avatar">
+                        ${comment.author_avatar ? `<img src="/photos/${escapeHtml(comment.author_avatar)}?s=64" alt="Avatar">` : '<i class="fas fa-user-circle"></i>'}
+                    </div>
+                    <div class="comment-author-details">
+                        <span class="comment-author">${escapeHtml(comment.author_display_name || comment.author)}</span>
+                        <span class="comment-handle">@${escapeHtml(comment.author)}</span>
+                    </div>
+                </div>
+                <div class="comment-actions">
+                    <button class="comment-like-btn${comment.liked ? ' liked' : ''}" onclick="toggleCommentLike('${commentId}')">
+                        <i class="${comment.liked ? 'fas' : 'far'} fa-heart"></i>
+                        <span class="comment-like-count">${comment.likes || 0}</span>
+                    </button>
+                </div>
+            </div>
+            <div class="comment-content">${escapeHtml(comment.content)}</div>
+            <div class="comment-time">${escapeHtml(comment.created_at)}</div>
+        </div>
+    `;
+}
+
+// Load the newest page of comments, or the page before the ones already shown
+async function loadComments(clipId) {
+    const section = document.getElementById(`comments-${clipId}`);
+    const cursor = commentCursors[clipId];
+    if (section.dataset.loading || cursor === null) return;
+    section.dataset.loading = '1';
+    try {
+        const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await fetch(`/api/clips/${clipId}/comments${params}`);
+        if (response.ok) {
+            const data = await response.json();
+            // Pages come oldest first; older pages go above what is already shown
+            section.querySelector('.comments-list').insertAdjacentHTML('afterbegin', data.comments
+                .filter(comment => !section.querySelector(`[data-comment-id="${CSS.escape(comment.id)}"]`))
+                .map(renderComment).join(''));
+            commentCursors[clipId] = data.next_cursor;
+            section.querySelector('.load-earlier-comments').style.display = data.next_cursor ? 'block' : 'none';
+        }
+    } catch (error) {
+        console.error('Error loading comments:', error);
+    } finally {
+        delete section.dataset.loading;
+    }
+}
+
 // Toggle comments
 function toggleComments(clipId) {
     const commentsSection = document.getElementById(`comments-${clipId}`);
     if (commentsSection.style.display === 'none') {
         commentsSection.style.display = 'block';
         commentsSection.scrollIntoView({ behavior: 'smooth' });
+        if (!(clipId in commentCursors)) {
+            loadComments(clipId);
+        }
     } else {
         commentsSection.style.display = 'none';
     }
@@ -223,14 +405,7 @@ async function addComment(clipId) {
 // Add comment to UI
 function addCommentToUI(clipId, comment) {
     const commentsList = document.querySelector(`#comments-${clipId} .comments-list`);
-    const commentElement = document.createElement('div');
-    commentElement.className = 'comment';
-    commentElement.innerHTML = `
-        <div class="comment-author">@${comment.author}</div>
-        <div class="comment-content">${comment.content}</div>
-        <div class="comment-time">Just now</div>
-    `;
-    commentsList.appendChild(commentElement);
+    commentsList.insertAdjacentHTML('beforeend', renderComment(comment));
 }
 
 // Share clip
@@ -271,6 +446,7 @@ async function shareClip(clipId) {
 // Follow/Unfollow user
 async function toggleFollow(username, event) {
     event.stopPropagation(); // Prevent triggering profile view
+    const clickedButton = event.currentTarget;
 
     try {
         const response = await fetch(`/api/follow/${username}`, {
@@ -279,26 +455,25 @@ async function toggleFollow(username, event) {
 
         if (response.ok) {
             const data = await response.json();
-            const followBtn = document.querySelector(`[data-username="${username}"] .follow-btn`);
-
-            if (data.following) {
-                followBtn.innerHTML = '<i class="fas fa-check"></i> Following';
-                followBtn.classList.add('following');
-                showToast(`Now following @${username}!`);
-            } else {
-                followBtn.innerHTML = '<i class="fas fa-plus"></i> Follow';
-                followBtn.classList.remove('following');
-                showToast(`Unfollowed @${username}`);
-            }
+            // Every clip by this author in the feed has its own button
+            document.querySelectorAll(`.follow-btn[data-username="${username}"]`).forEach(followBtn => {
+                followBtn.innerHTML = followButtonLabel(data.following);
+                followBtn.classList.toggle('following', data.following);
+            });
+            showToast(data.following ? `Now following @${username}!` : `Unfollowed @${username}`);
 
             // Add follow animation
-            createFollowAnimation(followBtn);
+            createFollowAnimation(clickedButton);
         }
     } catch (error) {
         console.error('Error toggling follow:', error);
     }
 }
 
+function followButtonLabel(following) {
+    return following ? '<i class="fas fa-check"></i> Following' : '<i class="fas fa-plus"></i> Follow';
+}
+
 // View user profile
 function viewProfile(username) {
     // TODO: Implement user profile modal or page
@@ -493,6 +668,15 @@ style.textContent = `
         cursor: pointer;
     }
     
+    .load-earlier-comments {
+        background: none;
+        border: none;
+        color: var(--orange);
+        cursor: pointer;
+        margin-bottom: 0.5rem;
+        padding: 0;
+    }
+    
     .comment {
         margin-bottom: 1rem;
         padding: 0.5rem;
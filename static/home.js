@@ -9,12 +9,21 @@ let currentChatType = 'global'; // 'global' or 'dm'
 let currentChatPartner = null;
 let userChats = [];
 let typingUsers = new Set();
+let historyCursor = null; // cursor for the next older page of the open chat
+let loadingHistory = false;
+let syncVersion = null; // change-feed version of the last delta applied
+let pendingReads = {}; // chat id -> last read message id, sent in one mark_read batch
+let markReadTimer = null;
 
 // Socket connection events
 socket.on('connect', () => {
     console.log('Connected to server');
     // Join user's personal room for DM notifications
     socket.emit('join_chat', { chat_id: currentUser });
+    // Catch up on deltas missed while disconnected
+    if (syncVersion !== null) {
+        syncChanges();
+    }
 });
 
 socket.on('disconnect', () => {
@@ -33,7 +42,7 @@ function renderUserList() {
         li.className = 'user-row';
         li.innerHTML = `
             <span class="profile-thumb" style="background: #eee;">
-                ${u.avatar ? `<img src="/avatars/${u.avatar}" alt="Avatar" class="profile-thumb-img">` : (u.display_name ? u.display_name[0].toUpperCase() : u.username[0].toUpperCase())}
+                ${u.avatar ? `<img src="/avatars/${u.avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : (u.display_name ? u.display_name[0].toUpperCase() : u.username[0].toUpperCase())}
             </span>
             <span class="user-info">
                 <b>${u.display_name}</b><br>
@@ -58,7 +67,7 @@ function renderChatHeader(user) {
     return `
         <header class="chat-header">
             <span class="profile-thumb" style="background: #eee;">
-                ${user.avatar ? `<img src="/avatars/${user.avatar}" alt="Avatar" class="profile-thumb-img">` : (user.display_name ? user.display_name[0].toUpperCase() : user.username[0].toUpperCase())}
+                ${user.avatar ? `<img src="/avatars/${user.avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : (user.display_name ? user.display_name[0].toUpperCase() : user.username[0].toUpperCase())}
             </span>
             <span class="user-info">
                 <b>${user.display_name}</b><br>
@@ -72,30 +81,46 @@ function renderMessages(messages) {
     return messages.map(msg => renderSingleMessage(msg)).join('');
 }
 
+function renderAttachment(att) {
+    const idAttr = att.id ? `data-attachment-id="${att.id}"` : '';
+    if (att.status === 'processing') {
+        // Still being moved into place by an upload worker; message_updated swaps it in
+        return `<div class="attachment file-attachment" ${idAttr}>
+            <i class="fas fa-spinner fa-spin"></i>
+            <span>${att.filename}</span>
+        </div>`;
+    }
+    if (att.status === 'failed') {
+        return `<div class="attachment file-attachment" ${idAttr}>
+            <i class="fas fa-exclamation-triangle"></i>
+            <span>${att.filename} (upload failed)</span>
+        </div>`;
+    }
+    if (att.type === 'image') {
+        return `<div class="attachment image-attachment" ${idAttr}>
+            <img src="/uploads/${att.stored_filename}" alt="${att.filename}" onclick="openImageModal(this.src)">
+        </div>`;
+    } else if (att.type === 'video') {
+        return `<div class="attachment video-attachment" ${idAttr}>
+            <video controls>
+                <source src="/uploads/${att.stored_filename}" type="video/mp4">
+                Your browser does not support the video tag.
+            </video>
+        </div>`;
+    } else {
+        return `<div class="attachment file-attachment" ${idAttr}>
+            <i class="fas fa-file"></i>
+            <a href="/uploads/${att.stored_filename}" download="${att.filename}">${att.filename}</a>
+        </div>`;
+    }
+}
+
 function renderSingleMessage(msg) {
     const user = users.find(u => u.id === msg.user_id) || users.find(u => u.username === msg.username) || {};
     let attachmentHtml = '';
 
     if (msg.attachments && msg.attachments.length > 0) {
-        attachmentHtml = msg.attachments.map(att => {
-            if (att.type === 'image') {
-                return `<div class="attachment image-attachment">
-                    <img src="/uploads/${att.stored_filename}" alt="${att.filename}" onclick="openImageModal(this.src)">
-                </div>`;
-            } else if (att.type === 'video') {
-                return `<div class="attachment video-attachment">
-                    <video controls>
-                        <source src="/uploads/${att.stored_filename}" type="video/mp4">
-                        Your browser does not support the video tag.
-                    </video>
-                </div>`;
-            } else {
-                return `<div class="attachment file-attachment">
-                    <i class="fas fa-file"></i>
-                    <a href="/uploads/${att.stored_filename}" download="${att.filename}">${att.filename}</a>
-                </div>`;
-            }
-        }).join('');
+        attachmentHtml = msg.attachments.map(renderAttachment).join('');
     }
 
     // Format timestamp
@@ -119,7 +144,7 @@ function renderSingleMessage(msg) {
     return `
         <div class="message" data-message-id="${msg.id}">
             <span class="profile-thumb" style="background: #eee;">
-                ${user.avatar ? `<img src="/avatars/${user.avatar}" alt="Avatar" class="profile-thumb-img">` : (user.display_name ? user.display_name[0].toUpperCase() : user.username ? user.username[0].toUpperCase() : '?')}
+                ${user.avatar ? `<img src="/avatars/${user.avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : (user.display_name ? user.display_name[0].toUpperCase() : user.username ? user.username[0].toUpperCase() : '?')}
             </span>
             <div class="message-content">
                 <div class="user-info">
@@ -255,6 +280,12 @@ async function fetchDirectMessage() {
         if (response.ok) {
             const chat = await response.json();
             renderDirectMessageChat(chat);
+            setupHistoryScroll(chat.next_cursor);
+            const otherParticipant = chat.participants.find(p => p !== currentUser);
+            if (chat.read_receipts && chat.read_receipts[otherParticipant]) {
+                showReadReceipt(chat.read_receipts[otherParticipant]);
+            }
+            markRead(chat.id, chat.messages.length ? chat.messages[chat.messages.length - 1].id : null);
         }
     } catch (error) {
         console.error('Error fetching DM:', error);
@@ -274,7 +305,7 @@ function renderDirectMessageChat(chat) {
     chatApp.innerHTML = `
         <header class="chat-header dm-header">
             <span class="profile-thumb" style="background: #eee;">
-                ${otherUser.avatar ? `<img src="/photos/${otherUser.avatar}" alt="Avatar" class="profile-thumb-img">` : otherUser.display_name[0].toUpperCase()}
+                ${otherUser.avatar ? `<img src="/photos/${otherUser.avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : otherUser.display_name[0].toUpperCase()}
             </span>
             <div class="user-info">
                 <b>${otherUser.display_name}</b>
@@ -335,10 +366,9 @@ async function fetchChat() {
         return;
     }
 
-    const res = await fetch('/api/chats');
-    const chats = await res.json();
-    const chat = chats.find(c => c.id === activeChat);
-    if (!chat) return;
+    const res = await fetch(`/api/chats/${encodeURIComponent(activeChat)}/messages`);
+    if (!res.ok) return;
+    const chat = await res.json();
     const user = users.find(u => u.username === currentUser) || {};
 
     chatApp.innerHTML = `
@@ -361,6 +391,40 @@ async function fetchChat() {
     const chatWindow = document.getElementById('chat-window');
     chatWindow.scrollTop = chatWindow.scrollHeight;
     setupChatForm();
+    setupHistoryScroll(chat.next_cursor);
+    markRead(chat.chat_id, chat.messages.length ? chat.messages[chat.messages.length - 1].id : null);
+}
+
+// Load older messages when the chat is scrolled to the top
+function setupHistoryScroll(cursor) {
+    historyCursor = cursor;
+    loadingHistory = false;
+    const chatWindow = document.getElementById('chat-window');
+    if (!chatWindow) return;
+    chatWindow.onscroll = () => {
+        if (chatWindow.scrollTop < 80) loadOlderMessages();
+    };
+}
+
+async function loadOlderMessages() {
+    if (!historyCursor || loadingHistory) return;
+    loadingHistory = true;
+    const chatId = activeChat;
+    try {
+        const res = await fetch(`/api/chats/${encodeURIComponent(chatId)}/messages?before=${encodeURIComponent(historyCursor)}`);
+        if (!res.ok || chatId !== activeChat) return;
+        const page = await res.json();
+        const chatWindow = document.getElementById('chat-window');
+        // Prepend without moving what the user is looking at
+        const previousHeight = chatWindow.scrollHeight;
+        chatWindow.insertAdjacentHTML('afterbegin', renderMessages(page.messages));
+        chatWindow.scrollTop += chatWindow.scrollHeight - previousHeight;
+        historyCursor = page.next_cursor;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+    } finally {
+        loadingHistory = false;
+    }
 }
 
 // Setup chat form handlers
@@ -407,7 +471,18 @@ socket.on('new_message', (data) => {
     }
 
     // Update recent chats list
-    loadUserChats();
+    noteVersion(data);
+    const chat = userChats.find(c => c.id === data.chat_id);
+    if (data.chat_id === activeChat && document.visibilityState === 'visible') {
+        markRead(data.chat_id, data.message.id);
+    } else if (chat && chat.type !== 'direct' && data.message.username !== currentUser) {
+        // The server pushes unread_update for direct chats; public chats are counted here
+        chat.unread_count = (chat.unread_count || 0) + 1;
+    }
+    if (chat) {
+        chat.last_message = data.message;
+        renderRecentChats();
+    }
 
     // Show browser notification for messages not in current chat
     if (data.chat_id !== activeChat && data.message.username !== currentUser) {
@@ -432,6 +507,17 @@ socket.on('new_message', (data) => {
     }
 });
 
+// An attachment finished processing
+socket.on('message_updated', (data) => {
+    if (data.chat_id !== activeChat || !data.attachment) {
+        return;
+    }
+    const element = document.querySelector(`[data-message-id="${data.message_id}"] [data-attachment-id="${data.attachment.id}"]`);
+    if (element) {
+        element.outerHTML = renderAttachment(data.attachment);
+    }
+});
+
 // Handle mention notifications
 socket.on('mention_notification', (data) => {
     console.log('📢 MENTION NOTIFICATION:', data);
@@ -533,14 +619,151 @@ function showNotification(message) {
 }
 
 socket.on('user_status', (data) => {
-    // Update user online status
-    const user = users.find(u => u.username === data.username);
-    if (user) {
-        user.online = data.online;
+    // Coalesced batch of online/offline transitions
+    noteVersion(data);
+    data.statuses.forEach(status => {
+        const user = users.find(u => u.username === status.username);
+        if (user) {
+            applyUser(Object.assign({}, user, { online: status.online }));
+        }
+    });
+});
+
+socket.on('user_update', (data) => {
+    // A user signed up, edited their profile or was deleted
+    noteVersion(data);
+    if (data.user) {
+        applyUser(data.user);
+    } else {
+        users = users.filter(u => u.username !== data.username);
         renderUserList();
     }
 });
 
+socket.on('chat_update', (data) => {
+    // A chat was created or its list entry changed
+    noteVersion(data);
+    if (data.chat) {
+        applyChat(data.chat);
+        renderRecentChats();
+    }
+});
+
+socket.on('unread_update', (data) => {
+    // New unread counts for some chats: a message arrived, or this user read them in another tab
+    Object.entries(data.counts).forEach(([chatId, count]) => {
+        const chat = userChats.find(c => c.id === chatId);
+        if (chat) {
+            chat.unread_count = chatId === activeChat && document.visibilityState === 'visible' ? 0 : count;
+        }
+    });
+    renderRecentChats();
+});
+
+socket.on('read_receipt', (data) => {
+    if (data.chat_id === activeChat && data.username !== currentUser && data.message_id) {
+        showReadReceipt(data.message_id);
+    }
+});
+
+// --- Read state ---
+// Reads are collected for a moment and sent as one mark_read batch
+function markRead(chatId, messageId) {
+    if (!chatId) return;
+    pendingReads[chatId] = messageId;
+    const chat = userChats.find(c => c.id === chatId);
+    if (chat && chat.unread_count) {
+        chat.unread_count = 0;
+        renderRecentChats();
+    }
+    if (!markReadTimer) {
+        markReadTimer = setTimeout(() => {
+            socket.emit('mark_read', { reads: pendingReads });
+            pendingReads = {};
+            markReadTimer = null;
+        }, 500);
+    }
+}
+
+// "Seen" under the last message the other participant has read
+function showReadReceipt(messageId) {
+    document.querySelectorAll('.read-receipt').forEach(el => el.remove());
+    const message = document.querySelector(`[data-message-id="${messageId}"] .message-content`);
+    if (message) {
+        message.insertAdjacentHTML('beforeend', '<div class="read-receipt">Seen</div>');
+    }
+}
+
+document.addEventListener('visibilitychange', () => {
+    // Coming back to the tab reads what arrived in the open chat meanwhile
+    if (document.visibilityState === 'visible' && activeChat) {
+        const chat = userChats.find(c => c.id === activeChat);
+        if (chat && chat.unread_count) {
+            markRead(activeChat, null);
+        }
+    }
+});
+
+// --- Live updates ---
+function noteVersion(data) {
+    if (data && data.version && (syncVersion === null || data.version > syncVersion)) {
+        syncVersion = data.version;
+    }
+}
+
+function applyUser(user) {
+    const index = users.findIndex(u => u.username === user.username);
+    if (index >= 0) {
+        users[index] = user;
+    } else {
+        users.push(user);
+    }
+    renderUserList();
+
+    // Keep the DM entries that show this user in step
+    const dms = userChats.filter(c => c.type === 'direct' && c.other_user.username === user.username);
+    dms.forEach(c => {
+        c.other_user = { username: user.username, display_name: user.display_name, avatar: user.avatar, online: user.online };
+    });
+    if (dms.length) {
+        renderRecentChats();
+    }
+}
+
+function applyChat(chat) {
+    const index = userChats.findIndex(c => c.id === chat.id);
+    if (index >= 0) {
+        userChats[index] = chat;
+    } else {
+        userChats.push(chat);
+    }
+}
+
+// Fetch what changed since syncVersion, or reload both lists if the server no longer has it
+async function syncChanges() {
+    try {
+        const response = await fetch(`/api/sync?since=${syncVersion}`);
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        if (data.reset) {
+            syncVersion = data.version;
+            await fetchUsers();
+            await loadUserChats();
+            return;
+        }
+        users = users.filter(u => !data.removed_users.includes(u.username));
+        data.users.forEach(applyUser);
+        data.chats.forEach(applyChat);
+        noteVersion(data);
+        renderUserList();
+        renderRecentChats();
+    } catch (error) {
+        console.error('Error syncing changes:', error);
+    }
+}
+
 socket.on('user_typing', (data) => {
     if (data.chat_id === activeChat) {
         typingUsers.add(data.username);
@@ -661,7 +884,7 @@ function showMentionDropdown(query, input) {
     mentionDropdown.innerHTML = filteredUsers.map(user => `
         <div class="mention-item" data-username="${user.username}">
             <div class="mention-avatar">
-                ${user.avatar ? `<img src="/photos/${user.avatar}" alt="Avatar">` : '<i class="fas fa-user-circle"></i>'}
+                ${user.avatar ? `<img src="/photos/${user.avatar}?s=64" alt="Avatar">` : '<i class="fas fa-user-circle"></i>'}
             </div>
             <div class="mention-info">
                 <div class="mention-name">${user.display_name}</div>
@@ -808,7 +1031,7 @@ function addToRecentChats(username, displayName, avatar, isOnline) {
 
     chatItem.innerHTML = `
         <span class="profile-thumb" style="background: #eee;">
-            ${avatar ? `<img src="/photos/${avatar}" alt="Avatar" class="profile-thumb-img">` : displayName[0].toUpperCase()}
+            ${avatar ? `<img src="/photos/${avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : displayName[0].toUpperCase()}
         </span>
         <span class="user-info">
             <b>${displayName}</b><br>
@@ -861,7 +1084,7 @@ function renderRecentChats() {
         return `
             <li class="user-row recent-chat" onclick="openDirectMessage('${otherUser.username}', '${otherUser.display_name}', '${otherUser.avatar || ''}', ${otherUser.online})">
                 <span class="profile-thumb" style="background: #eee;">
-                    ${otherUser.avatar ? `<img src="/photos/${otherUser.avatar}" alt="Avatar" class="profile-thumb-img">` : otherUser.display_name[0].toUpperCase()}
+                    ${otherUser.avatar ? `<img src="/photos/${otherUser.avatar}?s=64" alt="Avatar" class="profile-thumb-img">` : otherUser.display_name[0].toUpperCase()}
                 </span>
                 <div class="user-info">
                     <b>${otherUser.display_name}</b>
@@ -928,15 +1151,20 @@ async function initializeApp() {
     // Request notification permission
     requestNotificationPermission();
 
+    // Note the version before loading so deltas from here on are not missed
+    try {
+        const response = await fetch('/api/sync');
+        syncVersion = (await response.json()).version;
+    } catch (error) {
+        console.error('Error reading sync version:', error);
+    }
     await fetchUsers();
     await loadUserChats();
 
     // Set up mention autocomplete
     setupMentionAutocomplete();
 
-    // Set up periodic updates
-    setInterval(fetchUsers, 10000); // Update users every 10 seconds
-    setInterval(loadUserChats, 30000); // Update chats every 30 seconds
+    // Users and chats stay current through Socket.IO deltas (see Live updates)
 
     console.log('✅ Connectra app initialized successfully');
 }
@@ -0,0 +1,1195 @@
+"""
+Storage engines for Connectra.
+
+Two backends share one interface:
+
+``DocumentStore`` (the default, ``CONNECTRA_STORAGE=json``) keeps the whole
+database in memory. Every mutation is appended as one small JSON record to a
+write-ahead log that lives next to the snapshot (``userbase.json.wal``), so a
+like or a chat message costs the size of the change instead of a full
+re-serialization of userbase.json. Once the log grows past ``compact_every``
+records it is folded back into the snapshot.
+
+``SQLiteStore`` (``CONNECTRA_STORAGE=sqlite``) keeps users, chats, messages,
+clips, comments and blogs in normalized tables with indexes on the fields the
+routes look things up by. Run ``python storage.py migrate`` once to import the
+existing JSON files.
+
+Both also keep a short change feed: ``record_change`` stamps a small dict with
+a version that is monotonic across workers, and ``changes_since`` returns the
+records after a version so reconnecting clients can catch up on deltas. The
+feed is bounded; a version older than what is retained yields ``None`` and the
+client has to reload in full.
+
+Given a ``metrics.Metrics`` (``metrics=``), both backends time how long they
+spend reading, parsing and serializing data and count the bytes involved:
+snapshot and log reads and writes for ``DocumentStore``, document rows and
+full loads for ``SQLiteStore``.
+
+Given an ``offload.Offload`` (``offload=``), the calls that can hold an
+eventlet worker's only OS thread for long run on native threads instead:
+snapshot reads and writes, fsyncs, large log reads and waits for another
+worker's file lock in ``DocumentStore``; in ``SQLiteStore``, full loads,
+waits for another worker's write lock, commits and WAL checkpoints.
+
+Clips are also kept in ``created_at`` order (a sorted key list in memory, an
+index in SQLite) so ``clips_page`` pages through the newest clips without
+sorting the collection. Chat messages and clip comments are paged with
+``messages`` and ``comments``; a comment is found by id in O(1).
+
+Users are found by email or username case-insensitively through in-memory
+maps (expression indexes in SQLite) kept in step with every write, and
+``unique_username`` picks a free username for a new account with a per-base
+suffix counter instead of rescanning the users once per candidate.
+
+Mutations are addressed with paths such as ``('clips', clip_id, 'views')``.
+A path segment that lands on a list selects the element whose key field
+matches it: ``username`` for users, ``id`` for everything else. Every
+mutation returns the new value at its path.
+"""
+
+import base64
+import bisect
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-worker deployments only
+    fcntl = None
+
+# Key field used to address list elements, per top-level collection
+COLLECTION_KEYS = {'users': 'username'}
+DEFAULT_KEY = 'id'
+COLLECTIONS = ('users', 'chats', 'clips', 'blogs')
+
+# Nested lists that the SQLite backend keeps in their own tables
+CHILD_LISTS = {'chats': 'messages', 'clips': 'comments'}
+
+# Top-level key in the snapshot that records the last folded log record
+SEQ_KEY = '_wal_seq'
+
+# Change-feed records kept for changes_since(); older versions force a full reload
+CHANGE_RETENTION = 10000
+
+# Log reads at least this large go through the offload pool (smaller ones cost less than the hand-off)
+OFFLOAD_READ_BYTES = 256 * 1024
+
+# How long SQLiteStore waits for another worker's write lock (the connections' busy timeout)
+BUSY_TIMEOUT = 30
+
+
+class StorageError(Exception):
+    """Raised when a path cannot be resolved against the database"""
+
+
+def key_field(collection):
+    return COLLECTION_KEYS.get(collection, DEFAULT_KEY)
+
+
+def encode_cursor(item, field='timestamp'):
+    """Opaque, URL-safe page cursor pointing at ``item`` (its sort field + id)"""
+    raw = json.dumps([item.get(field), item.get('id')], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(timestamp, message_id)`` or ``(None, None)`` for a bad cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, message_id = json.loads(raw)
+        return timestamp, message_id
+    except (ValueError, TypeError):
+        return None, None
+
+
+def clip_order_key(clip):
+    return clip.get('created_at') or '', clip['id']
+
+
+def shallow_copy(item, child_list):
+    return {k: v for k, v in item.items() if k != child_list}
+
+
+def next_username(base, taken, suffixes):
+    """``base`` if ``taken(name)`` is false for it, else ``base1``, ``base2``, ...
+
+    ``suffixes`` remembers the last suffix handed out per case-folded base, so
+    the thousandth "john" starts probing at john999 instead of re-testing every
+    suffix before it. A worker's counter can lag behind names other workers
+    took; those are simply probed and skipped.
+    """
+    folded = base.lower()
+    suffix = suffixes.get(folded, 0)
+    username = f"{base}{suffix}" if suffix else base
+    while taken(username):
+        suffix += 1
+        username = f"{base}{suffix}"
+    suffixes[folded] = suffix
+    return username
+
+
+def define_metrics(metrics):
+    """Declare the storage series on a ``metrics.Metrics`` (both backends take ``metrics=None``)"""
+    if metrics:
+        metrics.histogram('connectra_storage_seconds', 'Time spent reading, parsing and serializing stored data, by operation')
+        metrics.counter('connectra_storage_bytes_total', 'Bytes of stored data read or written, by operation')
+    return metrics
+
+
+def measure(metrics, backend, op, started, nbytes):
+    if metrics:
+        metrics.observe('connectra_storage_seconds', time.perf_counter() - started, backend=backend, op=op)
+        metrics.inc('connectra_storage_bytes_total', nbytes, backend=backend, op=op)
+
+
+def blocking(offload, fn, *args):
+    """``fn(*args)`` through ``offload`` (an ``offload.Offload``) when there is one, else inline"""
+    return offload.run(fn, *args) if offload else fn(*args)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_range(path, size, offset):
+    with open(path, 'rb') as f:
+        return os.pread(f.fileno(), size, offset)
+
+
+def write_text_atomic(path, text):
+    """Write ``text`` to a temp file, fsync it and rename it over ``path``"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def resolve(node, path):
+    """Walk ``path`` from ``node``; list segments match an item's ``id``"""
+    for segment in path:
+        if isinstance(node, dict):
+            if segment not in node:
+                raise StorageError(f"Missing key {segment!r} in {path!r}")
+            node = node[segment]
+        elif isinstance(node, list):
+            node = next((item for item in node if item.get(DEFAULT_KEY) == segment), None)
+            if node is None:
+                raise StorageError(f"No item {segment!r} in {path!r}")
+        else:
+            raise StorageError(f"Cannot descend into {path!r}")
+    return node
+
+
+def apply_op(parent, key, op, value):
+    """Apply one mutation to ``parent[key]`` and return the new value"""
+    if op == 'set':
+        parent[key] = value
+    elif op == 'append':
+        parent.setdefault(key, []).append(value)
+    elif op == 'remove':
+        items = parent.setdefault(key, [])
+        if value in items:
+            items.remove(value)
+    elif op == 'incr':
+        parent[key] = parent.get(key, 0) + value
+    else:
+        raise StorageError(f"Unknown operation {op!r}")
+    return parent[key]
+
+
+class DocumentStore:
+    """In-memory document store backed by a snapshot and a write-ahead log
+
+    Several processes (gunicorn workers) may share one store. Writers take an
+    exclusive ``flock`` on ``<snapshot>.lock``, catch up on records other
+    workers appended, then append their own; readers catch up the same way
+    before answering. Compaction replaces both files atomically, and a worker
+    that finds a new log whose base is ahead of it reloads the snapshot.
+    """
+
+    def __init__(self, snapshot_path, wal_path=None, compact_every=1000, fsync=False, metrics=None, offload=None):
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path or f"{snapshot_path}.wal"
+        self.lock_path = f"{snapshot_path}.lock"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.metrics = define_metrics(metrics)
+        self.offload = offload
+        self._lock = None
+        self._lock_pid = None
+        self.data = {}
+        self.seq = 0
+        self._indexes = {}
+        self._emails = {}
+        self._usernames = {}
+        self._username_suffixes = {}
+        self._comments = {}
+        self._comment_pos = {}
+        self._message_pos = {}
+        self._clip_order = []
+        # The change feed lives in the log only: it is not part of the snapshot
+        self._changes = deque()
+        self._changes_floor = 0
+        self._wal = None
+        self._wal_ino = None
+        self._wal_offset = 0
+        self._wal_records = 0
+        self._lock_file = None
+        self._lock_depth = 0
+        self._pid = os.getpid()
+        self.open()
+
+    @property
+    def lock(self):
+        # Made again in every worker: one made before the fork (gunicorn preloads the app) stays a native lock
+        # after eventlet patches threading, and a greenlet parked on the offload pool while holding it would
+        # block the whole hub for the next greenlet that asks for it
+        if self._lock_pid != os.getpid():
+            self._lock_pid = os.getpid()
+            self._lock = threading.RLock()
+        return self._lock
+
+    # --- Cross-process locking ---
+    def _reopen_after_fork(self):
+        """Forked workers must not share lock or log file descriptions with the parent"""
+        self._pid = os.getpid()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._wal = open(self.wal_path, 'a', encoding='utf-8')
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        if self._pid != os.getpid():
+            self._reopen_after_fork()
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        if fcntl:
+            mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(self._lock_file.fileno(), mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker holds it, maybe for a whole compaction: wait off the hub
+                blocking(self.offload, fcntl.flock, self._lock_file.fileno(), mode)
+        self._lock_depth = 1
+        try:
+            yield
+        finally:
+            self._lock_depth = 0
+            if fcntl:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def transaction(self):
+        """Hold the write lock so a read-check-write sequence cannot interleave with other workers"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            yield self
+
+    # --- Loading and recovery ---
+    def open(self):
+        with self.lock, self._file_lock():
+            self._load_snapshot()
+            self._replay(repair=True)
+            if self._wal:
+                self._wal.close()
+            self._wal = open(self.wal_path, 'a', encoding='utf-8')
+
+    def _load_snapshot(self):
+        if os.path.exists(self.snapshot_path):
+            started = time.perf_counter()
+            raw = blocking(self.offload, read_file, self.snapshot_path)
+            self.data = json.loads(raw)
+            measure(self.metrics, 'json', 'snapshot_read', started, len(raw))
+        else:
+            self.data = {}
+        self.seq = self.data.pop(SEQ_KEY, 0)
+        for collection in COLLECTIONS:
+            self.data.setdefault(collection, [])
+        self._reindex()
+        self._changes.clear()
+        self._changes_floor = self.seq
+        self._wal_ino = None
+        self._wal_offset = 0
+        self._wal_records = 0
+
+    def _replay(self, repair=False):
+        """Apply every complete log record we have not seen yet"""
+        try:
+            stat = os.stat(self.wal_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._wal_ino:
+            # The log was compacted (or this is the first read): start from its top
+            # and make sure our own appends go to the new file, not the replaced one
+            self._wal_ino = stat.st_ino
+            self._wal_offset = 0
+            self._wal_records = 0
+            if self._wal and not self._wal.closed:
+                self._wal.close()
+                self._wal = open(self.wal_path, 'a', encoding='utf-8')
+        if stat.st_size <= self._wal_offset:
+            return
+        started = time.perf_counter()
+        size = stat.st_size - self._wal_offset
+        chunk = blocking(self.offload if size >= OFFLOAD_READ_BYTES else None, read_range, self.wal_path, size, self._wal_offset)
+        good_bytes = 0
+        for line in chunk.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good_bytes += len(line)
+            if 'base' in record:
+                if record['base'] > self.seq:
+                    # Another worker folded records we never saw into the snapshot
+                    self._load_snapshot()
+                    return self._replay(repair)
+                continue
+            self._wal_records += 1
+            if record['seq'] <= self.seq:
+                continue
+            self._apply(record['op'], record['path'], record.get('value'))
+            self.seq = record['seq']
+        self._wal_offset += good_bytes
+        measure(self.metrics, 'json', 'wal_read', started, good_bytes)
+        # Drop a torn tail left by a crash mid-write
+        if repair and self._wal_offset != stat.st_size:
+            with open(self.wal_path, 'r+b') as f:
+                f.truncate(self._wal_offset)
+
+    def _catch_up(self):
+        if self._pid != os.getpid():
+            self._reopen_after_fork()
+        self._replay()
+
+    def _reindex(self):
+        self._indexes = {}
+        self._emails = {}
+        self._usernames = {}
+        self._comments = {}
+        self._comment_pos = {}
+        self._message_pos = {}
+        for collection, items in self.data.items():
+            if isinstance(items, list):
+                field = key_field(collection)
+                self._indexes[collection] = {item[field]: item for item in items if isinstance(item, dict) and field in item}
+        for user in self.data.get('users', []):
+            self._index_email(user)
+            self._usernames[user['username'].lower()] = user
+        for clip in self.data.get('clips', []):
+            self._index_comments(clip)
+        self._clip_order = sorted(clip_order_key(clip) for clip in self.data.get('clips', []))
+        for chat in self.data.get('chats', []):
+            self._index_messages(chat)
+
+    def _index_email(self, user):
+        if user.get('email'):
+            self._emails[user['email'].lower()] = user
+
+    def _index_comments(self, clip):
+        positions = self._comment_pos[clip['id']] = {}
+        for i, comment in enumerate(clip.get('comments', [])):
+            self._comments[comment['id']] = clip['id']
+            positions[comment['id']] = i
+
+    def _index_messages(self, chat):
+        self._message_pos[chat['id']] = {m.get('id'): i for i, m in enumerate(chat.get('messages', []))}
+
+    # --- Reads ---
+    def _fresh(self):
+        """Catch up on other workers' writes before a read"""
+        with self.lock:
+            if self._lock_depth:
+                self._catch_up()
+                return
+            with self._file_lock(exclusive=False):
+                self._catch_up()
+
+    def load(self):
+        """Return the live database dict. Mutate it only through the store."""
+        self._fresh()
+        return self.data
+
+    def get(self, collection, key, shallow=False):
+        """O(1) lookup of a top-level item by its key field; ``shallow`` leaves out its messages or comments"""
+        self._fresh()
+        item = self._indexes.get(collection, {}).get(key)
+        if shallow and item is not None and collection in CHILD_LISTS:
+            return shallow_copy(item, CHILD_LISTS[collection])
+        return item
+
+    def find_user_by_email(self, email):
+        self._fresh()
+        return self._emails.get((email or '').lower())
+
+    def find_users(self, usernames):
+        """Case-insensitive lookup of several usernames: ``{lowercased username: user}`` for those that exist"""
+        self._fresh()
+        found = {}
+        for name in usernames:
+            user = self._usernames.get(name.lower())
+            if user is not None:
+                found[name.lower()] = user
+        return found
+
+    def unique_username(self, base):
+        """A username no user has yet, derived from ``base``; call it inside ``transaction()``"""
+        self._fresh()
+        return next_username(base, lambda name: name.lower() in self._usernames, self._username_suffixes)
+
+    def find_comment(self, comment_id):
+        """Return ``(clip_id, comment)`` for a clip comment, or ``(None, None)``"""
+        self._fresh()
+        clip_id = self._comments.get(comment_id)
+        clip = self._indexes.get('clips', {}).get(clip_id)
+        position = self._comment_pos.get(clip_id, {}).get(comment_id)
+        if not clip or position is None:
+            return None, None
+        return clip_id, clip['comments'][position]
+
+    def comment_counts(self, clip_ids):
+        """``{clip_id: number of comments}`` for the clips that exist"""
+        self._fresh()
+        clips = self._indexes.get('clips', {})
+        return {clip_id: len(clips[clip_id].get('comments', [])) for clip_id in clip_ids if clip_id in clips}
+
+    def version(self):
+        """Current change-feed version"""
+        self._fresh()
+        return self.seq
+
+    def changes_since(self, since):
+        """Return ``(changes, version)``; ``changes`` is None when ``since`` is no longer retained"""
+        self._fresh()
+        if since < self._changes_floor or since > self.seq:
+            return None, self.seq
+        return [c for c in self._changes if c['version'] > since], self.seq
+
+    def chats(self):
+        """Every chat without its messages; ``message_count`` says how many it has"""
+        self._fresh()
+        return [dict(shallow_copy(chat, 'messages'), message_count=len(chat.get('messages', []))) for chat in self.data['chats']]
+
+    def blogs(self):
+        """Every blog post"""
+        self._fresh()
+        return [dict(blog) for blog in self.data.get('blogs', [])]
+
+    def clips(self):
+        """Every clip without its comments; ``comment_count`` says how many it has"""
+        self._fresh()
+        return [dict(shallow_copy(clip, 'comments'), comment_count=len(clip.get('comments', []))) for clip in self.data.get('clips', [])]
+
+    def clips_page(self, before=None, limit=20):
+        """Newest clips first, starting just after the ``before`` cursor: ``(clips, next_cursor)``.
+
+        Clips come without their comments, with ``comment_count``. Costs O(log n + limit):
+        the cursor is bisected into the ``created_at`` order.
+        """
+        self._fresh()
+        end = len(self._clip_order)
+        if before:
+            created_at, clip_id = decode_cursor(before)
+            if clip_id is None:
+                return [], None
+            end = bisect.bisect_left(self._clip_order, (created_at or '', clip_id))
+        start = max(0, end - limit)
+        clips = self._indexes['clips']
+        page = [dict(shallow_copy(clips[clip_id], 'comments'), comment_count=len(clips[clip_id].get('comments', [])))
+                for _, clip_id in reversed(self._clip_order[start:end])]
+        return page, (encode_cursor(page[-1], 'created_at') if start > 0 else None)
+
+    def messages(self, chat_id, before=None, limit=50):
+        """One page of a chat, oldest first, ending just before the ``before`` cursor.
+
+        Returns ``(messages, next_cursor)``; ``next_cursor`` is None on the first page of history.
+        Costs O(limit): the cursor's message id is looked up in a per-chat position index.
+        """
+        return self._child_page('chats', chat_id, 'messages', self._message_pos, 'timestamp', before, limit)
+
+    def comments(self, clip_id, before=None, limit=20):
+        """One page of a clip's comments, oldest first, ending just before the ``before`` cursor"""
+        return self._child_page('clips', clip_id, 'comments', self._comment_pos, 'created_at', before, limit)
+
+    def _child_page(self, collection, key, child_list, positions, field, before, limit):
+        self._fresh()
+        item = self._indexes.get(collection, {}).get(key)
+        if not item:
+            return [], None
+        children = item.get(child_list, [])
+        end = len(children)
+        if before:
+            _, child_id = decode_cursor(before)
+            end = positions.get(key, {}).get(child_id)
+            if end is None:
+                return [], None
+        start = max(0, end - limit)
+        page = children[start:end]
+        return page, (encode_cursor(page[0], field) if start > 0 else None)
+
+    # --- Writes ---
+    def insert(self, collection, item):
+        return self._commit('insert', [collection], item)
+
+    def delete(self, collection, key):
+        return self._commit('delete', [collection], key)
+
+    def set(self, path, value):
+        return self._commit('set', list(path), value)
+
+    def append(self, path, value):
+        return self._commit('append', list(path), value)
+
+    def remove(self, path, value):
+        return self._commit('remove', list(path), value)
+
+    def incr(self, path, amount=1):
+        return self._commit('incr', list(path), amount)
+
+    def record_change(self, change):
+        """Append ``change`` to the change feed and return its version"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            change = dict(change, version=self.seq + 1)
+            self._commit('change', ['_changes'], change)
+            return change['version']
+
+    def replace(self, data):
+        """Swap in a whole new database and snapshot it immediately"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            self.data = data
+            self._reindex()
+            self.seq += 1
+            self._changes.clear()
+            self._changes_floor = self.seq
+            self.compact()
+
+    def _commit(self, op, path, value):
+        with self.lock, self._file_lock():
+            self._catch_up()
+            result = self._apply(op, path, value)
+            self.seq += 1
+            started = time.perf_counter()
+            record = {'seq': self.seq, 'op': op, 'path': path, 'value': value}
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+            self._wal.write(line)
+            self._wal.flush()
+            if self.fsync:
+                blocking(self.offload, os.fsync, self._wal.fileno())
+            written = len(line.encode('utf-8'))
+            self._wal_offset += written
+            self._wal_records += 1
+            measure(self.metrics, 'json', 'wal_write', started, written)
+            if self.compact_every and self._wal_records >= self.compact_every:
+                self.compact()
+            return result
+
+    def compact(self):
+        """Fold the log into a fresh snapshot and start a new log, both swapped in atomically"""
+        with self.lock, self._file_lock():
+            self._catch_up()
+            snapshot = dict(self.data)
+            snapshot[SEQ_KEY] = self.seq
+            started = time.perf_counter()
+            # Serialized here, where nothing can change the data halfway through (load() and get() hand out
+            # live objects); compact, so json uses its C encoder. Only the write and fsync leave the hub.
+            text = json.dumps(snapshot, ensure_ascii=False)
+            blocking(self.offload, write_text_atomic, self.snapshot_path, text)
+            measure(self.metrics, 'json', 'snapshot_write', started, os.path.getsize(self.snapshot_path))
+            tmp_path = f"{self.wal_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'base': self.seq}) + '\n')
+            os.replace(tmp_path, self.wal_path)
+            self._wal.close()
+            self._wal = open(self.wal_path, 'a', encoding='utf-8')
+            stat = os.fstat(self._wal.fileno())
+            self._wal_ino = stat.st_ino
+            self._wal_offset = stat.st_size
+            self._wal_records = 0
+
+    def close(self):
+        with self.lock:
+            if self._wal and not self._wal.closed:
+                self.compact()
+                self._wal.close()
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _apply(self, op, path, value):
+        collection = path[0]
+        if op == 'change':
+            if len(self._changes) >= CHANGE_RETENTION:
+                self._changes_floor = self._changes.popleft()['version']
+            self._changes.append(value)
+            return value
+        if op == 'insert':
+            self.data.setdefault(collection, []).append(value)
+            self._indexes.setdefault(collection, {})[value[key_field(collection)]] = value
+            if collection == 'users':
+                self._index_email(value)
+                self._usernames[value['username'].lower()] = value
+            elif collection == 'clips':
+                self._index_comments(value)
+                bisect.insort(self._clip_order, clip_order_key(value))
+            elif collection == 'chats':
+                self._index_messages(value)
+            return value
+        if op == 'delete':
+            item = self._indexes.get(collection, {}).pop(value, None)
+            if item is not None:
+                self.data[collection] = [i for i in self.data[collection] if i is not item]
+                if collection == 'users':
+                    if item.get('email'):
+                        self._emails.pop(item['email'].lower(), None)
+                    if self._usernames.get(value.lower()) is item:
+                        del self._usernames[value.lower()]
+                elif collection == 'clips':
+                    for comment in item.get('comments', []):
+                        self._comments.pop(comment['id'], None)
+                    self._comment_pos.pop(value, None)
+                    position = bisect.bisect_left(self._clip_order, clip_order_key(item))
+                    if position < len(self._clip_order) and self._clip_order[position][1] == value:
+                        del self._clip_order[position]
+                elif collection == 'chats':
+                    self._message_pos.pop(value, None)
+            return item
+
+        if len(path) < 3:
+            raise StorageError(f"Path {path!r} is too short for {op!r}")
+        item = self._indexes.get(collection, {}).get(path[1])
+        if item is None:
+            raise StorageError(f"No item {path[1]!r} in {collection!r}")
+        position = None
+        if collection == 'chats' and len(path) > 4 and path[2] == 'messages':
+            position = self._message_pos.get(item['id'], {}).get(path[3])
+        elif collection == 'clips' and len(path) > 4 and path[2] == 'comments':
+            position = self._comment_pos.get(item['id'], {}).get(path[3])
+        if position is not None:
+            # Jump straight to the message or comment instead of scanning the list
+            parent = resolve(item[path[2]][position], path[4:-1])
+        else:
+            parent = resolve(item, path[2:-1])
+        if collection == 'users' and path[2:] == ['email'] and item.get('email'):
+            self._emails.pop(item['email'].lower(), None)
+        result = apply_op(parent, path[-1], op, value)
+        if collection == 'users' and path[2:] == ['email']:
+            self._index_email(item)
+        elif collection == 'clips' and path[2:] == ['comments'] and op == 'append':
+            self._comments[value['id']] = item['id']
+            self._comment_pos.setdefault(item['id'], {})[value['id']] = len(result) - 1
+        elif collection == 'chats' and path[2:] == ['messages'] and op == 'append':
+            self._message_pos.setdefault(item['id'], {})[value.get('id')] = len(result) - 1
+        return result
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (lower(email));
+CREATE INDEX IF NOT EXISTS users_username_ci ON users (lower(username));
+
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_participants (
+    chat_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (chat_id, username)
+);
+CREATE INDEX IF NOT EXISTS chat_participants_username ON chat_participants (username);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    timestamp TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_chat_timestamp ON messages (chat_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS clips (
+    id TEXT PRIMARY KEY,
+    author TEXT,
+    created_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clips_created_at ON clips (created_at);
+CREATE INDEX IF NOT EXISTS clips_feed ON clips (created_at, id);
+
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    clip_id TEXT NOT NULL,
+    created_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_clip ON comments (clip_id, created_at);
+
+CREATE TABLE IF NOT EXISTS blogs (
+    id TEXT PRIMARY KEY,
+    created_at TEXT,
+    doc TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc TEXT NOT NULL
+);
+"""
+
+# Indexed columns stored next to each row's JSON document
+COLUMNS = {
+    'users': ('username', 'email'),
+    'chats': ('id', 'type'),
+    'clips': ('id', 'author', 'created_at'),
+    'blogs': ('id', 'created_at'),
+    'messages': ('id', 'chat_id', 'timestamp'),
+    'comments': ('id', 'clip_id', 'created_at'),
+}
+PARENT_COLUMN = {'messages': 'chat_id', 'comments': 'clip_id'}
+
+
+class SQLiteStore:
+    """SQLite backend with normalized tables and lookup indexes"""
+
+    def __init__(self, db_path, metrics=None, offload=None):
+        self.db_path = db_path
+        self.metrics = define_metrics(metrics)
+        self.offload = offload
+        self._lock = None
+        self._lock_pid = None
+        self._username_suffixes = {}
+        self._connect()
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def lock(self):
+        # Per worker, like DocumentStore.lock
+        if self._lock_pid != os.getpid():
+            self._lock_pid = os.getpid()
+            self._lock = threading.RLock()
+        return self._lock
+
+    def _connect(self):
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    @property
+    def conn(self):
+        # Connections must not cross fork(); each gunicorn worker opens its own
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE takes SQLite's write lock, so a read-check-write sequence is atomic across workers"""
+        with self.lock:
+            conn = self.conn
+            if conn.in_transaction:
+                yield self
+                return
+            # Waiting for another worker's write lock and committing (which may checkpoint the WAL into the
+            # database file) both block; this worker's other requests wait on self.lock, not on the OS thread
+            blocking(self.offload, conn.execute, 'BEGIN IMMEDIATE')
+            try:
+                yield self
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            blocking(self.offload, conn.execute, 'COMMIT')
+
+    @contextmanager
+    def _snapshot(self):
+        """Deferred BEGIN: the reads inside see one snapshot and take no lock that writers wait on"""
+        with self.lock:
+            conn = self.conn
+            if conn.in_transaction:
+                yield self
+                return
+            conn.execute('BEGIN')
+            try:
+                yield self
+            finally:
+                conn.execute('COMMIT')
+
+    # --- Row helpers ---
+    def _write_row(self, table, doc, parent_id=None):
+        doc = dict(doc)
+        if table in CHILD_LISTS.values():
+            doc_values = dict(doc, **{PARENT_COLUMN[table]: parent_id})
+        else:
+            doc_values = doc
+            doc.pop(CHILD_LISTS.get(table), None)
+        columns = COLUMNS[table]
+        values = [doc_values.get(column) for column in columns]
+        started = time.perf_counter()
+        encoded = json.dumps(doc, ensure_ascii=False)
+        # An upsert, not INSERT OR REPLACE: a replaced row gets a new rowid and would move to the end of load()
+        self.conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}, doc) VALUES ({', '.join('?' * (len(columns) + 1))}) "
+            f"ON CONFLICT ({key_field(table)}) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in (*columns, 'doc'))}",
+            values + [encoded]
+        )
+        measure(self.metrics, 'sqlite', 'row_write', started, len(encoded))
+
+    def _read_doc(self, table, key):
+        field = key_field(table)
+        started = time.perf_counter()
+        row = self.conn.execute(f"SELECT doc FROM {table} WHERE {field} = ?", (key,)).fetchone()
+        if not row:
+            return None
+        doc = json.loads(row[0])
+        measure(self.metrics, 'sqlite', 'row_read', started, len(row[0]))
+        return doc
+
+    def _insert(self, collection, item):
+        self._write_row(collection, item)
+        child_list = CHILD_LISTS.get(collection)
+        if child_list:
+            for child in item.get(child_list, []):
+                self._write_row(child_list, child, item['id'])
+        if collection == 'chats':
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO chat_participants (chat_id, username) VALUES (?, ?)",
+                [(item['id'], p) for p in item.get('participants', [])]
+            )
+
+    # --- Reads ---
+    def load(self):
+        """Materialize the whole database as a dict (a copy, not a live view)"""
+        with self.lock:
+            started = time.perf_counter()
+            data, nbytes = blocking(self.offload, self._read_all, self.conn)
+            measure(self.metrics, 'sqlite', 'load', started, nbytes)
+            return data
+
+    @staticmethod
+    def _read_all(conn):
+        """Every row as ``(data, bytes read)``; touches nothing but ``conn``, so it can run on a pool thread"""
+        nbytes = 0
+        data = {}
+        for collection in COLLECTIONS:
+            rows = conn.execute(f"SELECT doc FROM {collection} ORDER BY rowid").fetchall()
+            nbytes += sum(len(row[0]) for row in rows)
+            data[collection] = [json.loads(row[0]) for row in rows]
+        for collection, child_list in CHILD_LISTS.items():
+            by_parent = {item['id']: item for item in data[collection]}
+            for item in by_parent.values():
+                item[child_list] = []
+            parent_column = PARENT_COLUMN[child_list]
+            rows = conn.execute(f"SELECT {parent_column}, doc FROM {child_list} ORDER BY rowid")
+            for parent_id, doc in rows:
+                nbytes += len(doc)
+                if parent_id in by_parent:
+                    by_parent[parent_id][child_list].append(json.loads(doc))
+        return data, nbytes
+
+    def get(self, collection, key, shallow=False):
+        with self.lock:
+            child_list = CHILD_LISTS.get(collection)
+            if not child_list or shallow:
+                return self._read_doc(collection, key)
+            order = 'timestamp' if child_list == 'messages' else 'created_at'
+            parent_column = PARENT_COLUMN[child_list]
+            # One statement: the row plus its children gathered through the (parent, time) index
+            row = self.conn.execute(
+                f"SELECT p.doc, (SELECT json_group_array(json(c.doc)) FROM "
+                f"(SELECT doc FROM {child_list} WHERE {parent_column} = p.id ORDER BY {order}, rowid) c) "
+                f"FROM {collection} p WHERE p.id = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            item = json.loads(row[0])
+            item[child_list] = json.loads(row[1]) if row[1] else []
+            return item
+
+    def find_user_by_email(self, email):
+        with self.lock:
+            row = self.conn.execute("SELECT doc FROM users WHERE lower(email) = lower(?)", (email or '',)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def find_users(self, usernames):
+        """Case-insensitive lookup of several usernames: ``{lowercased username: user}`` for those that exist"""
+        names = list({name.lower() for name in usernames})
+        found = {}
+        with self.lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT doc FROM users WHERE lower(username) IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                for (doc,) in rows:
+                    user = json.loads(doc)
+                    found[user['username'].lower()] = user
+        return found
+
+    def unique_username(self, base):
+        """A username no user has yet, derived from ``base``; call it inside ``transaction()``"""
+        def taken(name):
+            return self.conn.execute("SELECT 1 FROM users WHERE lower(username) = lower(?)", (name,)).fetchone() is not None
+        with self.lock:
+            return next_username(base, taken, self._username_suffixes)
+
+    def find_comment(self, comment_id):
+        """Return ``(clip_id, comment)`` for a clip comment, or ``(None, None)``"""
+        with self.lock:
+            row = self.conn.execute("SELECT clip_id, doc FROM comments WHERE id = ?", (comment_id,)).fetchone()
+            return (row[0], json.loads(row[1])) if row else (None, None)
+
+    def version(self):
+        """Current change-feed version"""
+        with self.lock:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+            return row[0] if row else 0
+
+    def changes_since(self, since):
+        """Return ``(changes, version)``; ``changes`` is None when ``since`` is no longer retained"""
+        # One read snapshot so the rows, the floor and the version agree
+        with self._snapshot():
+            version = self.version()
+            oldest = self.conn.execute("SELECT min(version) FROM changes").fetchone()[0]
+            floor = oldest - 1 if oldest is not None else version
+            if since < floor or since > version:
+                return None, version
+            rows = self.conn.execute("SELECT doc FROM changes WHERE version > ? ORDER BY version", (since,))
+            return [json.loads(row[0]) for row in rows], version
+
+    def chats(self):
+        """Every chat without its messages; ``message_count`` says how many it has"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT doc, (SELECT count(*) FROM messages WHERE chat_id = chats.id) FROM chats ORDER BY rowid"
+            )
+            return [dict(json.loads(doc), message_count=count) for doc, count in rows]
+
+    def blogs(self):
+        """Every blog post"""
+        with self.lock:
+            return [json.loads(row[0]) for row in self.conn.execute("SELECT doc FROM blogs ORDER BY rowid")]
+
+    def clips(self):
+        """Every clip without its comments; ``comment_count`` says how many it has"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT doc, (SELECT count(*) FROM comments WHERE clip_id = clips.id) FROM clips ORDER BY rowid"
+            )
+            return [dict(json.loads(doc), comment_count=count) for doc, count in rows]
+
+    def clips_page(self, before=None, limit=20):
+        """Newest clips first, starting just after the ``before`` cursor: ``(clips, next_cursor)``.
+
+        Keyset pagination over the (created_at, id) index; clips come without their comments,
+        with ``comment_count``.
+        """
+        query = "SELECT p.doc, (SELECT count(*) FROM comments WHERE clip_id = p.id) FROM clips p "
+        with self.lock:
+            if before:
+                created_at, clip_id = decode_cursor(before)
+                if clip_id is None:
+                    return [], None
+                rows = self.conn.execute(
+                    query + "WHERE p.created_at < ? OR (p.created_at = ? AND p.id < ?) "
+                    "ORDER BY p.created_at DESC, p.id DESC LIMIT ?", (created_at, created_at, clip_id, limit + 1)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(query + "ORDER BY p.created_at DESC, p.id DESC LIMIT ?", (limit + 1,)).fetchall()
+        page = [dict(json.loads(doc), comment_count=count) for doc, count in rows[:limit]]
+        return page, (encode_cursor(page[-1], 'created_at') if len(rows) > limit else None)
+
+    def comment_counts(self, clip_ids):
+        """``{clip_id: number of comments}`` for the clips that exist"""
+        ids = list(set(clip_ids))
+        found = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, (SELECT count(*) FROM comments WHERE clip_id = clips.id) FROM clips "
+                    f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                found.update(rows)
+        return found
+
+    def messages(self, chat_id, before=None, limit=50):
+        """One page of a chat, oldest first, ending just before the ``before`` cursor.
+
+        Keyset pagination over the (chat_id, timestamp) index, so a page costs O(limit).
+        """
+        return self._child_page('messages', 'chat_id', 'timestamp', chat_id, before, limit)
+
+    def comments(self, clip_id, before=None, limit=20):
+        """One page of a clip's comments, oldest first, ending just before the ``before`` cursor"""
+        return self._child_page('comments', 'clip_id', 'created_at', clip_id, before, limit)
+
+    def _child_page(self, table, parent_column, order_column, parent_id, before, limit):
+        with self.lock:
+            if before:
+                value, child_id = decode_cursor(before)
+                row = self.conn.execute(
+                    f"SELECT rowid FROM {table} WHERE id = ? AND {parent_column} = ?", (child_id, parent_id)
+                ).fetchone()
+                if not row:
+                    return [], None
+                rows = self.conn.execute(
+                    f"SELECT doc FROM {table} WHERE {parent_column} = ? AND ({order_column} < ? OR "
+                    f"({order_column} = ? AND rowid < ?)) ORDER BY {order_column} DESC, rowid DESC LIMIT ?",
+                    (parent_id, value, value, row[0], limit + 1)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    f"SELECT doc FROM {table} WHERE {parent_column} = ? ORDER BY {order_column} DESC, rowid DESC LIMIT ?",
+                    (parent_id, limit + 1)
+                ).fetchall()
+            page = [json.loads(row[0]) for row in reversed(rows[:limit])]
+            return page, (encode_cursor(page[0], order_column) if len(rows) > limit else None)
+
+    # --- Writes ---
+    def insert(self, collection, item):
+        with self.transaction():
+            self._insert(collection, item)
+            return item
+
+    def delete(self, collection, key):
+        with self.transaction():
+            item = self._read_doc(collection, key)
+            field = key_field(collection)
+            self.conn.execute(f"DELETE FROM {collection} WHERE {field} = ?", (key,))
+            child_list = CHILD_LISTS.get(collection)
+            if child_list:
+                self.conn.execute(f"DELETE FROM {child_list} WHERE {PARENT_COLUMN[child_list]} = ?", (key,))
+            if collection == 'chats':
+                self.conn.execute("DELETE FROM chat_participants WHERE chat_id = ?", (key,))
+            return item
+
+    def set(self, path, value):
+        return self._mutate('set', list(path), value)
+
+    def append(self, path, value):
+        return self._mutate('append', list(path), value)
+
+    def remove(self, path, value):
+        return self._mutate('remove', list(path), value)
+
+    def incr(self, path, amount=1):
+        return self._mutate('incr', list(path), amount)
+
+    def _mutate(self, op, path, value):
+        if len(path) < 3:
+            raise StorageError(f"Path {path!r} is too short for {op!r}")
+        collection, key = path[0], path[1]
+        child_list = CHILD_LISTS.get(collection)
+        with self.transaction():
+            if child_list and path[2] == child_list:
+                if len(path) == 3:
+                    if op != 'append':
+                        raise StorageError(f"Only append is supported on {path!r}")
+                    if not self.conn.execute(f"SELECT 1 FROM {collection} WHERE {key_field(collection)} = ?", (key,)).fetchone():
+                        raise StorageError(f"No item {key!r} in {collection!r}")
+                    self._write_row(child_list, value, key)
+                    return value
+                table, doc_key, sub_path, parent_id = child_list, path[3], path[4:], key
+            else:
+                table, doc_key, sub_path, parent_id = collection, key, path[2:], None
+            doc = self._read_doc(table, doc_key)
+            if doc is None:
+                raise StorageError(f"No item {doc_key!r} in {table!r}")
+            result = apply_op(resolve(doc, sub_path[:-1]), sub_path[-1], op, value)
+            self._write_row(table, doc, parent_id)
+            return result
+
+    def record_change(self, change):
+        """Append ``change`` to the change feed and return its version"""
+        with self.transaction():
+            # sqlite_sequence keeps counting after rows are pruned or replace() empties the table
+            version = self.version() + 1
+            self.conn.execute("INSERT INTO changes (version, doc) VALUES (?, ?)",
+                              (version, json.dumps(dict(change, version=version), ensure_ascii=False)))
+            if version % 1000 == 0:
+                self.conn.execute("DELETE FROM changes WHERE version <= ?", (version - CHANGE_RETENTION,))
+            return version
+
+    def replace(self, data):
+        with self.transaction():
+            for table in ('users', 'chats', 'chat_participants', 'messages', 'clips', 'comments', 'blogs', 'changes'):
+                self.conn.execute(f"DELETE FROM {table}")
+            for collection in COLLECTIONS:
+                for item in data.get(collection, []):
+                    self._insert(collection, item)
+
+    def compact(self):
+        with self.lock:
+            blocking(self.offload, self.conn.execute, 'PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self.lock:
+            self._conn.close()
+
+
+def open_store(backend, json_path, sqlite_path, metrics=None, offload=None, **options):
+    """Create the storage backend named by ``backend`` ('json' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteStore(sqlite_path, metrics=metrics, offload=offload)
+    if backend == 'json':
+        return DocumentStore(json_path, metrics=metrics, offload=offload, **options)
+    raise StorageError(f"Unknown storage backend {backend!r}")
+
+
+def migrate_json_to_sqlite(sqlite_path, userbase_path, extra_paths=()):
+    """One-shot import of userbase.json plus the standalone chats.json/blogs.json files"""
+    with open(userbase_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    data.pop(SEQ_KEY, None)
+    for path in extra_paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            extra = json.load(f)
+        for collection in COLLECTIONS:
+            known = {item.get(key_field(collection)) for item in data.setdefault(collection, [])}
+            data[collection].extend(item for item in extra.get(collection, []) if item.get(key_field(collection)) not in known)
+    store = SQLiteStore(sqlite_path)
+    store.replace(data)
+    store.close()
+    return {collection: len(data.get(collection, [])) for collection in COLLECTIONS}
+
+
+if __name__ == '__main__':
+    # Usage: python storage.py migrate [sqlite_path]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate [sqlite_path]")
+        sys.exit(1)
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.join('database', 'connectra.db')
+    counts = migrate_json_to_sqlite(
+        target,
+        os.path.join('database', 'userbase.json'),
+        [os.path.join('database', 'chats.json'), os.path.join('database', 'blogs.json')]
+    )
+    print(f"Migrated into {target}: " + ', '.join(f"{n} {c}" for c, n in counts.items()))
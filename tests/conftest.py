@@ -0,0 +1,34 @@
+"""Shared fixtures: main.py imported once in a scratch working directory"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    """main.py imported in an empty working directory with one user and the global chat"""
+    workdir = tmp_path_factory.mktemp('connectra')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs('database')
+    with open(os.path.join('database', 'userbase.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'users': [{'id': 'tester', 'username': 'tester', 'email': 'tester@example.com',
+                       'password': hashlib.sha256(b'pw').hexdigest(), 'display_name': 'Tester'}],
+            'chats': [{'id': 'global', 'name': 'Global Chat', 'type': 'public', 'participants': [], 'messages': []}],
+            'clips': [], 'blogs': []
+        }, f)
+    if os.environ.get('CONNECTRA_STORAGE', 'json').lower() == 'sqlite':
+        subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'storage.py'), 'migrate'], check=True, stdout=subprocess.DEVNULL)
+    import main
+    yield main
+    main.store.close()
+    os.chdir(previous)
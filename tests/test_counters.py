@@ -0,0 +1,69 @@
+"""Counter buffer: increments are coalesced per worker and none are lost across flushes."""
+
+import pytest
+
+from counters import CounterBuffer
+from storage import DocumentStore, StorageError
+
+VIEWS = ('clips', 'c1', 'views')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DocumentStore(str(tmp_path / 'userbase.json'), compact_every=0)
+    store.insert('clips', {'id': 'c1', 'title': 'clip', 'created_at': '2025-01-01T00:00:00', 'views': 5, 'comments': []})
+    yield store
+    store.close()
+
+
+def log_records(store):
+    with open(store.wal_path, 'rb') as f:
+        return len(f.read().splitlines())
+
+
+def test_increments_are_coalesced_into_one_write(store):
+    counters = CounterBuffer(store, interval=60, threshold=1000)
+    for n in range(1, 101):
+        # The caller sees its own view counted before anything is written
+        assert counters.incr(VIEWS, current=5) == 5 + n
+    assert store.get('clips', 'c1')['views'] == 5
+    assert counters.pending_for(VIEWS) == 100
+
+    records = log_records(store)
+    counters.flush()
+    assert log_records(store) == records + 1
+    assert store.get('clips', 'c1')['views'] == 105
+    assert counters.pending_for(VIEWS) == 0
+
+
+def test_threshold_flushes_early(store):
+    counters = CounterBuffer(store, interval=60, threshold=10)
+    for _ in range(25):
+        counters.incr(VIEWS)
+    assert store.get('clips', 'c1')['views'] == 25
+    assert counters.pending_for(VIEWS) == 5
+
+
+def test_failed_flush_keeps_deltas(store, monkeypatch):
+    counters = CounterBuffer(store, interval=60)
+    counters.incr(VIEWS, amount=3)
+
+    def broken(*args):
+        raise OSError('disk full')
+
+    with monkeypatch.context() as m:
+        m.setattr(store, 'incr', broken)
+        counters.flush()
+    counters.incr(VIEWS, amount=2)
+    counters.flush()
+    assert store.get('clips', 'c1')['views'] == 10
+
+
+def test_deleted_clip_is_skipped(store):
+    counters = CounterBuffer(store, interval=60)
+    counters.incr(('clips', 'gone', 'views'))
+    counters.incr(VIEWS)
+    counters.flush()
+    assert store.get('clips', 'c1')['views'] == 6
+    with pytest.raises(StorageError):
+        store.incr(('clips', 'gone', 'views'))
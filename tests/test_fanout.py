@@ -0,0 +1,151 @@
+"""IPC fan-out: an emit on one worker reaches clients on the others, and survives the broker restarting."""
+
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import socketio
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+ROOM = 'fanout-room'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port, queue):
+    """One eventlet Socket.IO worker sharing ``queue``, as gunicorn runs them"""
+    import eventlet
+    eventlet.monkey_patch()
+    from fanout import socketio_options
+
+    sio = socketio.Server(async_mode='eventlet', **socketio_options(queue))
+
+    @sio.on('join')
+    def join(sid, data):
+        sio.enter_room(sid, ROOM)
+        return True
+
+    @sio.on('fire')
+    def fire(sid, data):
+        sio.emit('tick', {'port': port, 'n': data['n']}, room=ROOM)
+        return True
+
+    eventlet.wsgi.server(eventlet.listen(('127.0.0.1', port)), socketio.WSGIApp(sio), log_output=False)
+
+
+def start_broker(path):
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a killed broker
+    broker = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'fanout.py'), path])
+    deadline = time.time() + 10
+    while not os.path.exists(path):
+        assert time.time() < deadline, 'broker did not come up'
+        time.sleep(0.05)
+    return broker
+
+
+class Listener:
+    """Socket.IO client (long-polling, so no websocket package is needed) collecting the room's ticks"""
+
+    def __init__(self, port):
+        self.ticks = []
+        self.arrived = threading.Condition()
+        self.client = socketio.Client()
+        self.client.on('tick', self.on_tick)
+        deadline = time.time() + 20
+        while True:
+            try:
+                self.client.connect(f"http://127.0.0.1:{port}", transports=['polling'])
+                break
+            except socketio.exceptions.ConnectionError:
+                assert time.time() < deadline, f"worker on port {port} did not come up"
+                time.sleep(0.1)
+        self.client.call('join', {})
+
+    def on_tick(self, data):
+        with self.arrived:
+            self.ticks.append((data['port'], data['n']))
+            self.arrived.notify_all()
+
+    def wait_for(self, tick, timeout=10):
+        with self.arrived:
+            return self.arrived.wait_for(lambda: tick in self.ticks, timeout)
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    """A broker and two workers; yields (broker path, [broker process], ports)"""
+    path = str(tmp_path / 'broker.sock')
+    brokers = [start_broker(path)]
+    ports = [free_port() for _ in range(2)]
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=serve, args=(port, f"ipc://{path}"), daemon=True) for port in ports]
+    for worker in workers:
+        worker.start()
+    try:
+        yield path, brokers, ports
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for broker in brokers:
+            broker.terminate()
+            broker.wait()
+
+
+def test_emit_reaches_other_worker(cluster):
+    path, brokers, ports = cluster
+    first, second = Listener(ports[0]), Listener(ports[1])
+    try:
+        time.sleep(0.5)  # let each worker's listener subscribe
+        first.client.call('fire', {'n': 1})
+        second.client.call('fire', {'n': 2})
+        for listener in (first, second):
+            assert listener.wait_for((ports[0], 1))
+            assert listener.wait_for((ports[1], 2))
+        time.sleep(0.3)
+        # The publishing worker hears its own frame back once, not twice
+        assert sorted(first.ticks) == sorted(second.ticks) == sorted([(ports[0], 1), (ports[1], 2)])
+    finally:
+        first.client.disconnect()
+        second.client.disconnect()
+
+
+def test_workers_reconnect_after_broker_restart(cluster):
+    path, brokers, ports = cluster
+    first, second = Listener(ports[0]), Listener(ports[1])
+    try:
+        time.sleep(0.5)
+        first.client.call('fire', {'n': 0})
+        assert second.wait_for((ports[0], 0))
+
+        brokers[0].kill()
+        brokers[0].wait()
+        # Publishing with the broker gone is logged, not raised: the worker keeps serving its clients
+        assert first.client.call('fire', {'n': 1}, timeout=10) is True
+
+        brokers.append(start_broker(path))
+        # Subscribers retry after 1s, then 2s; keep firing until the relay is back
+        deadline = time.time() + 20
+        n = 2
+        while True:
+            first.client.call('fire', {'n': n})
+            if second.wait_for((ports[0], n), timeout=0.5):
+                break
+            assert time.time() < deadline, 'fan-out did not recover after the broker restarted'
+            n += 1
+        # Both directions work again
+        second.client.call('fire', {'n': 100})
+        assert first.wait_for((ports[1], 100))
+    finally:
+        first.client.disconnect()
+        second.client.disconnect()
@@ -0,0 +1,34 @@
+"""Guest pages: built from the shallow store lists and the authors cache, never from a full load_db()."""
+
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    def whole_store():
+        raise AssertionError('load_db() on a guest page')
+    monkeypatch.setattr(main, 'load_db', whole_store)
+    main.page_cache.clear()
+    return main.app.test_client()
+
+
+def test_guest_home_counts_messages(main, client):
+    main.store.append(('chats', 'global', 'messages'), {'id': str(uuid.uuid4()), 'username': 'tester', 'content': 'hi',
+                                                        'timestamp': '2025-01-01T00:00:00'})
+    count = len(main.store.get('chats', 'global')['messages'])
+    response = client.get('/guest/home')
+    assert response.status_code == 200
+    assert f"{count} messages" in response.get_data(as_text=True)
+
+
+def test_guest_blog_shows_authors(main, client):
+    main.store.set(('users', 'tester', 'avatar'), 'tester_face.png')
+    main.authors.forget('tester')
+    main.store.insert('blogs', {'id': str(uuid.uuid4()), 'title': 'Guest post', 'content': 'words', 'author': 'tester',
+                                'created_at': '2025-01-01T00:00:00', 'updated_at': ''})
+    response = client.get('/guest/blog')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'Guest post' in body and '/photos/tester_face.png' in body
@@ -0,0 +1,51 @@
+"""Identity maps: case-insensitive email and username lookups stay current, and usernames are never handed out twice."""
+
+import pytest
+
+from storage import DocumentStore, SQLiteStore
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        store = SQLiteStore(str(tmp_path / 'connectra.db'))
+    else:
+        store = DocumentStore(str(tmp_path / 'userbase.json'))
+    store.insert('users', {'id': 'ann', 'username': 'Ann', 'email': 'Ann@Example.com'})
+    yield store
+    store.close()
+
+
+def test_email_lookup_follows_changes(store):
+    assert store.find_user_by_email('ann@example.COM')['username'] == 'Ann'
+    assert store.find_user_by_email('') is None
+
+    store.set(('users', 'Ann', 'email'), 'ann@new.example')
+    assert store.find_user_by_email('ann@example.com') is None
+    assert store.find_user_by_email('ANN@new.example')['username'] == 'Ann'
+
+    store.delete('users', 'Ann')
+    assert store.find_user_by_email('ann@new.example') is None
+    assert store.find_users({'ann'}) == {}
+
+
+def test_unique_username(store):
+    assert store.unique_username('bob') == 'bob'
+    # Taken whatever the case
+    assert store.unique_username('ann') == 'ann1'
+    with store.transaction():
+        store.insert('users', {'id': 'ann1', 'username': store.unique_username('ANN'), 'email': 'a1@example.com'})
+    with store.transaction():
+        store.insert('users', {'id': 'ann2', 'username': store.unique_username('ann'), 'email': 'a2@example.com'})
+    assert sorted(store.find_users({'ann', 'ann1', 'ann2'})) == ['ann', 'ann1', 'ann2']
+    assert store.unique_username('ann') == 'ann3'
+
+
+def test_counter_skips_names_taken_elsewhere(store):
+    assert store.unique_username('cy') == 'cy'
+    store.insert('users', {'id': 'cy', 'username': 'cy', 'email': 'cy@example.com'})
+    assert store.unique_username('cy') == 'cy1'
+    # Another worker took cy1 and cy2 behind this worker's counter
+    store.insert('users', {'id': 'cy1', 'username': 'cy1', 'email': 'cy1@example.com'})
+    store.insert('users', {'id': 'cy2', 'username': 'Cy2', 'email': 'cy2@example.com'})
+    assert store.unique_username('cy') == 'cy3'
@@ -0,0 +1,97 @@
+"""Media jobs: failed ffmpeg steps clean up, finished steps are kept, and a job that gives up marks its clip."""
+
+import os
+import subprocess
+import tempfile
+import uuid
+
+import pytest
+
+import mediajobs
+
+
+@pytest.fixture
+def broken_ffmpeg(monkeypatch):
+    """ffmpeg 'installed' but failing; returns the temporary files it was given"""
+    created = []
+    mkstemp = tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+        fd, path = mkstemp(*args, **kwargs)
+        created.append(path)
+        return fd, path
+
+    def run(args, **kwargs):
+        raise subprocess.CalledProcessError(1, args)
+
+    monkeypatch.setattr(mediajobs.shutil, 'which', lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(mediajobs.tempfile, 'mkstemp', recording_mkstemp)
+    monkeypatch.setattr(mediajobs.subprocess, 'run', run)
+    return created
+
+
+@pytest.mark.parametrize('step', [lambda: mediajobs.make_poster('clip.mp4', 10), lambda: mediajobs.make_rendition('clip.mp4')])
+def test_failed_ffmpeg_leaves_no_temp_file(broken_ffmpeg, step):
+    with pytest.raises(subprocess.CalledProcessError):
+        step()
+    assert len(broken_ffmpeg) == 1
+    assert not os.path.exists(broken_ffmpeg[0])
+
+
+@pytest.fixture
+def clip(main):
+    clip_id = str(uuid.uuid4())
+    main.store.insert('clips', {
+        'id': clip_id, 'title': 'job test', 'video_filename': f"{clip_id}.mp4", 'thumbnail': None, 'rendition': None,
+        'author': 'tester', 'created_at': '2025-01-01T00:00:00', 'views': 0, 'likes': 0, 'comments': [],
+        'duration': 0, 'width': None, 'height': None, 'status': 'ready', 'media_status': 'queued'
+    })
+    return clip_id
+
+
+def test_poster_kept_when_rendition_fails(main, clip, monkeypatch):
+    def poster(source, duration):
+        fd, path = tempfile.mkstemp(suffix='.jpg')
+        os.write(fd, b'jpeg')
+        os.close(fd)
+        return path
+
+    def failing_rendition(source):
+        raise subprocess.CalledProcessError(1, 'ffmpeg')
+
+    monkeypatch.setattr(main, 'probe', lambda source: {'duration': 12.5, 'width': 640, 'height': 360})
+    monkeypatch.setattr(main, 'make_poster', poster)
+    monkeypatch.setattr(main, 'make_rendition', failing_rendition)
+    with pytest.raises(RuntimeError, match='rendition'):
+        main.process_clip_job({'clip_id': clip})
+    record = main.store.get('clips', clip, shallow=True)
+    assert (record['duration'], record['thumbnail'], record['rendition']) == (12.5, f"{clip}_thumb.jpg", None)
+    assert record['media_status'] == 'queued'
+
+    # The retry only renders what is missing
+    def unexpected(*args):
+        raise AssertionError('step repeated')
+
+    monkeypatch.setattr(main, 'probe', unexpected)
+    monkeypatch.setattr(main, 'make_poster', unexpected)
+    monkeypatch.setattr(main, 'make_rendition', lambda source: None)
+    main.process_clip_job({'clip_id': clip})
+    assert main.store.get('clips', clip, shallow=True)['media_status'] == 'ready'
+
+
+def test_clip_marked_failed_when_job_gives_up(main, clip, tmp_path):
+    queue = mediajobs.JobQueue(str(tmp_path / 'jobs.db'))
+    queue.enqueue('clip', {'clip_id': clip})
+    since = main.store.version()
+    attempts = []
+
+    def failing_job(payload):
+        attempts.append(payload)
+        raise RuntimeError('rendition: ffmpeg exited with 1')
+
+    mediajobs.run_worker(queue, {'clip': failing_job}, once=True, give_up={'clip': main.fail_clip_job})
+    assert len(attempts) == mediajobs.MAX_ATTEMPTS
+    assert queue.counts() == {'failed': 1}
+    assert main.store.get('clips', clip, shallow=True)['media_status'] == 'failed'
+    changes, _ = main.store.changes_since(since)
+    assert any(change['kind'] == 'clip' and change['key'] == clip for change in changes)
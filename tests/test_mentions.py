@@ -0,0 +1,28 @@
+"""Mentions: one pass over the message, case-insensitive, whole names only, each user once."""
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def users(main):
+    for username in ('dolan', 'dolanp'):
+        main.store.insert('users', {'id': username, 'username': username, 'email': f"{username}@example.com"})
+
+
+def span(username):
+    return f'<span class="mention" data-user="{username}">@{username}</span>'
+
+
+def test_mentions_resolve_whole_names(main, users):
+    content, mentioned = main.process_mentions('@dolanp meet @Dolan, cc @dolan and @nobody')
+    assert content == f"{span('dolanp')} meet {span('dolan')}, cc {span('dolan')} and @nobody"
+    assert sorted(mentioned) == ['dolan', 'dolanp']
+
+
+def test_message_without_known_names_is_untouched(main, users):
+    assert main.process_mentions('mail me at someone@example.com @nobody') == ('mail me at someone@example.com @nobody', [])
+
+
+def test_find_users_is_case_insensitive(main, users):
+    found = main.store.find_users({'DOLAN', 'dolanP', 'nobody'})
+    assert {name: user['username'] for name, user in found.items()} == {'dolan': 'dolan', 'dolanp': 'dolanp'}
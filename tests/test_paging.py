@@ -0,0 +1,88 @@
+"""Cursor paging: walking back through history visits every item once, even while new ones arrive."""
+
+import pytest
+
+from storage import DocumentStore, SQLiteStore
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        store = SQLiteStore(str(tmp_path / 'connectra.db'))
+    else:
+        store = DocumentStore(str(tmp_path / 'userbase.json'))
+    yield store
+    store.close()
+
+
+def message(n):
+    # Pairs of messages share a timestamp, so the cursor has to break ties by id
+    return {'id': f"m{n:03d}", 'username': 'ann', 'content': f"message {n}", 'timestamp': f"2025-01-01T00:{n // 2:02d}:00"}
+
+
+def walk(fetch, between=lambda: None):
+    """Follow ``fetch(before)`` from the newest page back to the first; returns the pages' ids, newest page first"""
+    pages = []
+    items, cursor = fetch(None)
+    pages.append([item['id'] for item in items])
+    while cursor:
+        between()
+        items, cursor = fetch(cursor)
+        pages.append([item['id'] for item in items])
+    return pages
+
+
+def test_message_pages_neither_overlap_nor_skip(store):
+    store.insert('chats', {'id': 'global', 'type': 'public', 'participants': [], 'messages': []})
+    for n in range(45):
+        store.append(('chats', 'global', 'messages'), message(n))
+    arrivals = iter(range(45, 100))
+
+    def new_message():
+        store.append(('chats', 'global', 'messages'), message(next(arrivals)))
+
+    pages = walk(lambda before: store.messages('global', before=before, limit=10), between=new_message)
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 5]
+    # Each page is oldest first; concatenated newest page last they are the history before the walk began
+    assert [item for page in reversed(pages) for item in page] == [f"m{n:03d}" for n in range(45)]
+
+
+def test_unknown_cursor_is_an_empty_page(store):
+    from storage import encode_cursor
+    store.insert('chats', {'id': 'global', 'type': 'public', 'participants': [], 'messages': [message(0)]})
+    assert store.messages('global', before=encode_cursor({'id': 'gone', 'timestamp': '2025'})) == ([], None)
+
+
+def clip(n):
+    return {'id': f"c{n:03d}", 'title': f"clip {n}", 'author': 'ann', 'created_at': f"2025-01-01T00:{n // 2:02d}:00",
+            'views': 0, 'likes': 0, 'comments': []}
+
+
+def test_clip_pages_neither_overlap_nor_skip(store):
+    for n in range(25):
+        store.insert('clips', clip(n))
+    arrivals = iter(range(25, 60))
+
+    pages = walk(lambda before: store.clips_page(before=before, limit=10), between=lambda: store.insert('clips', clip(next(arrivals))))
+    # Newest first throughout; clips posted during the walk sort above its cursor and are not seen
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [item for page in pages for item in page] == [f"c{n:03d}" for n in reversed(range(25))]
+
+
+def test_comment_pages_neither_overlap_nor_skip(store):
+    store.insert('clips', clip(0))
+    for n in range(25):
+        store.append(('clips', 'c000', 'comments'), {'id': f"k{n:03d}", 'author': 'ann', 'content': f"comment {n}",
+                                                       'created_at': f"2025-01-02T00:{n // 2:02d}:00"})
+    arrivals = iter(range(25, 60))
+
+    def new_comment():
+        n = next(arrivals)
+        store.append(('clips', 'c000', 'comments'), {'id': f"k{n:03d}", 'author': 'ann', 'content': f"comment {n}",
+                                                       'created_at': f"2025-01-02T00:{n // 2:02d}:00"})
+
+    pages = walk(lambda before: store.comments('c000', before=before, limit=10), between=new_comment)
+    assert [item for page in reversed(pages) for item in page] == [f"k{n:03d}" for n in range(25)]
+    # The id index answers single-comment lookups too
+    assert store.find_comment('k007') == ('c000', {'id': 'k007', 'author': 'ann', 'content': 'comment 7',
+                                                    'created_at': '2025-01-02T00:03:00'})
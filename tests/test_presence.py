@@ -0,0 +1,67 @@
+"""Presence: a user goes offline only after the grace period, and a quick reconnect is not reported at all."""
+
+import time
+import types
+
+import pytest
+
+import presence
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """presence.time with a hand-wound wall clock"""
+    now = [1000000.0]
+    monkeypatch.setattr(presence, 'time', types.SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic, sleep=time.sleep))
+    return now
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = presence.PresenceTracker(str(tmp_path / 'presence.db'), grace=10, interval=0)
+    yield tracker
+    tracker.close()
+
+
+def test_flap_inside_grace_is_not_reported(tracker, clock):
+    tracker.connect('ann')
+    assert tracker.tick() == {'ann': True}
+
+    # A page reload: the socket goes and comes back before the grace period ends
+    tracker.disconnect('ann')
+    assert tracker.tick() == {}
+    clock[0] += 5
+    tracker.connect('ann')
+    assert tracker.tick() == {}
+    clock[0] += 20
+    assert tracker.tick() == {}
+    assert tracker.is_online('ann')
+    assert tracker.take_last_seen() == {}
+
+
+def test_offline_after_grace(tracker, clock):
+    tracker.connect('ann')
+    tracker.tick()
+    tracker.disconnect('ann')
+    left = clock[0]
+    tracker.tick()
+    clock[0] += 9
+    assert tracker.tick() == {}
+    assert tracker.is_online('ann')
+
+    clock[0] += 1
+    assert tracker.tick() == {'ann': False}
+    assert not tracker.is_online('ann')
+    # Last seen is when the socket went away, not when the grace period ran out
+    assert tracker.take_last_seen() == {'ann': presence.datetime.fromtimestamp(left).isoformat()}
+    assert tracker.tick() == {}
+
+
+def test_user_with_two_tabs_stays_online(tracker, clock):
+    tracker.connect('ann')
+    tracker.connect('ann')
+    assert tracker.tick() == {'ann': True}
+    tracker.disconnect('ann')
+    clock[0] += 60
+    assert tracker.tick() == {}
+    assert tracker.online_users() == {'ann'}
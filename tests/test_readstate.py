@@ -0,0 +1,55 @@
+"""Read state: unread counts per member, forward-only read positions, receipts and the one-time import."""
+
+import pytest
+
+from readstate import ReadState
+
+
+@pytest.fixture
+def reads(tmp_path):
+    state = ReadState(str(tmp_path / 'readstate.db'))
+    state.add_chat('dm', ['ann', 'bob'])
+    state.add_chat('global')
+    return state
+
+
+def test_unread_counts_and_receipts(reads):
+    assert reads.posted('dm', 'm1', 'ann') == 1
+    reads.posted('dm', 'm2', 'ann')
+    assert (reads.unread_count('ann', 'dm'), reads.unread_count('bob', 'dm')) == (0, 2)
+    # Posting moves the author's own position past everything before it
+    reads.posted('dm', 'm3', 'bob')
+    assert (reads.unread_count('ann', 'dm'), reads.unread_count('bob', 'dm')) == (1, 0)
+    assert reads.receipts('dm', ['ann', 'bob', 'cy']) == {'ann': 'm2', 'bob': 'm3'}
+
+    assert reads.mark_read('ann', {'dm': 'm3'}) == {'dm': 0}
+    # A late read of an older message does not move the position back
+    assert reads.mark_read('ann', {'dm': 'm1'}) == {'dm': 0}
+    assert reads.receipts('dm', ['ann']) == {'ann': 'm3'}
+
+
+def test_public_chat_starts_where_it_is_first_seen(reads):
+    for n in range(5):
+        reads.posted('global', f"g{n}", 'bob')
+    # History from before cy first looked is not unread
+    assert reads.inbox('cy') == {'global': 0}
+    reads.posted('global', 'g5', 'bob')
+    assert reads.inbox('cy') == {'global': 1}
+    assert reads.mark_read('cy', {'global': None}) == {'global': 0}
+
+    # Other people's direct chats never show up
+    assert 'dm' not in reads.inbox('cy')
+    assert reads.inbox('ann') == {'dm': 0, 'global': 0}
+
+
+def test_import_marks_direct_chats_read(tmp_path):
+    state = ReadState(str(tmp_path / 'readstate.db'))
+    chats = [{'id': 'dm', 'type': 'direct', 'participants': ['ann', 'bob'], 'messages': [{'id': 'm1'}, {'id': 'm2'}]},
+             {'id': 'global', 'type': 'public', 'participants': [], 'messages': [{'id': 'g1'}]}]
+    assert state.needs_import()
+    assert state.import_chats(chats) == 2
+    assert state.import_chats(chats) == 0
+    assert state.inbox('bob') == {'dm': 0, 'global': 0}
+    state.posted('dm', 'm3', 'ann')
+    assert state.unread_count('bob', 'dm') == 1
+    assert state.receipts('dm', ['ann', 'bob']) == {'ann': 'm3', 'bob': 'm2'}
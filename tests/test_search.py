@@ -0,0 +1,60 @@
+"""Search: direct-chat messages are only found by their participants, and results page newest first."""
+
+import pytest
+
+from search import SearchIndex
+
+DM = {'id': 'dm_ann_bob', 'type': 'direct', 'participants': ['ann', 'bob']}
+GLOBAL = {'id': 'global', 'type': 'public', 'participants': []}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.add_message(DM, {'id': 'm1', 'username': 'ann', 'content': 'the secret plan', 'timestamp': '2025-01-01T00:00:00'})
+    index.add_message(GLOBAL, {'id': 'm2', 'username': 'cy', 'content': 'a public plan', 'timestamp': '2025-01-02T00:00:00'})
+    return index
+
+
+def found(index, query, username, **kwargs):
+    return [result['id'] for result in index.search(query, username, **kwargs)[0]]
+
+
+def test_direct_message_hidden_from_third_user(index):
+    assert found(index, 'plan', 'ann') == ['m2', 'm1']
+    assert found(index, 'secret', 'BOB') == ['m1']
+    assert found(index, 'plan', 'cy') == ['m2']
+    assert found(index, 'secret', 'cy') == []
+    # Query syntax is tokenized away, so it cannot widen the access clause
+    assert found(index, 'secret" OR access : "ua', 'cy') == []
+    assert found(index, 'secret OR plan', 'cy') == []
+
+
+def test_usernames_cannot_borrow_access(index):
+    # Tokens are the hex of the whole name: no prefix of a participant's name matches
+    assert found(index, 'secret', 'an') == []
+    assert found(index, 'secret', 'ann bob') == []
+
+
+def test_reindexed_chat_keeps_access(index):
+    # A message edited in place is re-added with the same access tokens
+    index.add_message(DM, {'id': 'm1', 'username': 'ann', 'content': 'the new secret', 'timestamp': '2025-01-01T00:00:00'})
+    assert found(index, 'new secret', 'bob') == ['m1']
+    assert found(index, 'new secret', 'cy') == []
+    index.remove('message', 'm1')
+    assert found(index, 'secret', 'ann') == []
+
+
+def test_pages_neither_overlap_nor_skip(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.add_messages(GLOBAL, [{'id': f"m{n:02d}", 'content': f"hello {n}", 'timestamp': f"2025-01-01T00:00:{n:02d}"}
+                                for n in range(25)])
+    seen = []
+    results, cursor = index.search('hello', 'ann', limit=10)
+    seen += [result['id'] for result in results]
+    while cursor:
+        index.add_message(GLOBAL, {'id': f"late{len(seen)}", 'content': 'hello again'})
+        results, cursor = index.search('hello', 'ann', before=cursor, limit=10)
+        seen += [result['id'] for result in results]
+    assert seen == [f"m{n:02d}" for n in reversed(range(25))]
+    assert found(index, 'hel', 'ann', scope='blog') == []
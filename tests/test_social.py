@@ -0,0 +1,69 @@
+"""Social graph: counts follow the edges, follower lists page without overlap, old user lists import once."""
+
+import pytest
+
+from social import SocialGraph
+
+
+@pytest.fixture
+def graph(tmp_path):
+    return SocialGraph(str(tmp_path / 'social.db'))
+
+
+def test_follow_and_unfollow_keep_counts(graph):
+    assert graph.follow('ann', 'bob')
+    assert not graph.follow('ann', 'bob')
+    assert graph.toggle('cy', 'bob') == (True, 2, 1)
+    assert graph.is_following('ann', 'bob') and not graph.is_following('bob', 'ann')
+    assert graph.counts('bob') == (2, 0)
+    assert graph.counts_many(['ann', 'bob', 'nobody']) == {'ann': (0, 1), 'bob': (2, 0)}
+    assert graph.following_among('ann', ['bob', 'cy', 'nobody']) == {'bob'}
+
+    assert graph.toggle('cy', 'bob') == (False, 1, 0)
+    assert graph.unfollow('ann', 'bob')
+    assert not graph.unfollow('ann', 'bob')
+    assert graph.counts('bob') == (0, 0)
+
+
+def test_remove_user_fixes_the_other_ends(graph):
+    graph.follow('ann', 'bob')
+    graph.follow('bob', 'cy')
+    graph.follow('cy', 'ann')
+    graph.remove_user('bob')
+    assert graph.counts('bob') == (0, 0)
+    assert graph.counts('ann') == (1, 0)
+    assert graph.counts('cy') == (0, 1)
+    assert graph.followers('cy') == ([], None)
+
+
+def test_follower_pages_neither_overlap_nor_skip(graph, monkeypatch):
+    import social
+    now = [1000.0]
+    monkeypatch.setattr(social.time, 'time', lambda: now[0])
+    for n in range(25):
+        # Pairs share a timestamp, so the cursor has to break ties by name
+        now[0] = 1000.0 + n // 2
+        graph.follow(f"fan{n:02d}", 'bob')
+
+    seen = []
+    names, cursor = graph.followers('bob', limit=10)
+    seen.extend(names)
+    while cursor:
+        # Follows arriving meanwhile are newer than the cursor and do not shift the pages
+        now[0] += 100
+        graph.follow(f"late{len(seen)}", 'bob')
+        names, cursor = graph.followers('bob', before=cursor, limit=10)
+        seen.extend(names)
+    assert seen == [f"fan{n:02d}" for n in reversed(range(25))]
+    assert graph.following('fan03') == (['bob'], None)
+
+
+def test_user_lists_import_once(graph):
+    users = [{'username': 'ann', 'following': ['bob'], 'followers': ['bob']},
+             {'username': 'bob', 'following': ['ann'], 'followers': ['ann', 'cy']}]
+    assert graph.needs_import()
+    # ann->bob and bob->ann appear on both documents; cy->bob only on bob's
+    assert graph.import_user_lists(users) == 3
+    assert not graph.needs_import()
+    assert graph.import_user_lists(users) == 0
+    assert graph.counts('bob') == (2, 1)
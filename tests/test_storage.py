@@ -0,0 +1,201 @@
+"""Storage backends: the JSON snapshot with its write-ahead log, and SQLite."""
+
+import json
+import os
+
+import pytest
+
+from storage import DocumentStore
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return str(tmp_path / 'userbase.json')
+
+
+def fill(store):
+    store.insert('users', {'username': 'ann', 'email': 'ann@example.com', 'bio': ''})
+    store.set(('users', 'ann', 'bio'), 'hello')
+    store.insert('chats', {'id': 'global', 'type': 'public', 'participants': [], 'messages': []})
+    for n in range(3):
+        store.append(('chats', 'global', 'messages'), {'id': f"m{n}", 'content': f"message {n}"})
+
+
+def test_reopen_replays_log(snapshot):
+    store = DocumentStore(snapshot, compact_every=0)
+    fill(store)
+    assert not os.path.exists(snapshot)
+
+    # No close(): the records only exist in the log, as after a crash
+    reopened = DocumentStore(snapshot, compact_every=0)
+    assert reopened.get('users', 'ann')['bio'] == 'hello'
+    assert [m['id'] for m in reopened.get('chats', 'global')['messages']] == ['m0', 'm1', 'm2']
+
+
+def test_torn_tail_is_dropped(snapshot):
+    store = DocumentStore(snapshot, compact_every=0)
+    fill(store)
+    wal_path = f"{snapshot}.wal"
+    good_size = os.path.getsize(wal_path)
+    with open(wal_path, 'ab') as f:
+        f.write(b'{"seq":99,"op":"append","path":["chats","global","mess')
+
+    reopened = DocumentStore(snapshot, compact_every=0)
+    assert os.path.getsize(wal_path) == good_size
+    assert len(reopened.get('chats', 'global')['messages']) == 3
+
+    # The next record starts on a fresh line, so it survives another reopen
+    reopened.append(('chats', 'global', 'messages'), {'id': 'm3', 'content': 'after the crash'})
+    again = DocumentStore(snapshot, compact_every=0)
+    assert [m['id'] for m in again.get('chats', 'global')['messages']] == ['m0', 'm1', 'm2', 'm3']
+
+
+def test_compact_then_reopen(snapshot):
+    store = DocumentStore(snapshot, compact_every=0)
+    fill(store)
+    store.compact()
+    with open(snapshot, encoding='utf-8') as f:
+        assert json.load(f)['users'][0]['bio'] == 'hello'
+    store.set(('users', 'ann', 'bio'), 'after compaction')
+
+    reopened = DocumentStore(snapshot, compact_every=0)
+    assert reopened.get('users', 'ann')['bio'] == 'after compaction'
+    assert len(reopened.get('chats', 'global')['messages']) == 3
+
+
+def test_compacts_every_n_records(snapshot):
+    store = DocumentStore(snapshot, compact_every=2)
+    fill(store)
+    assert os.path.exists(snapshot)
+    reopened = DocumentStore(snapshot)
+    assert reopened.get('users', 'ann')['bio'] == 'hello'
+    assert len(reopened.get('chats', 'global')['messages']) == 3
+
+
+# --- SQLite backend ---
+SAMPLE = {
+    'users': [{'username': 'ann', 'email': 'ann@example.com', 'bio': 'hi'},
+              {'username': 'bob', 'email': 'bob@example.com', 'bio': ''}],
+    'chats': [{'id': 'global', 'name': 'Global Chat', 'type': 'public', 'participants': [],
+               'messages': [{'id': 'm1', 'username': 'ann', 'content': 'hello', 'timestamp': '2025-01-01T00:00:00'}]},
+              {'id': 'dm_ann_bob', 'name': 'DM: ann & bob', 'type': 'direct', 'participants': ['ann', 'bob'],
+               'messages': [{'id': 'm2', 'username': 'bob', 'content': 'psst', 'timestamp': '2025-01-02T00:00:00'}]}],
+    'clips': [{'id': 'c1', 'title': 'Clip', 'author': 'ann', 'created_at': '2025-01-03T00:00:00', 'views': 2, 'likes': 0,
+               'liked_by': [], 'comments': [{'id': 'k1', 'author': 'bob', 'content': 'nice', 'created_at': '2025-01-04T00:00:00'}]}],
+    'blogs': [{'id': 'b1', 'title': 'Post', 'content': 'text', 'author': 'bob'}]
+}
+
+
+def edit(store):
+    store.insert('users', {'username': 'cy', 'email': 'cy@example.com', 'bio': ''})
+    store.set(('users', 'bob', 'bio'), 'changed')
+    store.append(('chats', 'global', 'messages'), {'id': 'm3', 'username': 'cy', 'content': 'new', 'timestamp': '2025-01-05T00:00:00'})
+    store.append(('clips', 'c1', 'liked_by'), 'cy')
+    store.incr(('clips', 'c1', 'views'))
+    store.append(('clips', 'c1', 'comments'), {'id': 'k2', 'author': 'cy', 'content': 'me too', 'created_at': '2025-01-06T00:00:00'})
+    store.delete('blogs', 'b1')
+
+
+def test_sqlite_matches_json_backend(tmp_path):
+    from storage import SQLiteStore, migrate_json_to_sqlite
+    snapshot = str(tmp_path / 'userbase.json')
+    with open(snapshot, 'w', encoding='utf-8') as f:
+        json.dump(SAMPLE, f)
+    migrate_json_to_sqlite(str(tmp_path / 'connectra.db'), snapshot)
+    documents, sqlite = DocumentStore(snapshot), SQLiteStore(str(tmp_path / 'connectra.db'))
+    assert sqlite.load() == documents.load()
+
+    edit(documents)
+    edit(sqlite)
+    assert sqlite.load() == documents.load()
+
+    # replace() writes the whole database back; a fresh connection reads the same thing
+    sqlite.replace(documents.load())
+    sqlite.close()
+    assert SQLiteStore(str(tmp_path / 'connectra.db')).load() == documents.load()
+
+
+def test_sqlite_append_to_missing_parent_raises(tmp_path):
+    from storage import SQLiteStore, StorageError
+    store = SQLiteStore(str(tmp_path / 'connectra.db'))
+    store.replace(SAMPLE)
+    with pytest.raises(StorageError):
+        store.append(('chats', 'nope', 'messages'), {'id': 'orphan', 'content': 'lost'})
+    with pytest.raises(StorageError):
+        store.append(('clips', 'nope', 'comments'), {'id': 'orphan', 'content': 'lost'})
+    assert store.conn.execute("SELECT count(*) FROM messages WHERE id = 'orphan'").fetchone()[0] == 0
+    assert store.conn.execute("SELECT count(*) FROM comments WHERE id = 'orphan'").fetchone()[0] == 0
+
+
+# --- Sharing between processes ---
+def open_shared(backend, tmp_path):
+    from storage import SQLiteStore
+    if backend == 'sqlite':
+        return SQLiteStore(str(tmp_path / 'connectra.db'))
+    return DocumentStore(str(tmp_path / 'userbase.json'), compact_every=25)
+
+
+def count_up(backend, tmp_path, times):
+    store = open_shared(backend, tmp_path)
+    for _ in range(times):
+        with store.transaction():
+            count = store.get('users', 'ann')['count']
+            store.set(('users', 'ann', 'count'), count + 1)
+    store.close()
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_transactions_lose_no_updates_across_processes(backend, tmp_path):
+    import multiprocessing
+    store = open_shared(backend, tmp_path)
+    store.insert('users', {'username': 'ann', 'email': 'ann@example.com', 'count': 0})
+    store.close()
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=count_up, args=(backend, tmp_path, 100)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    assert open_shared(backend, tmp_path).get('users', 'ann')['count'] == 200
+
+
+# --- Change feed ---
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_changes_since_older_than_retained(backend, tmp_path, monkeypatch):
+    import storage
+    monkeypatch.setattr(storage, 'CHANGE_RETENTION', 10)
+    if backend == 'sqlite':
+        store = storage.SQLiteStore(str(tmp_path / 'connectra.db'))
+    else:
+        store = DocumentStore(str(tmp_path / 'userbase.json'), compact_every=0)
+    # SQLite prunes on every thousandth version
+    for n in range(1000):
+        store.record_change({'kind': 'user', 'key': f"u{n}"})
+    version = store.version()
+    assert version == 1000
+
+    changes, current = store.changes_since(version - 3)
+    assert ([change['key'] for change in changes], current) == (['u997', 'u998', 'u999'], version)
+    assert store.changes_since(0) == (None, version)
+    assert store.changes_since(version + 1) == (None, version)
+
+
+def test_sqlite_changes_since_does_not_wait_for_writers(tmp_path):
+    import sqlite3
+    from storage import SQLiteStore
+    store = SQLiteStore(str(tmp_path / 'connectra.db'))
+    store.record_change({'kind': 'user', 'key': 'ann'})
+    store.conn.execute('PRAGMA busy_timeout = 200')
+
+    # Another worker holds the write lock
+    writer = sqlite3.connect(str(tmp_path / 'connectra.db'), isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    writer.execute("INSERT INTO changes (version, doc) VALUES (2, '{}')")
+    try:
+        changes, version = store.changes_since(0)
+        assert ([change['key'] for change in changes], version) == (['ann'], 1)
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
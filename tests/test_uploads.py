@@ -0,0 +1,43 @@
+"""Upload finalize failures: the record must end up 'failed', not 'processing' forever."""
+
+import io
+
+import pytest
+
+import uploads
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(uploads.StagedFile, 'move_to', fail)
+    client = main.app.test_client()
+    client.post('/login', data={'email': 'tester@example.com', 'password': 'pw'})
+    return client
+
+
+def test_attachment_marked_failed(main, client):
+    since = main.store.version()
+    response = client.post('/api/send_message', data={'chat_id': 'global', 'content': 'photo',
+                                                      'file': (io.BytesIO(b'not really a png'), 'a.png')})
+    assert response.status_code == 200
+    main.upload_pipeline.join()
+
+    message = next(m for m in main.store.get('chats', 'global')['messages'] if m['id'] == response.json['id'])
+    assert [attachment['status'] for attachment in message['attachments']] == ['failed']
+    changes, _ = main.store.changes_since(since)
+    assert any(change['kind'] == 'chat' and change['key'] == 'global' for change in changes)
+
+
+def test_clip_marked_failed(main, client):
+    since = main.store.version()
+    response = client.post('/clips/upload', data={'title': 'broken', 'video': (io.BytesIO(b'not really a video'), 'a.mp4')})
+    assert response.status_code == 302
+    main.upload_pipeline.join()
+
+    clip = next(clip for clip in main.load_db()['clips'] if clip['title'] == 'broken')
+    assert clip['status'] == 'failed'
+    assert not main.is_ready(clip)
+    changes, _ = main.store.changes_since(since)
+    assert any(change['kind'] == 'clip' and change['key'] == clip['id'] for change in changes)
@@ -0,0 +1,188 @@
+"""
+Upload handling for Connectra.
+
+Werkzeug normally spools every multipart file into a temporary file and the
+route then copies it a second time with ``file.save()``, inside the request.
+``StreamingRequest`` instead writes each file part straight into a staging
+directory while the form is parsed, hashing and counting the bytes on the way,
+so by the time a route runs the upload is already on disk with its size and
+SHA-256 known.
+
+Routes create their records at once in a ``processing`` state and hand the
+staged file to an ``UploadPipeline``. Its worker threads run the finalize step
+(moving the file into place, and whatever later processing a kind of upload
+needs) and the step itself marks the record ready and emits the update. If
+the step raises, the ``on_failure`` callback given to ``submit`` gets the same
+arguments, so the record can be marked failed instead of staying
+``processing`` for good.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+from flask import Request
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StagedFile:
+    """Write-through upload file that hashes and counts the bytes written to it
+
+    Unless ``move_to`` claims it, the file is deleted when closed, so uploads a
+    route ignores (or a request that fails) leave nothing behind. While ``held``
+    by a pipeline, closing is deferred: the request ends before the upload is
+    finalized.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.claimed = False
+        self.held = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/fileno... for werkzeug's FileStorage
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def move_to(self, destination):
+        """Rename the staged bytes to ``destination`` (same filesystem, no copy)"""
+        self.claimed = True
+        self._file.flush()
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        try:
+            os.replace(self.path, destination)
+        except OSError:
+            # Staging on another device: fall back to a copy
+            shutil.copyfile(self.path, destination)
+            os.unlink(self.path)
+        self._file.close()
+        return destination
+
+    def close(self):
+        if self.held:
+            return
+        if not self._file.closed:
+            self._file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class StreamingRequest(Request):
+    """Flask request whose multipart files stream into ``staging_dir``"""
+    staging_dir = os.path.join('uploads', '.staging')
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return StagedFile(self.staging_dir)
+
+
+def copy_into(stream, staged):
+    stream.seek(0)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        staged.write(chunk)
+    staged.flush()
+
+
+def stage(file_storage, staging_dir=StreamingRequest.staging_dir, offload=None):
+    """The StagedFile behind a werkzeug FileStorage, copying the upload only if it was not streamed
+
+    The copy runs through ``offload`` (an ``offload.Offload``) when one is given.
+    """
+    if isinstance(file_storage.stream, StagedFile):
+        return file_storage.stream
+    staged = StagedFile(staging_dir)
+    if offload:
+        offload.run(copy_into, file_storage.stream, staged)
+    else:
+        copy_into(file_storage.stream, staged)
+    return staged
+
+
+def purge_staging(staging_dir, max_age=3600):
+    """Delete staged parts left behind by a crashed worker"""
+    if not os.path.isdir(staging_dir):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(staging_dir):
+        path = os.path.join(staging_dir, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+class UploadPipeline:
+    """Small pool of worker threads that finalize staged uploads off the request path"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_workers(self):
+        # Threads do not survive fork(); every gunicorn worker starts its own
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.queue = queue.Queue()
+            for n in range(self.workers):
+                threading.Thread(target=self._work, name=f"upload-worker-{n}", daemon=True).start()
+
+    def submit(self, staged, finalize, *args, on_failure=None):
+        """Run ``finalize(staged, *args)`` on a worker; ``staged`` stays on disk until then.
+
+        If it raises, ``on_failure(*args)`` runs next.
+        """
+        self._ensure_workers()
+        staged.held = True
+        self.queue.put((staged, finalize, args, on_failure))
+
+    def _work(self):
+        while True:
+            staged, finalize, args, on_failure = self.queue.get()
+            try:
+                finalize(staged, *args)
+            except Exception:
+                logger.exception('Upload finalize step %s failed', getattr(finalize, '__name__', finalize))
+                if on_failure:
+                    try:
+                        on_failure(*args)
+                    except Exception:
+                        logger.exception('Upload failure step %s failed', getattr(on_failure, '__name__', on_failure))
+            finally:
+                staged.held = False
+                staged.close()
+                self.queue.task_done()
+
+    def join(self):
+        """Block until every submitted upload has been finalized"""
+        if self._pid == os.getpid():
+            self.queue.join()
@@ -0,0 +1,81 @@
+"""
+Cached author lookups for Connectra.
+
+Clips and comments only store their author's username; the display name and
+avatar shown next to them are looked up when a page is rendered, so renames
+and new avatars show up everywhere at once instead of going stale in copies.
+``UserCache`` keeps the public fields of recently seen users per worker so a
+page of comments costs at most one batched ``store.find_users`` for the names
+it has not seen.
+
+Entries are dropped by following the store's change feed: every profile edit
+already records a ``user`` change (``push_user``), and at most every
+``check_interval`` seconds the cache reads the changes since the version it
+last saw and forgets those users. If the feed has moved past what is
+retained, the whole cache is cleared. The cache holds at most ``max_entries``
+users, least recently used first out.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Per-worker ``{username: public fields}`` kept coherent through the change feed"""
+
+    def __init__(self, store, fields=('username', 'display_name', 'avatar'), max_entries=10000, check_interval=1.0):
+        self.store = store
+        self.fields = fields
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.checked = 0.0
+
+    def _sync(self):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked < self.check_interval:
+                return
+            self.checked = now
+            since = self.version
+        if since is None:
+            changes, version = None, self.store.version()
+        else:
+            changes, version = self.store.changes_since(since)
+        with self.lock:
+            if changes is None:
+                self.entries.clear()
+            else:
+                for change in changes:
+                    if change.get('kind') == 'user' and change.get('key'):
+                        self.entries.pop(change['key'].lower(), None)
+            self.version = version
+
+    def get_many(self, usernames):
+        """``{lowercased username: public fields}`` for the users that exist"""
+        self._sync()
+        names = {name.lower() for name in usernames if name}
+        found = {}
+        with self.lock:
+            for name in names:
+                if name in self.entries:
+                    self.entries.move_to_end(name)
+                    found[name] = self.entries[name]
+        missing = names - found.keys()
+        if missing:
+            loaded = {name: {field: user.get(field) for field in self.fields}
+                      for name, user in self.store.find_users(missing).items()}
+            found.update(loaded)
+            with self.lock:
+                self.entries.update(loaded)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return found
+
+    def forget(self, username):
+        """Drop one user now (this worker's own edits need not wait for the next sync)"""
+        with self.lock:
+            self.entries.pop(username.lower(), None)